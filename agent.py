@@ -1,34 +1,37 @@
 import json
 import os, getpass
+import asyncio
 import datetime
-import requests
+import sqlite3
+import threading
 from typing import List, Optional, TypedDict, Dict, Annotated, Literal
 from pydantic import BaseModel, field_validator, ValidationError
-from langchain.chat_models import ChatOpenAI
-from langgraph.graph import StateGraph
-from IPython.display import Image, display
 from langgraph.graph import START, END, StateGraph
-from langgraph.graph.message import add_messages
-from langgraph.prebuilt import tools_condition, ToolNode
 from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, AnyMessage
-from langchain_community.document_loaders import WikipediaLoader
-from langchain_community.tools import TavilySearchResults
+from langchain_core.runnables import RunnableLambda
+
+from cache import LLMCache, response_cache
+from metrics import MetricsCallback, metrics
+from scheduler import scheduler
+import httpclient
+from budget import DOCUMENT_TOKENS, add_windowed_messages, bullet_list, compact_lines, truncate
+from revision import arevise, revise
+from reviews import answer_interactively, request_review
+from lazy import Lazy
+from assets import AssetStore
 
 def _set_env(var: str):
     if not os.environ.get(var):
         os.environ[var] = getpass.getpass(f"{var}: ")
 
-_set_env("OPENAI_API_KEY")
-_set_env("TAVILY_API_KEY")
-
 # =============================================================================
 # DEFINIZIONE DELLO STATO CON VERSIONING E MEMORIA PERSISTENTE
 # =============================================================================
-class VersionedPost(TypedDict):
+class VersionedPost(TypedDict, total=False):
     version: int              # Versione del post
     timestamp: str            # Data/ora della versione salvata
-    content: str              # Testo del post (bozza finale)
+    content: str              # Testo del post (caricato solo su richiesta)
 
 class PostRecord(TypedDict):
     topic: str                # Argomento trattato
@@ -36,7 +39,7 @@ class PostRecord(TypedDict):
     versions: List[VersionedPost]  # Lista delle versioni (per versioning)
 
 class AgentState(TypedDict):
-    messages: Annotated[List[AnyMessage], add_messages]  # Messaggi di input/output
+    messages: Annotated[List[AnyMessage], add_windowed_messages]  # Messaggi di input/output (a finestra)
     prompt: str                   # Messaggio di input dell'utente
     topic: List[str]              # Tema del post attuale
     category: str                 # Categoria: "Review", "How-to", "Evento", ecc.
@@ -44,28 +47,139 @@ class AgentState(TypedDict):
     retrieved_docs: List[str]     # Documenti ottenuti dalla ricerca
     verified_docs: List[str]      # Documenti selezionati dopo verifica
     draft_post: Optional[str]     # Testo della bozza prodotta
+    draft_history: Optional[List[str]]    # Versioni precedenti della bozza (dalla più vecchia)
     human_feedback: Optional[str] # Feedback dell'utente (human-in-the-loop)
+    revision_request: Optional[str]       # Modifiche richieste, ancora da applicare alla bozza
     planning_notes: Optional[str] # Note e report pianificati del processo
     seo_analysis: Optional[str]   # Risultato dell'analisi SEO
     generated_titles: Optional[List[str]]  # Lista di titoli generati
-    media_resources: Optional[List[str]]      # Link a risorse multimediali
-    previous_posts: List[PostRecord]          # Memoria persistente dei post
+    media_resources: Optional[List[str]]      # URL delle immagini in archivio (variante web) o link remoti se il download fallisce
+    post_version: Optional[int]               # Versione salvata nella memoria persistente
 
 MEMORY_FILE = "./blog_memory.json"
+MEMORY_DB = "./blog_memory.sqlite"
+
+class PostMemory:
+    """Memoria persistente dei post, indicizzata per (topic, categoria).
+
+    Ogni salvataggio aggiunge una riga in ``post_versions`` con il numero di
+    versione successivo: nessuna riscrittura dello storico, costo costante per
+    articolo. Gli elenchi di versioni non includono il testo, che si legge
+    con ``content`` solo quando serve. Al primo avvio importa il vecchio
+    ``blog_memory.json``, se presente.
+    """
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT NOT NULL,
+            category TEXT NOT NULL,
+            UNIQUE (topic, category)
+        )""",
+        """CREATE TABLE IF NOT EXISTS post_versions (
+            post_id INTEGER NOT NULL REFERENCES posts(id),
+            version INTEGER NOT NULL,
+            timestamp TEXT NOT NULL,
+            content TEXT NOT NULL,
+            PRIMARY KEY (post_id, version)
+        )""",
+    )
+
+    def __init__(self, db_path: str = MEMORY_DB, legacy_file: str = MEMORY_FILE):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        for statement in self.SCHEMA:
+            self.conn.execute(statement)
+        self._import_legacy(legacy_file)
+
+    @staticmethod
+    def _key(value) -> str:
+        # Il topic può essere una lista (risultati Tavily): la chiave è la sua forma JSON
+        return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+    def _import_legacy(self, legacy_file: str) -> None:
+        if not os.path.exists(legacy_file) or self.conn.execute("SELECT 1 FROM posts LIMIT 1").fetchone():
+            return
+        with open(legacy_file, "r", encoding="utf-8") as f:
+            raw = f.read().strip()
+        for record in json.loads(raw) if raw else []:
+            for v in record["versions"]:
+                self.append(record["topic"], record["category"], v["content"], v["timestamp"])
+
+    def append(self, topic, category, content: str, timestamp: Optional[str] = None) -> VersionedPost:
+        """Aggiunge una nuova versione e restituisce numero e timestamp assegnati."""
+        timestamp = timestamp or datetime.datetime.now().isoformat()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO posts(topic, category) VALUES (?, ?)",
+                (self._key(topic), self._key(category))
+            )
+            post_id = self.conn.execute(
+                "SELECT id FROM posts WHERE topic = ? AND category = ?",
+                (self._key(topic), self._key(category))
+            ).fetchone()[0]
+            self.conn.execute(
+                "INSERT INTO post_versions(post_id, version, timestamp, content) "
+                "SELECT ?, COALESCE(MAX(version), 0) + 1, ?, ? FROM post_versions WHERE post_id = ?",
+                (post_id, timestamp, content, post_id)
+            )
+            version = self.conn.execute(
+                "SELECT MAX(version) FROM post_versions WHERE post_id = ?", (post_id,)
+            ).fetchone()[0]
+        return {"version": version, "timestamp": timestamp}
+
+    def get(self, topic, category) -> Optional[PostRecord]:
+        """Record del post con l'elenco delle versioni, senza il testo."""
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT v.version, v.timestamp FROM posts p
+                   JOIN post_versions v ON v.post_id = p.id
+                   WHERE p.topic = ? AND p.category = ? ORDER BY v.version""",
+                (self._key(topic), self._key(category))
+            ).fetchall()
+        if not rows:
+            return None
+        return {
+            "topic": topic,
+            "category": category,
+            "versions": [{"version": v, "timestamp": ts} for v, ts in rows],
+        }
+
+    def content(self, topic, category, version: Optional[int] = None) -> Optional[str]:
+        """Testo di una versione (l'ultima se ``version`` è None)."""
+        with self.lock:
+            row = self.conn.execute(
+                """SELECT v.content FROM posts p
+                   JOIN post_versions v ON v.post_id = p.id
+                   WHERE p.topic = ? AND p.category = ? AND (? IS NULL OR v.version = ?)
+                   ORDER BY v.version DESC LIMIT 1""",
+                (self._key(topic), self._key(category), version, version)
+            ).fetchone()
+        return row[0] if row else None
+
+# Chiavi, database e client si creano al primo uso (vedi lazy.py): l'import
+# del modulo resta senza effetti collaterali.
+post_memory = Lazy(PostMemory)
+# Immagini scaricate una volta sola e conservate in locale, con le varianti per il web
+asset_store = Lazy(AssetStore)
+
+# Cache LLM per i nodi che ripetono spesso lo stesso prompt (stesse fonti, stesso topic)
+llm_cache = Lazy(lambda: LLMCache(policy={"verify": "exact", "title": "exact", "seo": "exact"}))
+
+def _make_llm():
+    _set_env("OPENAI_API_KEY")
+    from langchain_openai import ChatOpenAI
 
-def load_memory() -> List[PostRecord]:
-    """Carica il file JSON della memoria persistente dei post."""
-    if os.path.exists(MEMORY_FILE):
-        with open(MEMORY_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return []
+    # Limiti RPM/TPM condivisi tramite lo scheduler; i retry su 429/5xx li fa il client OpenAI
+    return ChatOpenAI(model="gpt-4o", temperature=0.8, max_tokens=1500, cache=llm_cache.resolve(),
+                      rate_limiter=scheduler.rate_limiter("openai"), max_retries=6,
+                      callbacks=[scheduler.callback("openai")])
 
-def save_memory(posts: List[PostRecord]) -> None:
-    """Salva la lista dei post (con versioning) su file JSON."""
-    with open(MEMORY_FILE, "w", encoding="utf-8") as f:
-        json.dump(posts, f, indent=4, ensure_ascii=False)
+llm = Lazy(_make_llm)
 
-llm = ChatOpenAI(model="gpt-4o", temperature=0.8, max_tokens=1500)
+def tavily_tool(max_results: int = 3):
+    _set_env("TAVILY_API_KEY")
+    from langchain_community.tools import TavilySearchResults
+    return TavilySearchResults(max_results=max_results)
 
 # =============================================================================
 # AGENTI DEL WORKFLOW
@@ -76,199 +190,310 @@ def tavily_search_ideas_agent(state: AgentState) -> AgentState:
     # Inizializza la ricerca Tavily
     prompt = ( f"Cerca idee per un post nell'ambito gaming di tipo {state['category']}"
               f" e restituisci i risultati in un formato leggibile.\n")
-    tavily = TavilySearchResults(max_results=3)
-    tavily_results = tavily.invoke(state["query"])
+    tavily = tavily_tool(max_results=3)
+    key = {"query": state["query"], "max_results": 3}
+    tavily_results = response_cache.cached(
+        "tavily", key, lambda: scheduler.call("tavily", lambda: tavily.invoke(state["query"]))
+    )
+    return _apply_tavily_ideas(state, tavily_results)
+
+async def atavily_search_ideas_agent(state: AgentState) -> AgentState:
+    tavily = tavily_tool(max_results=3)
+    key = {"query": state["query"], "max_results": 3}
+    tavily_results = await response_cache.acached(
+        "tavily", key, lambda: scheduler.acall("tavily", lambda: tavily.ainvoke(state["query"]))
+    )
+    return _apply_tavily_ideas(state, tavily_results)
+
+# ideas, search, verify e media girano in parallelo con altri nodi: restituiscono
+# solo le chiavi che scrivono, così gli aggiornamenti dello stesso step non collidono.
+def _apply_tavily_ideas(state: AgentState, tavily_results) -> AgentState:
     if tavily_results:
-        state["topic"] = [result["title"] for result in tavily_results]
+        topic = [result["title"] for result in tavily_results]
     else:
-        state["topic"] = ["Nessun risultato trovato."]
+        topic = ["Nessun risultato trovato."]
     print("Risultati della ricerca Tavily:")
-    for result in state["topic"]:
+    for result in topic:
         print(result)
-    state["planning_notes"] += "Risultati della ricerca Tavily:\n"
-    for result in state["topic"]:
-        state["planning_notes"] += f"- {result}\n"
-    return state
+    notes = state["planning_notes"] + "Risultati della ricerca Tavily:\n"
+    for result in topic:
+        notes += f"- {result}\n"
+    return {"topic": topic, "planning_notes": notes}
 
 # 2. Agente di Web Search per la ricerca di fonti
+BING_URL = "https://api.bing.microsoft.com/v7.0/search"
+BING_HEADERS = {"Ocp-Apim-Subscription-Key": "YOUR_BING_API_KEY"}  # Sostituire con la chiave reale
+
+def _bing_params(state: AgentState) -> dict:
+    return {"q": state["query"], "count": 5, "mkt": "it-IT"}
+
+def _parse_bing(data: dict) -> List[str]:
+    docs = []
+    # Estrae alcuni dettagli per ciascun risultato
+    for result in data.get("webPages", {}).get("value", []):
+        titolo = result.get("name", "")
+        estratto = result.get("snippet", "")
+        url = result.get("url", "")
+        docs.append(f"{titolo}: {estratto} [Link: {url}]")
+    return docs
+
 def web_search_agent(state: AgentState) -> AgentState:
-    headers = {"Ocp-Apim-Subscription-Key": "YOUR_BING_API_KEY"}  # Sostituire con la chiave reale
-    params = {"q": state["query"], "count": 5, "mkt": "it-IT"}
+    params = _bing_params(state)
     try:
-        response = requests.get("https://api.bing.microsoft.com/v7.0/search", headers=headers, params=params)
-        response.raise_for_status()
-        data = response.json()
+        data = response_cache.cached(
+            "bing", params, lambda: scheduler.call("bing", lambda: httpclient.get_json(BING_URL, BING_HEADERS, params))
+        )
+        docs = _parse_bing(data)
+    except Exception as e:
+        # Errore definitivo (dopo i retry): nessuna fonte, non un messaggio d'errore come fonte
+        print(f"[WARN] Ricerca web non riuscita: {e}")
         docs = []
-        # Estrae alcuni dettagli per ciascun risultato
-        for result in data.get("webPages", {}).get("value", []):
-            titolo = result.get("name", "")
-            estratto = result.get("snippet", "")
-            url = result.get("url", "")
-            docs.append(f"{titolo}: {estratto} [Link: {url}]")
-        state["retrieved_docs"] = docs
+    return {"retrieved_docs": docs}
+
+async def aweb_search_agent(state: AgentState) -> AgentState:
+    params = _bing_params(state)
+    try:
+        data = await response_cache.acached(
+            "bing", params, lambda: scheduler.acall("bing", lambda: httpclient.aget_json(BING_URL, BING_HEADERS, params))
+        )
+        docs = _parse_bing(data)
     except Exception as e:
-        state["retrieved_docs"] = [f"Errore durante la ricerca web: {str(e)}"]
-    return state
+        print(f"[WARN] Ricerca web non riuscita: {e}")
+        docs = []
+    return {"retrieved_docs": docs}
 
 # 3. Agente di Verifica delle Informazioni
-def verification_agent(state: AgentState) -> AgentState:
-    prompt = (
+def verification_prompt(state: AgentState) -> str:
+    return (
         "Verifica l'accuratezza e l'affidabilità delle seguenti fonti e seleziona quelle più rilevanti e ben documentate:\n"
-        f"{state['retrieved_docs']}\n"
+        f"{bullet_list(compact_lines(state['retrieved_docs']))}\n"
         "Rispondi con una lista, una fonte per riga."
     )
-    response = llm.invoke(prompt)
+
+def verification_agent(state: AgentState) -> AgentState:
+    response = llm.invoke(verification_prompt(state))
     sources = [line.strip() for line in response.content.split("\n") if line.strip()]
-    state["verified_docs"] = sources
-    return state
+    return {"verified_docs": sources}
+
+async def averification_agent(state: AgentState) -> AgentState:
+    response = await llm.ainvoke(verification_prompt(state))
+    sources = [line.strip() for line in response.content.split("\n") if line.strip()]
+    return {"verified_docs": sources}
 
 # 4. Agente di Redazione della Bozza del Post
-def draft_post_agent(state: AgentState) -> AgentState:
-    prompt = (
-        f"Sei un blogger esperto di tecnologia e devi scrivere un post sul tema '{state['topic']}' "
+def topic_text(state: AgentState, limit: int = 3) -> str:
+    """Il topic come testo: i primi ``limit`` titoli distinti, non la repr della lista."""
+    topic = state["topic"]
+    if isinstance(topic, str):
+        return topic
+    return "; ".join(compact_lines(topic, budget=100, per_line=30)[:limit])
+
+def draft_post_prompt(state: AgentState) -> str:
+    return (
+        f"Sei un blogger esperto di tecnologia e devi scrivere un post sul tema '{topic_text(state)}' "
         f"nella categoria '{state['category']}'. Utilizza le seguenti fonti verificate per scrivere "
         "un articolo strutturato con introduzione, sviluppo e conclusione, lungo circa 400 parole:\n"
-        f"{state['verified_docs']}"
+        f"{bullet_list(compact_lines(state['verified_docs']))}"
     )
-    response = llm.invoke(prompt)
+
+def draft_post_agent(state: AgentState) -> AgentState:
+    response = llm.invoke(draft_post_prompt(state))
+    state["draft_post"] = response.content
+    return state
+
+async def adraft_post_agent(state: AgentState) -> AgentState:
+    response = await llm.ainvoke(draft_post_prompt(state))
     state["draft_post"] = response.content
     return state
 
 # 5. Agente Human-in-the-loop per la Revisione
+# Il nodo si sospende con un interrupt finché il revisore non risponde (reviews.py)
 def human_review_agent(state: AgentState) -> AgentState:
-    print("------------ Bozza del Post Generata ------------")
-    print(state["draft_post"])
-    print("--------------------------------------------------")
-    feedback = input("Inserisci eventuali modifiche alla bozza oppure premi INVIO per accettare la versione attuale: ")
+    feedback = str(request_review(
+        "edits",
+        "Descrivi le modifiche da fare alla bozza oppure premi INVIO per accettare la versione attuale:",
+        component="Bozza del post", payload=state["draft_post"],
+    ))
     if feedback.strip():
-        state["human_feedback"] = feedback.strip()
-        state["draft_post"] = feedback.strip()
-    else:
-        state["human_feedback"] = "L'utente non ha apportato modifiche."
-    return state
+        # Le modifiche vengono applicate come patch dal nodo revise
+        return {"human_feedback": feedback.strip(), "revision_request": feedback.strip()}
+    return {"human_feedback": "L'utente non ha apportato modifiche.", "revision_request": None}
+
+async def ahuman_review_agent(state: AgentState) -> AgentState:
+    return human_review_agent(state)
+
+def route_review(state: AgentState) -> str:
+    return "revise" if state.get("revision_request") else "seo"
+
+# 5b. Revisione incrementale: la bozza non viene riscritta, il modello
+# restituisce solo le modifiche (cerca/sostituisci) e la versione precedente
+# resta in draft_history. Poi si torna alla revisione umana.
+def _revision_update(state: AgentState, draft: str, applied: int) -> AgentState:
+    if not applied:
+        print("[WARN] Nessuna modifica applicabile alla bozza: riformula la richiesta")
+        return {"revision_request": None}
+    history = [*(state.get("draft_history") or []), state["draft_post"]]
+    return {"draft_post": draft, "draft_history": history, "revision_request": None}
+
+def revise_draft_agent(state: AgentState) -> AgentState:
+    draft, applied = revise(llm, state["draft_post"], state["revision_request"])
+    return _revision_update(state, draft, applied)
+
+async def arevise_draft_agent(state: AgentState) -> AgentState:
+    draft, applied = await arevise(llm, state["draft_post"], state["revision_request"])
+    return _revision_update(state, draft, applied)
 
 # 6. Agente di Analisi SEO
-def seo_analysis_agent(state: AgentState) -> AgentState:
-    prompt = (
+def seo_analysis_prompt(state: AgentState) -> str:
+    return (
         f"Analizza il seguente articolo per identificare opportunità di ottimizzazione SEO. "
         "Fornisci una lista dettagliata di keyword rilevanti, suggerimenti per la densità delle keyword, "
         "e raccomandazioni per migliorare il titolo e il meta description.\n"
-        f"Articolo:\n{state['draft_post']}"
+        f"Articolo:\n{truncate(state['draft_post'], DOCUMENT_TOKENS)}"
     )
-    response = llm.invoke(prompt)
+
+def seo_analysis_agent(state: AgentState) -> AgentState:
+    response = llm.invoke(seo_analysis_prompt(state))
+    state["seo_analysis"] = response.content
+    return state
+
+async def aseo_analysis_agent(state: AgentState) -> AgentState:
+    response = await llm.ainvoke(seo_analysis_prompt(state))
     state["seo_analysis"] = response.content
     return state
 
 # 7. Agente di Generazione di Titoli
-def title_generation_agent(state: AgentState) -> AgentState:
-    prompt = (
-        f"Genera 3 titoli accattivanti e ottimizzati per SEO per un post sul tema '{state['topic']}' "
+def title_generation_prompt(state: AgentState) -> str:
+    return (
+        f"Genera 3 titoli accattivanti e ottimizzati per SEO per un post sul tema '{topic_text(state)}' "
         f"nella categoria '{state['category']}'. I titoli devono essere coinvolgenti e adatti per catturare l'attenzione dei lettori.\n"
         "Rispondi con una lista numerata."
     )
-    response = llm.invoke(prompt)
+
+def title_generation_agent(state: AgentState) -> AgentState:
+    response = llm.invoke(title_generation_prompt(state))
+    titles = [line.strip() for line in response.content.split("\n") if line.strip()]
+    state["generated_titles"] = titles
+    return state
+
+async def atitle_generation_agent(state: AgentState) -> AgentState:
+    response = await llm.ainvoke(title_generation_prompt(state))
     titles = [line.strip() for line in response.content.split("\n") if line.strip()]
     state["generated_titles"] = titles
     return state
 
 # 8. Agente Media Finder per Contenuti Multimediali (es. immagini da Unsplash)
-def media_finder_agent(state: AgentState) -> AgentState:
-    headers = {"Authorization": "Client-ID YOUR_UNSPLASH_ACCESS_KEY"}  # Sostituire con la chiave reale
-    params = {"query": state["topic"], "per_page": 3}
+UNSPLASH_URL = "https://api.unsplash.com/search/photos"
+UNSPLASH_HEADERS = {"Authorization": "Client-ID YOUR_UNSPLASH_ACCESS_KEY"}  # Sostituire con la chiave reale
+
+def _unsplash_params(state: AgentState) -> dict:
+    return {"query": state["topic"], "per_page": 3}
+
+def _parse_unsplash(data: dict) -> List[str]:
     media_links = []
+    for result in data.get("results", []):
+        link = result.get("urls", {}).get("regular")
+        if link:
+            media_links.append(link)
+    return media_links
+
+def media_finder_agent(state: AgentState) -> AgentState:
+    params = _unsplash_params(state)
     try:
-        response = requests.get("https://api.unsplash.com/search/photos", headers=headers, params=params)
-        response.raise_for_status()
-        data = response.json()
-        for result in data.get("results", []):
-            link = result.get("urls", {}).get("regular")
-            if link:
-                media_links.append(link)
+        data = response_cache.cached(
+            "unsplash", params,
+            lambda: scheduler.call("unsplash", lambda: httpclient.get_json(UNSPLASH_URL, UNSPLASH_HEADERS, params))
+        )
+        media_links = _parse_unsplash(data)
     except Exception as e:
-        media_links.append(f"Errore nel recupero delle risorse multimediali: {str(e)}")
-    state["media_resources"] = media_links
-    return state
+        print(f"[WARN] Ricerca immagini non riuscita: {e}")
+        media_links = []
+    return {"media_resources": asset_store.localize(media_links)}
+
+async def amedia_finder_agent(state: AgentState) -> AgentState:
+    params = _unsplash_params(state)
+    try:
+        data = await response_cache.acached(
+            "unsplash", params,
+            lambda: scheduler.acall("unsplash", lambda: httpclient.aget_json(UNSPLASH_URL, UNSPLASH_HEADERS, params))
+        )
+        media_links = _parse_unsplash(data)
+    except Exception as e:
+        print(f"[WARN] Ricerca immagini non riuscita: {e}")
+        media_links = []
+    return {"media_resources": await asset_store.alocalize(media_links)}
 
 # 9. Agente di Reportistica
+REPORTING_PROMPT = (
+    "Fornisci un report dettagliato che riassuma le fasi del processo editoriale eseguito, "
+    "includendo l'analisi SEO, le modifiche apportate tramite revisione umana, "
+    "le raccomandazioni dei titoli. Il report deve evidenziare i punti di forza e le aree di miglioramento."
+)
+
 def reporting_agent(state: AgentState) -> AgentState:
-    prompt = (
-        "Fornisci un report dettagliato che riassuma le fasi del processo editoriale eseguito, "
-        "includendo l'analisi SEO, le modifiche apportate tramite revisione umana, "
-        "le raccomandazioni dei titoli. Il report deve evidenziare i punti di forza e le aree di miglioramento."
-    )
-    response = llm.invoke(prompt)
+    response = llm.invoke(REPORTING_PROMPT)
     # Salviamo il report nelle planning_notes
     state["planning_notes"] = response.content
     return state
 
+async def areporting_agent(state: AgentState) -> AgentState:
+    response = await llm.ainvoke(REPORTING_PROMPT)
+    state["planning_notes"] = response.content
+    return state
+
 # 10. Agente per l'Aggiornamento della Memoria Persistente con Versioning
 def update_memory_agent(state: AgentState) -> AgentState:
-    new_version = {
-        "version": 1,
-        "timestamp": datetime.datetime.now().isoformat(),
-        "content": state["draft_post"]
-    }
-    exists = False
-    # Verifica se per lo stesso topic e categoria esiste già un record
-    for record in state["previous_posts"]:
-        if record["topic"] == state["topic"] and record["category"] == state["category"]:
-            # Incrementa il versioning aggiungendo la nuova versione
-            record["versions"].append(new_version)
-            exists = True
-            break
-    if not exists:
-        new_record: PostRecord = {
-            "topic": state["topic"],
-            "category": state["category"],
-            "versions": [new_version]
-        }
-        state["previous_posts"].append(new_record)
-    save_memory(state["previous_posts"])
+    # Append della nuova versione: il numero è assegnato dallo storage per (topic, categoria)
+    saved = post_memory.append(state["topic"], state["category"], state["draft_post"])
+    state["post_version"] = saved["version"]
     return state
 
+async def aupdate_memory_agent(state: AgentState) -> AgentState:
+    return await asyncio.to_thread(update_memory_agent, state)
+
 # =============================================================================
 # COSTRUZIONE DEL WORKFLOW CON LANGGRAPH
 # =============================================================================
+# Ogni nodo ha una variante asincrona: lo stesso grafo compilato può essere
+# eseguito con invoke/stream oppure con ainvoke/astream.
 graph = StateGraph(AgentState)
-graph.add_node("ideas", tavily_search_ideas_agent)
-graph.add_node("search", web_search_agent)
-graph.add_node("verify", verification_agent)
-graph.add_node("draft", draft_post_agent)
-graph.add_node("review", human_review_agent)
-graph.add_node("seo", seo_analysis_agent)
-graph.add_node("title", title_generation_agent)
-graph.add_node("media", media_finder_agent)
-graph.add_node("report", reporting_agent)
-graph.add_node("memory", update_memory_agent)
-
-# Imposta il flusso sequenziale completo
+graph.add_node("ideas", RunnableLambda(tavily_search_ideas_agent, afunc=atavily_search_ideas_agent))
+graph.add_node("search", RunnableLambda(web_search_agent, afunc=aweb_search_agent))
+graph.add_node("verify", RunnableLambda(verification_agent, afunc=averification_agent))
+graph.add_node("draft", RunnableLambda(draft_post_agent, afunc=adraft_post_agent))
+graph.add_node("review", RunnableLambda(human_review_agent, afunc=ahuman_review_agent))
+graph.add_node("revise", RunnableLambda(revise_draft_agent, afunc=arevise_draft_agent))
+graph.add_node("seo", RunnableLambda(seo_analysis_agent, afunc=aseo_analysis_agent))
+graph.add_node("title", RunnableLambda(title_generation_agent, afunc=atitle_generation_agent))
+graph.add_node("media", RunnableLambda(media_finder_agent, afunc=amedia_finder_agent))
+graph.add_node("report", RunnableLambda(reporting_agent, afunc=areporting_agent))
+graph.add_node("memory", RunnableLambda(update_memory_agent, afunc=aupdate_memory_agent))
+
+# Le fasi di I/O indipendenti partono insieme: idee (Tavily) e fonti (Bing)
+# subito, le immagini (Unsplash) appena ci sono i topic, in parallelo con
+# verifica, bozza e revisione. Le liste di nodi sono join: draft aspetta idee
+# e verifica, report aspetta titolo e immagini.
 graph.add_edge(START, "ideas")
-graph.add_edge("search")
+graph.add_edge(START, "search")
 graph.add_edge("search", "verify")
-graph.add_edge("verify", "draft")
+graph.add_edge(["ideas", "verify"], "draft")
+graph.add_edge("ideas", "media")
 graph.add_edge("draft", "review")
-graph.add_edge("review", "seo")
+graph.add_conditional_edges("review", route_review, ["revise", "seo"])
+graph.add_edge("revise", "review")
 graph.add_edge("seo", "title")
-graph.add_edge("title", "social")
-graph.add_edge("social", "sentiment")
-graph.add_edge("sentiment", "media")
-graph.add_edge("media", "calendar")
-graph.add_edge("calendar", "report")
-graph.add_edge("report", "crm")
-graph.add_edge("crm", "memory")
+graph.add_edge(["title", "media"], "report")
+graph.add_edge("report", "memory")
 graph.add_edge("memory", END)
 
-memory = MemorySaver()
-workflow = graph.compile(checkpointer=memory)
-
-display(Image(graph.get_graph().draw_mermaid_png()))
+# Compilato una sola volta, al primo uso. Il diagramma non si disegna più
+# all'import: workflow.get_graph().draw_mermaid() quando serve.
+workflow = Lazy(lambda: graph.compile(checkpointer=MemorySaver()))
 
 # =============================================================================
 # ESECUZIONE DEL WORKFLOW
 # =============================================================================
 if __name__ == "__main__":
-    # Carica la memoria persistente dei post precedenti
-    stored_posts = load_memory()
     initial_state: AgentState = {
         "topic": "gaming",
         "category": None,
@@ -276,7 +501,9 @@ if __name__ == "__main__":
         "retrieved_docs": [],
         "verified_docs": [],
         "draft_post": None,
+        "draft_history": [],
         "human_feedback": None,
+        "revision_request": None,
         "planning_notes": "",
         "seo_analysis": None,
         "generated_titles": None,
@@ -284,10 +511,11 @@ if __name__ == "__main__":
         "sentiment_analysis": None,
         "media_resources": None,
         "calendar_schedule": None,
-        "previous_posts": stored_posts
+        "post_version": None
     }
     
-    result = workflow.invoke(initial_state)
+    config = {"configurable": {"thread_id": "1"}, "callbacks": [MetricsCallback(metrics)]}
+    result = answer_interactively(workflow, initial_state, config)
     
     # Stampa dei risultati finali
     print("\n------------ RISULTATO FINALE ------------")
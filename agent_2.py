@@ -17,6 +17,9 @@ Per eseguire serve:
 - tavily-python               (wrapper API Tavily)
 - pytrends                    (Google Trends unofficial)
 - sqlite3 (standard lib)
+- aiosqlite                   (checkpointer asincrono, opzione --async)
+- zstandard                   (opzionale: checkpoint compressi con zstd invece di zlib)
+- pillow                      (opzionale: varianti ridimensionate delle immagini locali)
 
 Le sezioni TODO indicano dove inserire logica applicativa, chiavi API o
 integrazione con il sistema di feedback umano (es. web-app front-end,
@@ -25,137 +28,802 @@ notifiche Slack, ecc.).
 
 from __future__ import annotations
 import os, getpass
+import asyncio
+import contextlib
+import hashlib
 import json
+import re
+import sys
+import threading
 import sqlite3
+import datetime
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import urlparse
 import argparse
-from typing import Any, Dict, List, Union, TypedDict, Optional
+from functools import lru_cache
+from typing import Annotated, Any, Dict, List, Set, Tuple, Union, TypedDict, Optional
 
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate, SystemMessagePromptTemplate
+# Solo import leggeri a livello di modulo: SDK e client (OpenAI, Langfuse,
+# pytrends/pandas, Tavily, aiosqlite, IPython) si importano nelle factory,
+# al primo uso (vedi lazy.py).
+from langchain_core.callbacks import StreamingStdOutCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AnyMessage
+from langchain_core.prompts import ChatPromptTemplate, SystemMessagePromptTemplate
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langgraph.graph import StateGraph, START, END, MessagesState
-from IPython.display import Image, display
-from langgraph.prebuilt import ToolNode
-from pytrends.request import TrendReq
-from tavily import TavilyClient
-from langfuse.callback import CallbackHandler
-from langchain.callbacks import CallbackManager
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-from langfuse import Langfuse
-from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.types import Command
+
+from lazy import Lazy, resolve
+from cache import LLMCache, response_cache
+from metrics import MetricsCallback, cost, metrics
+from scheduler import BATCH, scheduler
+from budget import add_windowed_messages, compact_sources, format_sources
+from revision import arevise, revise
+from reviews import ReviewQueue, answer_interactively, format_review, pending_reviews, request_review
+from topics import TopicPool
+from assets import AssetStore, digest_of
+from checkpoints import BUSY_TIMEOUT, CheckpointRetention, CompactSerializer, connect_db
 
 def _set_env(var: str):
     if not os.environ.get(var):
         os.environ[var] = getpass.getpass(f"{var}: ")
 
-_set_env("OPENAI_API_KEY")
-_set_env("TAVILY_API_KEY")
-_set_env("LANGFUSE_PUBLIC_KEY")
-_set_env("LANGFUSE_SECRET_KEY")
-_set_env("LANGFUSE_HOST")
-
-langfuse = Langfuse(
-  secret_key=os.environ["LANGFUSE_SECRET_KEY"],
-  public_key=os.environ["LANGFUSE_PUBLIC_KEY"],
-  host=os.environ["LANGFUSE_HOST"]
-)
+def _make_langfuse_handler():
+    for var in ("LANGFUSE_PUBLIC_KEY", "LANGFUSE_SECRET_KEY", "LANGFUSE_HOST"):
+        _set_env(var)
+    from langfuse.callback import CallbackHandler
+    return CallbackHandler()
 
-langfuse_handler = CallbackHandler()
-cb_manager = CallbackManager([StreamingStdOutCallbackHandler(), langfuse_handler])
+langfuse_handler = Lazy(_make_langfuse_handler)
 
 DB_PATH = Path("./articles.sqlite")
-conn = sqlite3.connect(DB_PATH)
-memory = SqliteSaver(conn)
+# Una sola connessione (WAL) per tutto il processo: checkpointer, archivio
+# articoli e cache dei verdetti la condividono insieme al lock del checkpointer
+conn = Lazy(lambda: connect_db(DB_PATH))
+# Checkpoint compressi, con i canali grandi salvati una sola volta per hash
+serde = Lazy(lambda: CompactSerializer(DB_PATH))
+
+def _make_memory():
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    return SqliteSaver(resolve(conn), serde=resolve(serde))
+
+memory = Lazy(_make_memory)
+
+@contextlib.asynccontextmanager
+async def async_checkpointer():
+    import aiosqlite
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    async with aiosqlite.connect(DB_PATH, timeout=BUSY_TIMEOUT) as aconn:
+        await aconn.execute("PRAGMA journal_mode = WAL")
+        await aconn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}")
+        yield AsyncSqliteSaver(aconn, serde=resolve(serde))
 
-class Draft(TypedDict):
+class Draft(TypedDict, total=False):
     title: str
     body: str
     images: List[str]
 
+def merge_dicts(left: Optional[Dict[str, Any]], right: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Unisce gli aggiornamenti parziali prodotti in parallelo dai tre rami."""
+    return {**(left or {}), **(right or {})}
+
 class State(MessagesState):
+    # Cronologia a finestra: i messaggi vecchi confluiscono in un riassunto
+    messages: Annotated[List[AnyMessage], add_windowed_messages]
     prompt: str
     topic: Optional[str]
+    topics: Optional[List[str]]
+    related: Optional[List[Dict[str, Any]]]
     sources: Optional[List[Dict[str, Any]]]
-    draft: Optional[Draft]
+    draft: Annotated[Draft, merge_dicts]
+    approved: Annotated[Dict[str, Optional[bool]], merge_dicts]
+    # Alternative già pronte per parte: un rifiuto passa alla successiva senza chiamare il modello
+    candidates: Annotated[Dict[str, List[Any]], merge_dicts]
+    # Modifiche richieste dal revisore per parte: applicate come patch, senza rigenerare
+    notes: Annotated[Dict[str, str], merge_dicts]
+    article_id: Optional[int]
 
 class GoogleTrendsAdapter:
     def __init__(self, hl: str = "en-US", tz: int = 360):
+        from pytrends.request import TrendReq  # porta con sé pandas: solo al primo uso
         self.tr = TrendReq(hl=hl, tz=tz)
 
+    @metrics.track("adapter", "trends")
     def get_trending(self, country: str = "italy", n: int = 20) -> List[str]:
-        df = self.tr.trending_searches(pn=country)
-        return df.iloc[:, 0].head(n).tolist()
+        def fetch() -> List[str]:
+            df = self.tr.trending_searches(pn=country)
+            return df.iloc[:, 0].head(n).tolist()
+        return response_cache.cached("trends", {"country": country, "n": n, "hl": self.tr.hl},
+                                     lambda: scheduler.call("trends", fetch))
+
+    async def aget_trending(self, country: str = "italy", n: int = 20) -> List[str]:
+        # pytrends non ha un client asincrono: la richiesta gira in un thread
+        return await asyncio.to_thread(self.get_trending, country, n)
 
 class TopicClassifier:
-    def __init__(self, llm: ChatOpenAI):
+    """Classifica i termini di tendenza in blocchi, con cache persistente dei verdetti.
+
+    Ogni blocco di ``batch_size`` termini viene valutato con una sola chiamata
+    all'LLM (punteggio 0-10 di pertinenza gaming); i blocchi partono in
+    parallelo su un pool limitato a ``max_workers`` thread (o task, nella
+    variante asincrona). I verdetti restano
+    nella tabella ``topic_verdicts`` così i termini ricorrenti non vengono mai
+    riclassificati.
+    """
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS topic_verdicts (
+            term TEXT PRIMARY KEY,
+            score INTEGER NOT NULL,
+            classified_at TEXT NOT NULL
+        )"""
+    )
+    MIN_SCORE = 6
+
+    def __init__(self, llm: BaseChatModel, db_path: Path = DB_PATH,
+                 batch_size: int = 20, max_workers: int = 4,
+                 conn: Optional[sqlite3.Connection] = None, lock: Optional[threading.Lock] = None):
         self.llm = llm
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.conn = conn if conn is not None else connect_db(db_path)
+        self.lock = lock if lock is not None else threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute(self.SCHEMA)
 
-    def is_gaming(self, topic: str) -> bool:
-        prompt = [
-            {"role": "system", "content": "Sei un esperto di videogiochi, rispondi solo SÌ o NO."},
-            {"role": "user", "content": f"Il termine '{topic}' è un argomento di videogiochi?"}
+    @staticmethod
+    def _key(term: str) -> str:
+        return " ".join(term.lower().split())
+
+    def _cached(self, terms: List[str]) -> Dict[str, int]:
+        keys = [self._key(t) for t in terms]
+        if not keys:
+            return {}
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT term, score FROM topic_verdicts WHERE term IN ({','.join('?' * len(keys))})",
+                keys
+            ).fetchall()
+        return dict(rows)
+
+    @staticmethod
+    def _batch_prompt(terms: List[str]) -> List[Dict[str, str]]:
+        numbered = "\n".join(f"{i + 1}. {t}" for i, t in enumerate(terms))
+        return [
+            {"role": "system", "content": (
+                "Sei un esperto di videogiochi. Per ogni termine assegna un punteggio da 0 "
+                "(nessun legame con i videogiochi) a 10 (argomento di videogiochi). "
+                "Rispondi solo con un oggetto JSON {\"<numero>\": <punteggio>}."
+            )},
+            {"role": "user", "content": numbered}
         ]
-        resp = self.llm(prompt)
-        return resp.content.strip().upper().startswith("SÌ")
+
+    @staticmethod
+    def _parse_scores(terms: List[str], content: str) -> Dict[str, int]:
+        text = content.strip().removeprefix("```json").strip("`\n ")
+        try:
+            raw = json.loads(text)
+        except json.JSONDecodeError:
+            return {}
+        if isinstance(raw, list):
+            # Lista di punteggi nello stesso ordine dei termini
+            raw = {i + 1: score for i, score in enumerate(raw)}
+        elif not isinstance(raw, dict):
+            return {}
+        scores = {}
+        for idx, score in raw.items():
+            try:
+                position = int(idx) - 1
+                if position < 0:  # "0" o negativi indicizzerebbero dalla fine
+                    continue
+                scores[terms[position]] = max(0, min(10, int(score)))
+            except (ValueError, IndexError, TypeError):
+                continue
+        return scores
+
+    def _classify_batch(self, terms: List[str]) -> Dict[str, int]:
+        resp = self.llm.invoke(self._batch_prompt(terms))
+        return self._parse_scores(terms, resp.content)
+
+    async def _aclassify_batch(self, terms: List[str], limit: asyncio.Semaphore) -> Dict[str, int]:
+        async with limit:
+            resp = await self.llm.ainvoke(self._batch_prompt(terms))
+        return self._parse_scores(terms, resp.content)
+
+    def _batches(self, terms: List[str], cached: Dict[str, int]) -> List[List[str]]:
+        missing = list(dict.fromkeys(t for t in terms if self._key(t) not in cached))
+        return [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+
+    def classify(self, terms: List[str]) -> Dict[str, int]:
+        """Restituisce il punteggio gaming (0-10) di ogni termine, usando la cache dove possibile."""
+        cached = self._cached(terms)
+        batches = self._batches(terms, cached)
+        fresh: Dict[str, int] = {}
+        if batches:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for scores in pool.map(self._classify_batch, batches):
+                    fresh.update(scores)
+        return self._store(terms, cached, fresh)
+
+    async def aclassify(self, terms: List[str]) -> Dict[str, int]:
+        cached = self._cached(terms)
+        limit = asyncio.Semaphore(self.max_workers)
+        results = await asyncio.gather(
+            *(self._aclassify_batch(batch, limit) for batch in self._batches(terms, cached))
+        )
+        fresh = {t: s for scores in results for t, s in scores.items()}
+        return self._store(terms, cached, fresh)
+
+    def _store(self, terms: List[str], cached: Dict[str, int], fresh: Dict[str, int]) -> Dict[str, int]:
+        now = datetime.datetime.now().isoformat()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO topic_verdicts(term, score, classified_at) VALUES (?, ?, ?)",
+                [(self._key(t), s, now) for t, s in fresh.items()]
+            )
+        cached.update({self._key(t): s for t, s in fresh.items()})
+        return {t: cached[self._key(t)] for t in terms if self._key(t) in cached}
+
+    def _rank(self, terms: List[str], scores: Dict[str, int]) -> List[str]:
+        gaming = [t for t in terms if scores.get(t, 0) >= self.MIN_SCORE]
+        return sorted(gaming, key=lambda t: -scores[t])
+
+    def rank_gaming(self, terms: List[str]) -> List[str]:
+        """Termini gaming ordinati per punteggio; a parità vale l'ordine di tendenza."""
+        return self._rank(terms, self.classify(terms))
+
+    async def arank_gaming(self, terms: List[str]) -> List[str]:
+        return self._rank(terms, await self.aclassify(terms))
+
+    def is_gaming(self, topic: str) -> bool:
+        return self.classify([topic]).get(topic, 0) >= self.MIN_SCORE
+
+    async def ais_gaming(self, topic: str) -> bool:
+        return (await self.aclassify([topic])).get(topic, 0) >= self.MIN_SCORE
+
+# Soglie della ricerca fonti (graph.md: "Score < threshold" e "n_sources < 2")
+SOURCE_MIN_SCORE = float(os.environ.get("SOURCE_MIN_SCORE", 0.6))
+MIN_SOURCES = int(os.environ.get("MIN_SOURCES", 2))
 
 class TavilyAdapter:
-    def __init__(self, api_key: str | None = None) -> None:
+    """Ricerca fonti su Tavily con raccolta adattiva.
+
+    ``collect`` chiede i risultati a pagine di ``page_size`` escludendo i
+    domini già visti, scarta quelli sotto ``min_score`` e i duplicati (stesso
+    URL o stesso dominio) e si ferma appena ha ``target_sources`` fonti
+    valide, o dopo ``max_pages`` pagine. Con meno di ``min_sources`` fonti
+    il grafo torna alla scelta del topic.
+    """
+    def __init__(self, api_key: str | None = None, min_score: float = SOURCE_MIN_SCORE,
+                 min_sources: int = MIN_SOURCES, target_sources: int = 5,
+                 page_size: int = 5, max_pages: int = 3) -> None:
+        from tavily import AsyncTavilyClient, TavilyClient
         self.client = TavilyClient(api_key or os.environ.get("TAVILY_API_KEY"))
+        self.aclient = AsyncTavilyClient(api_key or os.environ.get("TAVILY_API_KEY"))
+        self.min_score = min_score
+        self.min_sources = min_sources
+        self.target_sources = target_sources
+        self.page_size = page_size
+        self.max_pages = max_pages
+
+    @staticmethod
+    def _key(query: str, k: int, exclude: Set[str]) -> Dict[str, Any]:
+        return {"query": query, "k": k, "exclude": sorted(exclude)}
 
-    def search(self, query: str, k: int = 10) -> List[Dict[str, Any]]:
-        return self.client.search(query, k=k)
+    @metrics.track("adapter", "tavily")
+    def search(self, query: str, k: int = 10, exclude_domains: Set[str] = frozenset()) -> List[Dict[str, Any]]:
+        def fetch() -> List[Dict[str, Any]]:
+            return self.client.search(query, max_results=k, exclude_domains=sorted(exclude_domains))["results"]
+        return response_cache.cached(
+            "tavily", self._key(query, k, exclude_domains), lambda: scheduler.call("tavily", fetch)
+        )
+
+    @metrics.track("adapter", "tavily")
+    async def asearch(self, query: str, k: int = 10, exclude_domains: Set[str] = frozenset()) -> List[Dict[str, Any]]:
+        async def fetch() -> List[Dict[str, Any]]:
+            response = await self.aclient.search(query, max_results=k, exclude_domains=sorted(exclude_domains))
+            return response["results"]
+        return await response_cache.acached(
+            "tavily", self._key(query, k, exclude_domains), lambda: scheduler.acall("tavily", fetch)
+        )
+
+    @staticmethod
+    def _domain(url: str) -> str:
+        host = urlparse(url).netloc.lower()
+        return host[4:] if host.startswith("www.") else host
+
+    def _accept(self, results: List[Dict[str, Any]], sources: List[Dict[str, Any]],
+                seen: Set[str]) -> bool:
+        """Aggiunge le fonti nuove e valide; False se la pagina non ha portato domini nuovi."""
+        fresh = False
+        for r in sorted(results, key=lambda r: -r.get("score", 0)):
+            domain = self._domain(r.get("url", ""))
+            if not domain or domain in seen:
+                continue
+            # Anche i domini scartati entrano in seen: la pagina dopo li esclude
+            seen.add(domain)
+            fresh = True
+            if r.get("score", 0) >= self.min_score and len(sources) < self.target_sources:
+                sources.append(r)
+        return fresh
+
+    def collect(self, query: str) -> List[Dict[str, Any]]:
+        sources: List[Dict[str, Any]] = []
+        seen: Set[str] = set()
+        for _ in range(self.max_pages):
+            if not self._accept(self.search(query, self.page_size, set(seen)), sources, seen):
+                break
+            if len(sources) >= self.target_sources:
+                break
+        return sources
+
+    async def acollect(self, query: str) -> List[Dict[str, Any]]:
+        sources: List[Dict[str, Any]] = []
+        seen: Set[str] = set()
+        for _ in range(self.max_pages):
+            if not self._accept(await self.asearch(query, self.page_size, set(seen)), sources, seen):
+                break
+            if len(sources) >= self.target_sources:
+                break
+        return sources
 
 class SourceVerifier:
-    def __init__(self, llm: ChatOpenAI) -> None:
+    def __init__(self, llm: BaseChatModel) -> None:
         self.llm = llm
 
-    def verify(self, sources: List[Dict[str, Any]]) -> bool:
+    @staticmethod
+    def _messages(sources: List[Dict[str, Any]]):
         prompt = ChatPromptTemplate.from_messages([
             ("system", "Sei un fact-checker esperto in videogiochi."),
             ("human", "{sources}\nLe fonti sono affidabili? Rispondi SÌ o NO.")
         ])
-        msg = prompt.format_messages(sources=json.dumps(sources, ensure_ascii=False))
-        reply = self.llm(msg)
+        # Titolo, URL ed estratto breve per fonte: mai il contenuto grezzo di Tavily
+        return prompt.format_messages(sources=format_sources(compact_sources(sources)))
+
+    def verify(self, sources: List[Dict[str, Any]]) -> bool:
+        reply = self.llm.invoke(self._messages(sources))
+        return "SÌ" in reply.content.upper()
+
+    async def averify(self, sources: List[Dict[str, Any]]) -> bool:
+        reply = await self.llm.ainvoke(self._messages(sources))
         return "SÌ" in reply.content.upper()
 
+SPECULATIVE_K = int(os.environ.get("SPECULATIVE_K", 2))
+SPECULATIVE_MAX_COST = float(os.environ.get("SPECULATIVE_MAX_COST", 0.001))
+
+class Speculation:
+    """Generazione speculativa delle alternative per titolo e immagini.
+
+    Insieme al candidato da revisionare vengono preparate ``k`` alternative,
+    tenute in ``state["candidates"]``: se il revisore rifiuta, il ramo passa
+    subito alla successiva. Per i titoli le alternative escono dalla stessa
+    chiamata (qualche token di output in più, nessun round trip); ``max_cost``
+    (USD) limita i token extra per generazione in base al prezzo del modello.
+    """
+    def __init__(self, k: int = SPECULATIVE_K, max_cost: float = SPECULATIVE_MAX_COST, title_tokens: int = 20):
+        self.k = k
+        self.max_cost = max_cost
+        self.title_tokens = title_tokens
+
+    def titles(self, model: str) -> int:
+        """Alternative da chiedere al modello entro il tetto di costo."""
+        each = cost(model, 0, self.title_tokens)
+        return self.k if each <= 0 else max(0, min(self.k, int(self.max_cost // each)))
+
+    @staticmethod
+    def parse_titles(content: str, n: int) -> List[str]:
+        titles = []
+        for line in content.splitlines():
+            title = re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip().strip('"“”')
+            if title and title not in titles:
+                titles.append(title)
+        return titles[:n] or [content.strip()]
+
+    @staticmethod
+    def next_candidate(state: State, part: str) -> Optional[State]:
+        """Aggiornamento con la prossima alternativa pronta, se ce n'è una."""
+        pending = (state.get("candidates") or {}).get(part) or []
+        if not pending:
+            return None
+        return {"draft": {part: pending[0]}, "approved": {part: None}, "candidates": {part: pending[1:]}}
+
 class HumanFeedback:
+    """Domande al revisore umano.
+
+    Nessuna chiamata blocca il processo: ognuna sospende il thread con un
+    interrupt (vedi reviews.py) e restituisce la risposta quando il thread
+    viene ripreso con ``Command(resume=...)``.
+    """
+    def __init__(self) -> None:
+        # Verdetti anticipati, dati mentre una parte è ancora in generazione
+        self.early: Dict[Tuple[str, str], bool] = {}
+        self.streaming: Set[Tuple[str, str]] = set()
+
     @staticmethod
     def request(component: str, payload: Union[str, List[str]]) -> bool:
-        print(f"[FEEDBACK] {component}: {payload}\nApprovare? (y/n) → ", end="")
-        return input().lower().startswith("y")
+        answer = request_review("approve", "Approvare? (y/n) →", component=component, payload=payload)
+        return str(answer).strip().lower().startswith("y")
 
-class ArticleDB:
-    SCHEMA = (
-        """CREATE TABLE IF NOT EXISTS articles (
+    @staticmethod
+    async def arequest(component: str, payload: Union[str, List[str]]) -> bool:
+        return HumanFeedback.request(component, payload)
+
+    @staticmethod
+    def verdict(answer: str) -> Tuple[bool, str]:
+        """``y`` approva, ``n`` o riga vuota rifiuta, altro testo è una richiesta di modifiche."""
+        answer = answer.strip()
+        if answer.lower() in ("y", "yes", "s", "si", "sì"):
+            return True, ""
+        if answer.lower() in ("", "n", "no"):
+            return False, ""
+        return False, answer
+
+    @staticmethod
+    def request_edits(component: str, payload: Union[str, List[str]]) -> Tuple[bool, str]:
+        answer = request_review("edits", "Approvare? (y / n = rigenera / testo = modifiche) →",
+                                component=component, payload=payload)
+        return HumanFeedback.verdict(str(answer))
+
+    @staticmethod
+    async def arequest_edits(component: str, payload: Union[str, List[str]]) -> Tuple[bool, str]:
+        return HumanFeedback.request_edits(component, payload)
+
+    @staticmethod
+    def ask(question: str, options: Optional[List[str]] = None) -> str:
+        return str(request_review("choice" if options else "text", question, options=options))
+
+    @staticmethod
+    async def aask(question: str, options: Optional[List[str]] = None) -> str:
+        return HumanFeedback.ask(question, options)
+
+    def begin_stream(self, thread_id: str, part: str) -> None:
+        self.early.pop((thread_id, part), None)
+        self.streaming.add((thread_id, part))
+
+    def early_verdict(self, thread_id: str, part: str) -> Optional[bool]:
+        return self.early.get((thread_id, part))
+
+    def end_stream(self, thread_id: str, part: str) -> Optional[bool]:
+        self.streaming.discard((thread_id, part))
+        return self.early.pop((thread_id, part), None)
+
+class StreamingReviewer(HumanFeedback):
+    """Revisore da terminale per la modalità --review.
+
+    Un thread legge stdin e smista le righe: se una parte è in streaming la
+    riga (y/n) diventa il suo verdetto anticipato, altrimenti finisce in
+    ``answers``, da cui ``areview`` risponde alle revisioni in attesa.
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self.answers: Optional[asyncio.Queue] = None
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.answers = asyncio.Queue()
+        def read() -> None:
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(self._dispatch, line.strip())
+        threading.Thread(target=read, name="review-stdin", daemon=True).start()
+
+    def _dispatch(self, line: str) -> None:
+        pending = [key for key in self.streaming if key not in self.early]
+        if not pending:
+            self.answers.put_nowait(line)
+            return
+        approved = line.lower().startswith("y")
+        for key in pending:
+            self.early[key] = approved
+        print(f"\n[FEEDBACK] {'approvato' if approved else 'rifiutato'} durante la generazione")
+
+def _articles_v1(conn: sqlite3.Connection) -> None:
+    """Tabella articles unificata: (topic, title, body, images).
+
+    Il DB storico ha ``articles(topic, article)`` con colonne NOT NULL: le
+    righe vengono copiate nel nuovo schema (``title`` = topic, ``body`` =
+    markdown completo) mantenendo id e data di creazione.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(articles)")}
+    conn.execute(
+        """CREATE TABLE articles_v1 (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT,
             title TEXT,
             body TEXT,
-            images TEXT,
+            images TEXT NOT NULL DEFAULT '[]',
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )"""
     )
-    def __init__(self, db_path: Path = DB_PATH):
-        self.conn = sqlite3.connect(db_path)
-        self.conn.execute(self.SCHEMA)
-    def save(self, title: str, body: str, images: List[str]) -> int:
-        cur = self.conn.cursor()
-        cur.execute(
-            "INSERT INTO articles(title, body, images) VALUES (?, ?, ?)",
-            (title, body, json.dumps(images))
+    if "article" in columns:
+        conn.execute(
+            "INSERT INTO articles_v1(id, topic, title, body, created_at) "
+            "SELECT id, topic, topic, article, created_at FROM articles"
+        )
+    elif columns:
+        conn.execute(
+            "INSERT INTO articles_v1(id, title, body, images, created_at) "
+            "SELECT id, title, body, COALESCE(images, '[]'), created_at FROM articles"
         )
-        self.conn.commit()
-        return cur.lastrowid
+    if columns:
+        conn.execute("DROP TABLE articles")
+    conn.execute("ALTER TABLE articles_v1 RENAME TO articles")
 
-def get_user_prompt_node(state: State) -> State:
-    prompt = input(
-        "Inserisci il prompt per l'articolo: "
+def _articles_v2(conn: sqlite3.Connection) -> None:
+    """Indice full-text e tabella degli embeddings, popolati dagli articoli esistenti."""
+    conn.execute(
+        """CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+            title, body, tokenize = 'unicode61 remove_diacritics 2'
+        )"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS article_embeddings (
+            article_id INTEGER PRIMARY KEY,
+            vector BLOB NOT NULL
+        )"""
+    )
+    conn.execute("DELETE FROM articles_fts")
+    conn.execute("INSERT INTO articles_fts(rowid, title, body) SELECT id, title, body FROM articles")
+    conn.execute("CREATE INDEX IF NOT EXISTS articles_topic ON articles(topic)")
+
+def _articles_v3(conn: sqlite3.Connection) -> None:
+    """Versioni successive delle parti della bozza (una riga per revisione)."""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS draft_versions (
+            thread_id TEXT NOT NULL,
+            part TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            feedback TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (thread_id, part, version)
+        )"""
     )
-    state["prompt"] = prompt
+
+def _articles_v4(conn: sqlite3.Connection) -> None:
+    """Immagini locali di ogni articolo, in ordine (hash dell'archivio assets.py)."""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS article_assets (
+            article_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            PRIMARY KEY (article_id, position)
+        )"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS article_assets_hash ON article_assets(hash)")
+
+class ArticleDB:
+    """Archivio degli articoli con indice full-text (FTS5) e, opzionale, indice semantico.
+
+    Lo schema è versionato con ``PRAGMA user_version``: all'apertura vengono
+    applicate in ordine, ognuna nella propria transazione, le ``MIGRATIONS``
+    più recenti della versione del file. L'indice FTS5 ``articles_fts`` è
+    allineato a ogni salvataggio; con ``embeddings`` configurato ogni articolo
+    salva anche il proprio vettore e ``similar`` fa una ricerca coseno
+    brute-force in NumPy sulla matrice caricata in memoria (poche migliaia di
+    articoli: pochi millisecondi).
+
+    Connessione e lock possono essere condivisi con il checkpointer, così
+    tutto il processo scrive su ``articles.sqlite`` da una sola connessione.
+    ``asave`` raggruppa i salvataggi concorrenti (modalità batch) e li scrive
+    con un'unica transazione di ``save_many``.
+
+    ``draft_versions`` conserva ogni versione di una parte della bozza per
+    thread, con le note del revisore che l'hanno prodotta.
+
+    Le immagini scaricate nell'archivio locale (vedi assets.py) sono
+    registrate anche in ``article_assets``: ``assets`` restituisce gli hash
+    da cui ricavare le varianti da pubblicare.
+    """
+    MIGRATIONS = (_articles_v1, _articles_v2, _articles_v3, _articles_v4)
+
+    def __init__(self, db_path: Path = DB_PATH, embeddings: Optional[Embeddings] = None,
+                 conn: Optional[sqlite3.Connection] = None, lock: Optional[threading.Lock] = None,
+                 flush_interval: float = 0.05):
+        self.conn = conn if conn is not None else connect_db(db_path)
+        self.lock = lock if lock is not None else threading.Lock()
+        self.embeddings = embeddings
+        self.flush_interval = flush_interval
+        self._ids: List[int] = []
+        self._matrix = None
+        self._pending: List[Tuple[Tuple[str, str, List[str], Optional[str]], asyncio.Future]] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self.migrate()
+
+    @property
+    def version(self) -> int:
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self) -> int:
+        """Porta il file all'ultima versione dello schema e la restituisce."""
+        with self.lock:
+            current = self.version
+            for version, step in enumerate(self.MIGRATIONS, start=1):
+                if version <= current:
+                    continue
+                with self.conn:
+                    # BEGIN esplicito: anche il DDL resta nella transazione
+                    self.conn.execute("BEGIN")
+                    step(self.conn)
+                    # user_version non accetta parametri: il valore è un intero nostro
+                    self.conn.execute(f"PRAGMA user_version = {version}")
+            return self.version
+
+    def rebuild_index(self) -> None:
+        """Ricostruisce l'indice full-text da zero a partire dalla tabella articles."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM articles_fts")
+            self.conn.execute("INSERT INTO articles_fts(rowid, title, body) SELECT id, title, body FROM articles")
+
+    def _embed_many(self, articles: List[Tuple[str, str]]) -> List[Optional[bytes]]:
+        if self.embeddings is None:
+            return [None] * len(articles)
+        import numpy as np
+        vectors = self.embeddings.embed_documents([f"{title}\n{body[:2000]}" for title, body in articles])
+        return [np.asarray(v, dtype=np.float32).tobytes() for v in vectors]
+
+    def save_many(self, articles: List[Tuple[str, str, List[str], Optional[str]]]) -> List[int]:
+        """Salva più articoli ``(title, body, images, topic)`` in una sola transazione.
+
+        Gli embeddings sono calcolati con una sola richiesta prima di prendere
+        il lock, così la transazione resta breve.
+        """
+        if not articles:
+            return []
+        vectors = self._embed_many([(title, body) for title, body, _, _ in articles])
+        ids = []
+        with self.lock, self.conn:
+            cur = self.conn.cursor()
+            for (title, body, images, topic), vector in zip(articles, vectors):
+                cur.execute(
+                    "INSERT INTO articles(topic, title, body, images) VALUES (?, ?, ?, ?)",
+                    (topic, title, body, json.dumps(images))
+                )
+                ids.append(cur.lastrowid)
+                cur.execute("INSERT INTO articles_fts(rowid, title, body) VALUES (?, ?, ?)",
+                            (cur.lastrowid, title, body))
+                if vector is not None:
+                    cur.execute("INSERT INTO article_embeddings(article_id, vector) VALUES (?, ?)",
+                                (cur.lastrowid, vector))
+                cur.executemany(
+                    "INSERT INTO article_assets(article_id, position, hash) VALUES (?, ?, ?)",
+                    [(ids[-1], position, digest) for position, digest in enumerate(map(digest_of, images)) if digest]
+                )
+            if any(v is not None for v in vectors):
+                self._matrix = None
+        return ids
+
+    def assets(self, article_id: int) -> List[str]:
+        """Hash delle immagini locali dell'articolo, nell'ordine di ``images``."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT hash FROM article_assets WHERE article_id = ? ORDER BY position", (article_id,)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def save(self, title: str, body: str, images: List[str], topic: Optional[str] = None) -> int:
+        return self.save_many([(title, body, images, topic)])[0]
+
+    async def asave(self, title: str, body: str, images: List[str], topic: Optional[str] = None) -> int:
+        """Accoda il salvataggio: i worker che salvano insieme condividono una transazione."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((title, body, images, topic), future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self) -> None:
+        batch: List[Tuple[Tuple[str, str, List[str], Optional[str]], asyncio.Future]] = []
+        try:
+            await asyncio.sleep(self.flush_interval)
+            # I salvataggi accodati durante la scrittura trovano questo flusher
+            # ancora attivo: si svuota la coda prima di terminare
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    ids = await asyncio.to_thread(self.save_many, [article for article, _ in batch])
+                except Exception as exc:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(exc)
+                else:
+                    for (_, future), aid in zip(batch, ids):
+                        if not future.done():
+                            future.set_result(aid)
+                batch = []
+        except asyncio.CancelledError:
+            for _, future in batch + self._pending:
+                future.cancel()
+            self._pending = []
+            raise
+
+    def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Ricerca full-text (BM25): qualsiasi termine della query può corrispondere."""
+        terms = re.findall(r"\w+", query.lower())
+        if not terms:
+            return []
+        match = " OR ".join(f'"{t}"' for t in terms)
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT rowid, title, bm25(articles_fts) AS rank FROM articles_fts "
+                "WHERE articles_fts MATCH ? ORDER BY rank LIMIT ?",
+                (match, k)
+            ).fetchall()
+        return [{"id": rid, "title": title, "rank": -rank} for rid, title, rank in rows]
+
+    def similar(self, text: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Articoli più vicini per similarità coseno sugli embeddings."""
+        import numpy as np
+        with self.lock:
+            if self._matrix is None:
+                rows = self.conn.execute("SELECT article_id, vector FROM article_embeddings").fetchall()
+                self._ids = [r[0] for r in rows]
+                if rows:
+                    matrix = np.vstack([np.frombuffer(r[1], dtype=np.float32) for r in rows])
+                    self._matrix = matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-9)
+            matrix, ids = self._matrix, self._ids
+        if matrix is None:
+            return []
+        query = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        sims = matrix @ (query / (np.linalg.norm(query) + 1e-9))
+        best = np.argsort(-sims)[:k]
+        with self.lock:
+            titles = dict(self.conn.execute(
+                f"SELECT rowid, title FROM articles_fts WHERE rowid IN ({','.join('?' * len(best))})",
+                [ids[i] for i in best]
+            ).fetchall())
+        return [{"id": ids[i], "title": titles.get(ids[i]), "similarity": float(sims[i])} for i in best]
+
+    def related(self, topic: str, k: int = 3) -> List[Dict[str, Any]]:
+        """Articoli già pubblicati vicini al topic: semantici se disponibili, altrimenti full-text."""
+        return self.similar(topic, k) if self.embeddings is not None else self.search(topic, k)
+
+    async def arelated(self, topic: str, k: int = 3) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.related, topic, k)
+
+    def save_version(self, thread_id: str, part: str, content: str, feedback: Optional[str] = None) -> int:
+        """Aggiunge una versione di ``part`` per il thread e ne restituisce il numero."""
+        with self.lock, self.conn:
+            version = self.conn.execute(
+                "SELECT COALESCE(MAX(version), 0) + 1 FROM draft_versions WHERE thread_id = ? AND part = ?",
+                (thread_id, part)
+            ).fetchone()[0]
+            self.conn.execute(
+                "INSERT INTO draft_versions(thread_id, part, version, content, feedback) VALUES (?, ?, ?, ?, ?)",
+                (thread_id, part, version, content, feedback)
+            )
+        return version
+
+    async def asave_version(self, thread_id: str, part: str, content: str, feedback: Optional[str] = None) -> int:
+        return await asyncio.to_thread(self.save_version, thread_id, part, content, feedback)
+
+    def versions(self, thread_id: str, part: str) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT version, content, feedback, created_at FROM draft_versions "
+                "WHERE thread_id = ? AND part = ? ORDER BY version",
+                (thread_id, part)
+            ).fetchall()
+        return [{"version": v, "content": c, "feedback": f, "created_at": t} for v, c, f, t in rows]
+
+def get_user_prompt_node(state: State) -> State:
+    if state.get("prompt"):
+        # Prompt già fornito (CLI o modalità batch): nessun input interattivo
+        return state
+    state["prompt"] = feedback.ask("Inserisci il prompt per l'articolo: ")
     return state
 
-def router_node(state: State) -> str:
+async def aget_user_prompt_node(state: State) -> State:
+    if state.get("prompt"):
+        return state
+    state["prompt"] = await feedback.aask("Inserisci il prompt per l'articolo: ")
+    return state
+
+def router_messages(state: State) -> List[Dict[str, str]]:
     prompt_text = state["prompt"]
-    messages = [
+    return [
         {"role": "system",
          "content": (
              "Sei un agente che decide se un prompt utente contiene già un "
@@ -164,149 +832,692 @@ def router_node(state: State) -> str:
          )},
         {"role": "user", "content": f"Prompt: {prompt_text}"}
     ]
-    resp = llm(messages)
+
+def router_node(state: State) -> str:
+    resp = llm.invoke(router_messages(state))
+    decision = resp.content.strip().lower()
+    return "search_sources" if decision == "search_sources" else "choose_topic"
+
+async def arouter_node(state: State) -> str:
+    resp = await llm.ainvoke(router_messages(state))
     decision = resp.content.strip().lower()
     return "search_sources" if decision == "search_sources" else "choose_topic"
 
+def _topics_update(ranked: List[str]) -> State:
+    if not ranked:
+        raise RuntimeError("Nessun topic gaming individuato automaticamente.")
+    print(f"[INFO] Topic gaming individuati: {ranked}")
+    return {"topics": ranked}
+
+# Trends e classificazione non sono più sul percorso della richiesta: i candidati
+# arrivano dal pool condiviso, aggiornato in background (vedi topics.py)
 def choose_topic_node(state: State) -> State:
-    global_tr = trends.get_trending(country="", n=30)
-    italy_tr = trends.get_trending(country="italy", n=30)
-    combined = list(dict.fromkeys(global_tr + italy_tr))
-    for term in combined:
-        if classifier.is_gaming(term):
-            state["topic"] = term
-            print(f"[INFO] Topic selezionato: {term}")
-            return state
-    raise RuntimeError("Nessun topic gaming individuato automaticamente.")
+    return _topics_update(topic_pool.candidates())
 
-def select_topic_node(state: State) -> State:
-    print("Scegli un argomento tra i seguenti:")
+async def achoose_topic_node(state: State) -> State:
+    return _topics_update(await topic_pool.acandidates())
+
+def _apply_topic_choice(state: State, answer: str) -> State:
     topics = state["topics"]
-    for i, topic in enumerate(topics):
-        print(f"{i + 1}. {topic}")
-    choice = int(input("Scegli un numero: ")) - 1
+    choice = int(answer) - 1
     if 0 <= choice < len(topics):
         state["topic"] = topics[choice]
         return state
     else:
         raise ValueError("Scelta non valida.")
 
+# Una scelta non valida non chiude il thread: si ripete la domanda (un nuovo interrupt)
+TOPIC_QUESTION = "Scegli un argomento tra quelli elencati (numero): "
+
+# Il topic scelto va in fondo al pool: gli altri thread non lo ripropongono
+def select_topic_node(state: State) -> State:
+    while True:
+        try:
+            state = _apply_topic_choice(state, feedback.ask(TOPIC_QUESTION, state["topics"]))
+        except ValueError:
+            print("Scelta non valida.")
+            continue
+        topic_pool.claim(state["topic"])
+        return state
+
+async def aselect_topic_node(state: State) -> State:
+    while True:
+        try:
+            state = _apply_topic_choice(state, await feedback.aask(TOPIC_QUESTION, state["topics"]))
+        except ValueError:
+            print("Scelta non valida.")
+            continue
+        # UPDATE sincrono su SQLite: fuori dal loop, come le scritture del checkpointer
+        await topic_pool.aclaim(state["topic"])
+        return state
+
+# Prima di spendere ricerche Tavily e una generazione lunga si controlla se il
+# tema è già stato coperto: un quasi-duplicato chiude il thread, gli articoli
+# vicini diventano contesto per i link interni della bozza.
+DUPLICATE_SIMILARITY = 0.92
+
+def _resolve_topic(state: State) -> str:
+    return state.get("topic") or state["prompt"].split("topic:")[-1].strip()
+
+# Nuovo topic: le alternative preparate per quello precedente non valgono più
+NO_CANDIDATES = {"title": [], "images": []}
+
+def related_articles_node(state: State) -> State:
+    topic = _resolve_topic(state)
+    return {"topic": topic, "related": db.related(topic), "candidates": NO_CANDIDATES}
+
+async def arelated_articles_node(state: State) -> State:
+    topic = _resolve_topic(state)
+    return {"topic": topic, "related": await db.arelated(topic), "candidates": NO_CANDIDATES}
+
+def route_related(state: State) -> str:
+    related = state.get("related") or []
+    if related and related[0].get("similarity", 0) >= DUPLICATE_SIMILARITY:
+        print(f"[INFO] Tema già trattato nell'articolo #{related[0]['id']}: {related[0]['title']}")
+        return END
+    return "search_sources"
+
 def search_sources_node(state: State) -> State:
-    topic = state.get("topic") or state["prompt"].split("topic:")[-1].strip()
+    topic = _resolve_topic(state)
+    state["topic"] = topic
+    state["sources"] = tavily.collect(topic)
+    return state
+
+async def asearch_sources_node(state: State) -> State:
+    topic = _resolve_topic(state)
     state["topic"] = topic
-    results = tavily.search(topic, k=15)
-    filtered = [r for r in results if r.get("score", 0) >= 0.6]
-    state["sources"] = filtered
+    state["sources"] = await tavily.acollect(topic)
     return state
 
-def verify_sources_node(state: State) -> Union[str, State]:
-    return state if verifier.verify(state["sources"]) else "choose_topic"
+# I tre rami (titolo, articolo, immagini) partono in parallelo dopo la verifica
+# delle fonti e hanno ciascuno il proprio loop di feedback: un rifiuto rigenera
+# solo la parte rifiutata. Il join avviene in save_node.
+DRAFT_PARTS = {
+    "title": "generate_title",
+    "article": "generate_article",
+    "images": "generate_images",
+}
+# Parti che accettano modifiche puntuali invece della sola rigenerazione
+REVISERS = {
+    "article": "revise_article",
+}
 
-def draft_node(state: State) -> State:
+def verify_sources_node(state: State) -> Union[str, List[str]]:
+    # Troppe poche fonti valide: nuovo topic senza interpellare il verificatore
+    if len(state["sources"]) < tavily.min_sources:
+        return "choose_topic"
+    if not verifier.verify(state["sources"]):
+        return "choose_topic"
+    return list(DRAFT_PARTS.values())
+
+async def averify_sources_node(state: State) -> Union[str, List[str]]:
+    if len(state["sources"]) < tavily.min_sources:
+        return "choose_topic"
+    if not await verifier.averify(state["sources"]):
+        return "choose_topic"
+    return list(DRAFT_PARTS.values())
+
+def title_messages(state: State, n: int = 1):
+    if n > 1:
+        system = (f"Genera {n} titoli SEO click-bait diversi tra loro, max 60 caratteri ciascuno, "
+                  "uno per riga, senza numerazione.")
+    else:
+        system = "Genera un titolo SEO click-bait max 60 caratteri."
+    title_prompt = ChatPromptTemplate.from_messages([
+        ("system", system),
+        ("human", "Topic: {topic}")
+    ])
+    return title_prompt.format_messages(topic=state["topic"])
+
+def _titles_update(titles: List[str]) -> State:
+    return {"draft": {"title": titles[0]}, "approved": {"title": None}, "candidates": {"title": titles[1:]}}
+
+def _model_name() -> str:
+    return getattr(getattr(llm, "bound", llm), "model_name", "")
+
+def generate_title_node(state: State) -> State:
+    ready = speculation.next_candidate(state, "title")
+    if ready:
+        return ready
+    n = 1 + speculation.titles(_model_name())
+    return _titles_update(speculation.parse_titles(llm.invoke(title_messages(state, n)).content, n))
+
+async def agenerate_title_node(state: State) -> State:
+    ready = speculation.next_candidate(state, "title")
+    if ready:
+        return ready
+    n = 1 + speculation.titles(_model_name())
+    return _titles_update(speculation.parse_titles((await llm.ainvoke(title_messages(state, n))).content, n))
+
+def article_messages(state: State):
     topic = state["topic"]
-    sources_text = "\n".join(f"- {s['title']} (→ {s['url']})" for s in state["sources"])
+    sources_text = format_sources(compact_sources(state["sources"]))
     sys_tmpl = SystemMessagePromptTemplate.from_template(
         "Sei un content writer SEO specializzato in videogiochi."
         " Scrivi un articolo di 800-1000 parole sul tema '{topic}' usando un tono informale ma autorevole."
     )
+    related = state.get("related") or []
+    related_text = "\n".join(f"- {r['title']} (articolo #{r['id']})" for r in related) or "nessuno"
     chat_prompt = ChatPromptTemplate.from_messages([
         sys_tmpl,
-        ("human", "Ecco le fonti:\n{sources}\n\nProcedi con la bozza.")
-    ])
-    msgs = chat_prompt.format_messages(topic=topic, sources=sources_text)
-    body = llm(msgs).content
-    title_prompt = ChatPromptTemplate.from_messages([
-        ("system", "Genera un titolo SEO click-bait max 60 caratteri."),
-        ("human", "Topic: {topic}")
+        ("human", "Ecco le fonti:\n{sources}\n\n"
+                  "Articoli già pubblicati da citare come link interni, se pertinenti:\n{related}\n\n"
+                  "Procedi con la bozza.")
     ])
-    title = llm(title_prompt.format_messages(topic=topic)).content.strip()
-    images = [f"https://source.unsplash.com/1600x900/?{topic.replace(' ', '+')}" for _ in range(3)]
-    state['draft'] = {'title': title, 'body': body, 'images': images}
-    return state
+    return chat_prompt.format_messages(topic=topic, sources=sources_text, related=related_text)
+
+# La bozza viene generata in streaming: i token arrivano al revisore (stream_mode
+# "messages") e un verdetto dato a metà chiude il ramo senza passare da
+# feedback_article. Un rifiuto anticipato interrompe subito la generazione.
+def generate_article_node(state: State, config: RunnableConfig) -> State:
+    thread_id = config["configurable"].get("thread_id")
+    feedback.begin_stream(thread_id, "article")
+    body = ""
+    try:
+        for chunk in llm.stream(article_messages(state), config):
+            body += chunk.content
+            if feedback.early_verdict(thread_id, "article") is False:
+                break
+    finally:
+        verdict = feedback.end_stream(thread_id, "article")
+    if verdict is not False:
+        db.save_version(thread_id, "article", body)
+    return {"draft": {"body": body}, "approved": {"article": verdict}, "notes": {"article": ""}}
 
-def feedback_title_node(state: State) -> Union[str, State]:
-    return state if feedback.request("titolo", state['draft']['title']) else "draft"
+async def agenerate_article_node(state: State, config: RunnableConfig) -> State:
+    thread_id = config["configurable"].get("thread_id")
+    feedback.begin_stream(thread_id, "article")
+    body = ""
+    try:
+        async with contextlib.aclosing(llm.astream(article_messages(state), config)) as stream:
+            async for chunk in stream:
+                body += chunk.content
+                if feedback.early_verdict(thread_id, "article") is False:
+                    break
+    finally:
+        verdict = feedback.end_stream(thread_id, "article")
+    if verdict is not False:
+        await db.asave_version(thread_id, "article", body)
+    return {"draft": {"body": body}, "approved": {"article": verdict}, "notes": {"article": ""}}
 
-def feedback_article_node(state: State) -> Union[str, State]:
+# Revisione incrementale: le note del revisore diventano modifiche puntuali
+# (cerca/sostituisci) sulla bozza esistente. Ogni versione resta in
+# draft_versions; se nessuna modifica va a segno si rigenera da capo.
+def _revised(body: str, applied: int) -> State:
+    if not applied:
+        print("[WARN] Nessuna modifica applicabile: rigenero l'articolo")
+        return {"approved": {"article": False}, "notes": {"article": ""}}
+    return {"draft": {"body": body}, "approved": {"article": None}, "notes": {"article": ""}}
+
+def revise_article_node(state: State, config: RunnableConfig) -> State:
+    thread_id = config["configurable"].get("thread_id")
+    notes = state["notes"]["article"]
+    body, applied = revise(llm, state["draft"]["body"], notes, config=config)
+    if applied:
+        db.save_version(thread_id, "article", body, notes)
+    return _revised(body, applied)
+
+async def arevise_article_node(state: State, config: RunnableConfig) -> State:
+    thread_id = config["configurable"].get("thread_id")
+    notes = state["notes"]["article"]
+    body, applied = await arevise(llm, state["draft"]["body"], notes, config=config)
+    if applied:
+        await db.asave_version(thread_id, "article", body, notes)
+    return _revised(body, applied)
+
+def image_urls(state: State) -> List[List[str]]:
+    """Set di immagini candidate (uno più le alternative): ``sig`` li distingue tra loro.
+
+    Gli URL dipendono solo dallo stato: un retry, la ripresa da un checkpoint o
+    lo stesso topic in un altro thread ritrovano le immagini in ``asset_sources``
+    senza scaricarle di nuovo. Dopo il rifiuto di tutti i set, le immagini
+    scartate spostano ``sig`` su un gruppo nuovo.
+    """
+    query = state["topic"].replace(' ', '+')
+    rejected = (state.get("draft") or {}).get("images")
+    start = int(hashlib.sha1(json.dumps(rejected).encode("utf-8")).hexdigest()[:6], 16) if rejected else 0
+    return [[f"https://source.unsplash.com/1600x900/?{query}&sig={start + 3 * s + i}" for i in range(3)]
+            for s in range(1 + speculation.k)]
+
+def _images_update(sets: List[List[str]], refs: List[str]) -> State:
+    # refs è allineato agli URL dei set: si ricompongono i set, senza doppioni (stesso hash)
+    it = iter(refs)
+    local = [list(dict.fromkeys(next(it) for _ in urls)) for urls in sets]
+    return {"draft": {"images": local[0]}, "approved": {"images": None}, "candidates": {"images": local[1:]}}
+
+# Revisore e salvataggio vedono file locali già ridimensionati: tutti i set
+# (anche le alternative) si scaricano insieme, una volta sola
+def generate_images_node(state: State) -> State:
+    ready = speculation.next_candidate(state, "images")
+    if ready:
+        return ready
+    sets = image_urls(state)
+    return _images_update(sets, asset_store.localize([url for urls in sets for url in urls]))
+
+async def agenerate_images_node(state: State) -> State:
+    ready = speculation.next_candidate(state, "images")
+    if ready:
+        return ready
+    sets = image_urls(state)
+    return _images_update(sets, await asset_store.alocalize([url for urls in sets for url in urls]))
+
+def feedback_title_node(state: State) -> State:
+    return {"approved": {"title": feedback.request("titolo", state['draft']['title'])}}
+
+async def afeedback_title_node(state: State) -> State:
+    return {"approved": {"title": await feedback.arequest("titolo", state['draft']['title'])}}
+
+def feedback_article_node(state: State) -> State:
     preview = state['draft']['body'][:500] + '…'
-    return state if feedback.request("articolo", preview) else "draft"
+    approved, notes = feedback.request_edits("articolo", preview)
+    return {"approved": {"article": approved}, "notes": {"article": notes}}
+
+async def afeedback_article_node(state: State) -> State:
+    preview = state['draft']['body'][:500] + '…'
+    approved, notes = await feedback.arequest_edits("articolo", preview)
+    return {"approved": {"article": approved}, "notes": {"article": notes}}
+
+def feedback_images_node(state: State) -> State:
+    return {"approved": {"images": feedback.request("immagini", state['draft']['images'])}}
+
+async def afeedback_images_node(state: State) -> State:
+    return {"approved": {"images": await feedback.arequest("immagini", state['draft']['images'])}}
 
-def feedback_images_node(state: State) -> Union[str, State]:
-    return state if feedback.request("immagini", state['draft']['images']) else "draft"
+def route_generated(part: str):
+    """Dopo la generazione: senza verdetto anticipato si passa al feedback del ramo."""
+    def route(state: State) -> str:
+        verdict = state["approved"].get(part)
+        if verdict is None:
+            return f"feedback_{part}"
+        return "save" if verdict else DRAFT_PARTS[part]
+    return route
+
+def route_feedback(part: str):
+    """Dopo il feedback: approvato → join in save, modifiche richieste → revisione
+    incrementale (se la parte la prevede), rifiutato → rigenera solo quel ramo."""
+    def route(state: State) -> str:
+        if state["approved"].get(part):
+            return "save"
+        if part in REVISERS and (state.get("notes") or {}).get(part):
+            return REVISERS[part]
+        return DRAFT_PARTS[part]
+    return route
+
+def _all_approved(state: State) -> bool:
+    approved = state.get("approved") or {}
+    return all(approved.get(part) for part in DRAFT_PARTS)
 
 def save_node(state: State) -> State:
+    if not _all_approved(state):
+        # Gli altri rami sono ancora in revisione: salverà l'ultimo approvato.
+        return {}
     d = state['draft']
-    aid = db.save(d['title'], d['body'], d['images'])
+    aid = db.save(d['title'], d['body'], d['images'], state.get('topic'))
     print(f"Articolo salvato con ID {aid}")
-    return state
+    # article_id nello stato dell'ultimo checkpoint segna il thread come concluso (vedi checkpoints.py)
+    return {"article_id": aid}
+
+async def asave_node(state: State) -> State:
+    if not _all_approved(state):
+        return {}
+    d = state['draft']
+    aid = await db.asave(d['title'], d['body'], d['images'], state.get('topic'))
+    print(f"Articolo salvato con ID {aid}")
+    return {"article_id": aid}
+
+# Il livello semantico della cache e l'indice semantico degli articoli si
+# abilitano con USE_EMBEDDINGS=1 (embeddings OpenAI).
+@lru_cache(maxsize=1)
+def get_embeddings() -> Optional[Embeddings]:
+    if not os.environ.get("USE_EMBEDDINGS"):
+        return None
+    _set_env("OPENAI_API_KEY")
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(model="text-embedding-3-small")
 
-tools = [choose_topic_node, search_sources_node, verify_sources_node]
-llm = ChatOpenAI(
-    model="gpt-4o-mini",
-    temperature=0.7,
-    streaming=True,
-    verbose=True,
-    callback_manager=cb_manager
-).bind_tools(tools)
-trends = GoogleTrendsAdapter(hl="it-IT", tz=120)
-classifier = TopicClassifier(llm)
-tavily = TavilyAdapter()
-verifier = SourceVerifier(llm)
+# Cache LLM attiva solo per i nodi con risposte riusabili. generate_title resta
+# fuori: dopo un rifiuto deve produrre un titolo diverso, non quello in cache.
+# Solo livello esatto: router (con o senza "topic:" cambia la rotta) e verifica
+# rispondono a quel prompt preciso, e un prompt "simile" darebbe la risposta
+# sbagliata. Il TopicClassifier non passa da qui: i suoi verdetti hanno già la
+# cache per termine in topic_verdicts, e un hit su un blocco posizionale
+# ("1. termine…") assegnerebbe i punteggi ai termini sbagliati.
+llm_cache = Lazy(lambda: LLMCache(
+    policy={
+        "get_user_prompt": "exact",   # router_node
+        "search_sources": "exact",    # SourceVerifier.verify
+    },
+    embeddings=get_embeddings(),
+))
+
+def _make_llm():
+    _set_env("OPENAI_API_KEY")
+    from langchain_core.callbacks import CallbackManager
+    from langchain_openai import ChatOpenAI
+
+    # L'eco dei token su stdout è nella config del grafo (compile_graph), così la
+    # modalità --review può mostrare la bozza in streaming senza stamparla due volte.
+    cb_manager = CallbackManager([resolve(langfuse_handler), scheduler.callback("openai")])
+    tools = [choose_topic_node, search_sources_node, verify_sources_node]
+    return ChatOpenAI(
+        model="gpt-4o-mini",
+        temperature=0.7,
+        streaming=True,
+        stream_usage=True,  # token nel chunk finale anche in streaming (metrics)
+        verbose=True,
+        callback_manager=cb_manager,
+        cache=resolve(llm_cache),
+        # RPM/TPM e priorità dallo scheduler; i retry su 429/5xx li fa il client OpenAI
+        rate_limiter=scheduler.rate_limiter("openai"),
+        max_retries=6,
+    ).bind_tools(tools)
+
+def _make_tavily() -> TavilyAdapter:
+    _set_env("TAVILY_API_KEY")
+    return TavilyAdapter()
+
+# Singleton creati al primo uso: importare il modulo non apre connessioni né client
+llm = Lazy(_make_llm)
+trends = Lazy(lambda: GoogleTrendsAdapter(hl="it-IT", tz=120))
+classifier = Lazy(lambda: TopicClassifier(llm, conn=resolve(conn), lock=memory.lock))
+tavily = Lazy(_make_tavily)
+speculation = Speculation()
+verifier = Lazy(lambda: SourceVerifier(llm))
 feedback = HumanFeedback()
-db = ArticleDB()
+db = Lazy(lambda: ArticleDB(embeddings=get_embeddings(), conn=resolve(conn), lock=memory.lock))
+retention = Lazy(lambda: CheckpointRetention(DB_PATH, keep_last=10, keep_finished=1, serde=resolve(serde)))
+# db prima del pool: la novità dei topic si misura sugli articoli già pubblicati
+asset_store = Lazy(lambda: AssetStore(conn=resolve(conn), lock=memory.lock))
+topic_pool = Lazy(lambda: TopicPool(trends, classifier, resolve(db), conn=resolve(conn), lock=memory.lock))
 
+# Nodi e router hanno una variante sync e una async: lo stesso grafo compilato
+# può essere eseguito con invoke/stream oppure con ainvoke/astream.
 builder = StateGraph(State)
-builder.add_node("get_user_prompt", get_user_prompt_node)
-builder.add_node("router", router_node)
-builder.add_node("choose_topic", ToolNode([choose_topic_node]))
-builder.add_node("select_topic", select_topic_node)
-builder.add_node("search_sources", search_sources_node)
-builder.add_node("verify_sources", verify_sources_node)
-builder.add_node("draft", draft_node)
-builder.add_node("feedback_title", feedback_title_node)
-builder.add_node("feedback_article", feedback_article_node)
-builder.add_node("feedback_images", feedback_images_node)
-builder.add_node("save", save_node)
-
-builder.set_entry_point(START)
+builder.add_node("get_user_prompt", RunnableLambda(get_user_prompt_node, afunc=aget_user_prompt_node))
+builder.add_node("choose_topic", RunnableLambda(choose_topic_node, afunc=achoose_topic_node))
+builder.add_node("select_topic", RunnableLambda(select_topic_node, afunc=aselect_topic_node))
+builder.add_node("related_articles", RunnableLambda(related_articles_node, afunc=arelated_articles_node))
+builder.add_node("search_sources", RunnableLambda(search_sources_node, afunc=asearch_sources_node))
+builder.add_node("generate_title", RunnableLambda(generate_title_node, afunc=agenerate_title_node))
+builder.add_node("generate_article", RunnableLambda(generate_article_node, afunc=agenerate_article_node))
+builder.add_node("generate_images", RunnableLambda(generate_images_node, afunc=agenerate_images_node))
+builder.add_node("revise_article", RunnableLambda(revise_article_node, afunc=arevise_article_node))
+builder.add_node("feedback_title", RunnableLambda(feedback_title_node, afunc=afeedback_title_node))
+builder.add_node("feedback_article", RunnableLambda(feedback_article_node, afunc=afeedback_article_node))
+builder.add_node("feedback_images", RunnableLambda(feedback_images_node, afunc=afeedback_images_node))
+builder.add_node("save", RunnableLambda(save_node, afunc=asave_node))
+
 builder.add_edge(START, "get_user_prompt")
-builder.add_edge("get_user_prompt", "router")
-builder.add_conditional_edges("router", router_node)
+builder.add_conditional_edges(
+    "get_user_prompt",
+    RunnableLambda(router_node, afunc=arouter_node),
+    {"choose_topic": "choose_topic", "search_sources": "related_articles"}
+)
 builder.add_edge("choose_topic", "select_topic")
-builder.add_edge("select_topic", "search_sources")
-builder.add_edge("search_sources", "verify_sources")
-builder.add_edge("verify_sources", "choose_topic", condition=lambda out: out == "choose_topic")
-builder.add_edge("verify_sources", "draft", condition=lambda _: True)
-builder.add_edge("draft", "feedback_title")
-builder.add_edge("feedback_title", "draft", condition=lambda out: out == "draft")
-builder.add_edge("feedback_title", "feedback_article")
-builder.add_edge("feedback_article", "draft", condition=lambda out: out == "draft")
-builder.add_edge("feedback_article", "feedback_images")
-builder.add_edge("feedback_images", "draft", condition=lambda out: out == "draft")
-builder.add_edge("feedback_images", "save")
+builder.add_edge("select_topic", "related_articles")
+builder.add_conditional_edges("related_articles", route_related, ["search_sources", END])
+builder.add_conditional_edges(
+    "search_sources",
+    RunnableLambda(verify_sources_node, afunc=averify_sources_node),
+    ["choose_topic", *DRAFT_PARTS.values()]
+)
+for part, generator in DRAFT_PARTS.items():
+    builder.add_conditional_edges(generator, route_generated(part), [f"feedback_{part}", generator, "save"])
+    reviser = [REVISERS[part]] if part in REVISERS else []
+    builder.add_conditional_edges(f"feedback_{part}", route_feedback(part), [generator, *reviser, "save"])
+for part, reviser in REVISERS.items():
+    builder.add_conditional_edges(reviser, route_generated(part), [f"feedback_{part}", DRAFT_PARTS[part], "save"])
 builder.add_edge("save", END)
 
-human_feedback_nodes = [
-    "select_topic",
-    "feedback_title",
-    "feedback_article",
-    "feedback_images"
-]
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser("Gaming Blog Assistant")
-    parser.add_argument("prompt", help="You are a helpful assistant for a gaming blog.")
-    args = parser.parse_args()
-    init_state: State = {"prompt": args.prompt}
-    graph = builder.compile(interrupt_before=human_feedback_nodes).with_config(
+# I nodi che chiedono qualcosa al revisore (get_user_prompt senza prompt,
+# select_topic, feedback_*) si sospendono da soli con un interrupt: il thread
+# resta nel checkpointer finché non arriva la risposta (reviews.py).
+def compile_graph(checkpointer, echo_tokens: bool = True):
+    callbacks = [resolve(langfuse_handler), MetricsCallback(metrics)]
+    callbacks += [StreamingStdOutCallbackHandler()] if echo_tokens else []
+    return builder.compile(checkpointer=resolve(checkpointer)).with_config(
         llm=llm,
         langfuse=langfuse_handler,
         verbose=True,
         max_iterations=10,
         max_tokens=2000,
-        checkpointer=memory,
-        callbacks=[langfuse_handler, StreamingStdOutCallbackHandler()],
+        callbacks=callbacks,
         timeout=30,
     )
-    display(Image(graph.get_graph().draw_mermaid_png()))
-    graph.invoke(init_state)
\ No newline at end of file
+
+@lru_cache(maxsize=None)
+def get_graph(echo_tokens: bool = True):
+    """Grafo compilato sul checkpointer SQLite del processo: costruito una volta, riusato a ogni invocazione."""
+    return compile_graph(memory, echo_tokens)
+
+def draw_graph(path: Path) -> None:
+    """Salva il diagramma del grafo: ``.png`` passa dal servizio remoto di Mermaid, altrimenti sorgente Mermaid."""
+    drawable = builder.compile().get_graph()
+    if path.suffix.lower() == ".png":
+        path.write_bytes(drawable.draw_mermaid_png())
+    else:
+        path.write_text(drawable.draw_mermaid(), encoding="utf-8")
+
+async def arun(init_state: State, config: Dict[str, Any]) -> None:
+    """Esegue il workflow con ainvoke/astream su un checkpointer asincrono."""
+    async with async_checkpointer() as saver:
+        graph = compile_graph(saver)
+        payload: Any = init_state
+        while True:
+            async for update in graph.astream(payload, config, stream_mode="updates"):
+                print(update)
+            reviews = pending_reviews(await graph.aget_state(config))
+            if not reviews:
+                break
+            payload = Command(resume={
+                r["review_id"]: await asyncio.to_thread(input, format_review(r) + " ") for r in reviews
+            })
+
+async def areview(init_state: State, config: Dict[str, Any]) -> None:
+    """Sessione di revisione interattiva con la bozza mostrata token per token.
+
+    Durante lo streaming dell'articolo basta scrivere ``y`` o ``n`` + INVIO per
+    approvarlo o scartarlo senza aspettare la fine; alle revisioni in attesa
+    la sessione risponde con la riga successiva e riprende subito il thread.
+    """
+    global feedback
+    feedback = reviewer = StreamingReviewer()
+    reviewer.start()
+    async with async_checkpointer() as saver:
+        graph = compile_graph(saver, echo_tokens=False)
+        payload: Any = init_state
+        while True:
+            async for chunk, meta in graph.astream(payload, config, stream_mode="messages"):
+                if meta.get("langgraph_node") == "generate_article" and chunk.content:
+                    print(chunk.content, end="", flush=True)
+            reviews = pending_reviews(await graph.aget_state(config))
+            if not reviews:
+                break
+            answers = {}
+            for review in reviews:
+                print(format_review(review), end=" ", flush=True)
+                answers[review["review_id"]] = await reviewer.answers.get()
+            payload = Command(resume=answers)
+
+# =============================================================================
+# MODALITÀ BATCH
+# =============================================================================
+def load_batch(path: Path) -> List[Dict[str, str]]:
+    """Legge i prompt da un file JSONL.
+
+    Ogni riga deve avere ``prompt`` (in alternativa ``body`` o ``title``) e può
+    indicare il proprio ``thread_id`` (o ``request_id``/``id``). In mancanza, il
+    thread_id deriva dall'hash del prompt: rilanciando lo stesso file dopo un
+    crash ogni elemento ritrova il proprio checkpoint.
+    """
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            raw = json.loads(line)
+            prompt = raw.get("prompt") or raw.get("body") or raw.get("title")
+            if not prompt:
+                raise ValueError(f"{path}:{line_no}: nessun prompt")
+            thread_id = raw.get("thread_id") or raw.get("request_id") or raw.get("id")
+            if not thread_id:
+                thread_id = "batch-" + hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12]
+            items.append({"thread_id": str(thread_id), "prompt": prompt})
+    return items
+
+async def _arun_batch_item(graph, item: Dict[str, str], limit: asyncio.Semaphore, emit) -> None:
+    config = {"configurable": {"thread_id": item["thread_id"]}}
+    async with limit:
+        try:
+            snapshot = await graph.aget_state(config)
+            if snapshot.values and not snapshot.next:
+                emit(item, "done", snapshot)
+                return
+            if pending_reviews(snapshot):
+                emit(item, "awaiting_review", snapshot)
+                return
+            # Checkpoint a metà (crash precedente): si riparte da lì senza rieseguire i nodi completati
+            resume = bool(snapshot.next)
+            emit(item, "resumed" if resume else "started")
+            await graph.ainvoke(None if resume else {"prompt": item["prompt"]}, config)
+            snapshot = await graph.aget_state(config)
+            emit(item, "awaiting_review" if pending_reviews(snapshot) else "done", snapshot)
+        except Exception as e:
+            emit(item, "error", error=f"{type(e).__name__}: {e}")
+
+async def arun_batch(path: Path, workers: int = 4, output=sys.stdout, review_port: Optional[int] = None) -> None:
+    """Esegue ogni prompt del file come thread separato su un pool di ``workers`` task.
+
+    Stato e risultati di ogni elemento vengono scritti su ``output`` come JSONL
+    man mano che cambiano; i nodi di feedback umano restano in attesa
+    (``awaiting_review``) nel checkpoint e i worker passano all'elemento
+    successivo. Con ``review_port`` le revisioni si fanno via HTTP mentre il
+    batch gira: ogni risposta riprende il thread in background e il processo
+    termina quando nessun elemento è più in attesa.
+    """
+    def emit(item: Dict[str, str], status: str, snapshot=None, error: Optional[str] = None) -> None:
+        record: Dict[str, Any] = {"thread_id": item["thread_id"], "status": status}
+        if snapshot is not None:
+            record["next"] = list(snapshot.next)
+            record["topic"] = snapshot.values.get("topic")
+            record["draft"] = snapshot.values.get("draft")
+            record["article_id"] = snapshot.values.get("article_id")
+        if error:
+            record["error"] = error
+        output.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        output.flush()
+
+    items = load_batch(path)
+    limit = asyncio.Semaphore(workers)
+    # Su stdout solo JSONL: i print dei nodi ([INFO], [WARN]...) vanno su stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        await _arun_batch(items, limit, emit, review_port)
+
+async def _arun_batch(items: List[Dict[str, str]], limit: asyncio.Semaphore, emit,
+                      review_port: Optional[int]) -> None:
+    # Retention dei checkpoint e pool dei topic in background mentre i worker scrivono
+    retention.start_background()
+    topic_pool.start_background()
+    try:
+        # Il lavoro batch cede il passo alle sessioni interattive sugli stessi limiti
+        with scheduler.priority(BATCH):
+            async with async_checkpointer() as saver:
+                # Niente eco dei token: su stdout c'è il JSONL dei risultati
+                graph = compile_graph(saver, echo_tokens=False)
+                server = None
+                if review_port:
+                    def on_update(thread_id: str, snapshot) -> None:
+                        status = "awaiting_review" if pending_reviews(snapshot) else "done"
+                        emit({"thread_id": thread_id}, status, snapshot)
+                    queue = ReviewQueue(graph, DB_PATH, on_update=on_update)
+                    server = queue.serve(port=review_port, assets=asset_store.root)
+                try:
+                    await asyncio.gather(*(_arun_batch_item(graph, item, limit, emit) for item in items))
+                    if server:
+                        await queue.wait_done([item["thread_id"] for item in items])
+                finally:
+                    if server:
+                        server.shutdown()
+    finally:
+        retention.stop()
+        topic_pool.stop()
+        await asyncio.to_thread(retention.compact)
+
+async def areviews(answer: Optional[List[str]] = None, output=sys.stdout) -> None:
+    """Elenca le revisioni in attesa (JSONL) o, con ``answer`` = [thread_id, review_id, testo],
+    risponde a una e riprende il thread fino alla revisione successiva."""
+    with contextlib.redirect_stdout(sys.stderr):
+        reviews = await _areviews(answer)
+    for review in reviews:
+        output.write(json.dumps(review, ensure_ascii=False, default=str) + "\n")
+
+async def _areviews(answer: Optional[List[str]]) -> List[Dict[str, Any]]:
+    async with async_checkpointer() as saver:
+        queue = ReviewQueue(compile_graph(saver, echo_tokens=False), DB_PATH)
+        if answer:
+            thread_id, review_id, text = answer
+            if not await queue.answer(thread_id, review_id, text, wait=True):
+                raise SystemExit(f"Nessuna revisione '{review_id}' in attesa sul thread {thread_id}")
+            reviews = await queue.pending(thread_id)
+        else:
+            reviews = await queue.pending()
+    return reviews
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Gaming Blog Assistant")
+    parser.add_argument("prompt", nargs="?", help="You are a helpful assistant for a gaming blog.")
+    parser.add_argument("--thread-id", default="1", help="thread_id del checkpoint")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="esegue il grafo con astream invece di invoke")
+    parser.add_argument("--review", action="store_true",
+                        help="revisione interattiva con la bozza in streaming (approva/scarta a metà)")
+    parser.add_argument("--batch", type=Path, help="file JSONL di prompt da generare in batch")
+    parser.add_argument("--workers", type=int, default=4, help="articoli generati in parallelo (batch)")
+    parser.add_argument("--output", default="-", help="file JSONL dei risultati batch ('-' = stdout)")
+    parser.add_argument("--speculative", type=int, default=SPECULATIVE_K, metavar="K",
+                        help="alternative di titolo e immagini preparate in anticipo (0 = disattivo)")
+    parser.add_argument("--speculative-max-cost", type=float, default=SPECULATIVE_MAX_COST,
+                        help="tetto di costo (USD) dei token extra per generazione di titoli")
+    parser.add_argument("--serve-reviews", type=int, metavar="PORTA",
+                        help="durante il batch, revisioni via HTTP su 127.0.0.1:PORTA")
+    parser.add_argument("--draw", type=Path, metavar="FILE",
+                        help="salva il diagramma del grafo (.png tramite mermaid.ink, altrimenti .mmd)")
+    parser.add_argument("--refresh-topics", action="store_true",
+                        help="aggiorna subito il pool dei topic di tendenza e lo stampa")
+    parser.add_argument("--reviews", action="store_true", help="elenca le revisioni in attesa (JSONL)")
+    parser.add_argument("--answer", nargs=3, metavar=("THREAD_ID", "REVIEW_ID", "TESTO"),
+                        help="risponde a una revisione in attesa e riprende il thread")
+    parser.add_argument("--min-score", type=float, default=SOURCE_MIN_SCORE,
+                        help="punteggio Tavily minimo di una fonte")
+    parser.add_argument("--min-sources", type=int, default=MIN_SOURCES,
+                        help="fonti valide sotto le quali si cambia topic")
+    args = parser.parse_args()
+    if (args.min_score, args.min_sources) != (SOURCE_MIN_SCORE, MIN_SOURCES):
+        # Solo se cambiano: --reviews/--draw non devono creare il client Tavily
+        tavily.min_score, tavily.min_sources = args.min_score, args.min_sources
+    speculation.k, speculation.max_cost = args.speculative, args.speculative_max_cost
+    init_state: State = {"prompt": args.prompt}
+    config = {"configurable": {"thread_id": args.thread_id}}
+    if args.draw:
+        draw_graph(args.draw)
+    if args.refresh_topics:
+        for topic in topic_pool.refresh(force=True):
+            print(topic)
+    if args.reviews or args.answer:
+        asyncio.run(areviews(args.answer))
+    elif args.batch:
+        out = sys.stdout if args.output == "-" else open(args.output, "a", encoding="utf-8")
+        try:
+            asyncio.run(arun_batch(args.batch, args.workers, out, args.serve_reviews))
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    elif not args.prompt:
+        if not (args.draw or args.refresh_topics):
+            parser.error("serve un prompt oppure --batch FILE")
+    elif args.review:
+        asyncio.run(areview(init_state, config))
+    elif args.use_async:
+        asyncio.run(arun(init_state, config))
+    else:
+        answer_interactively(get_graph(), init_state, config)
\ No newline at end of file
@@ -0,0 +1,253 @@
+# coding: utf-8
+"""
+Archivio locale delle immagini
+==============================
+
+Gli articoli non puntano più a link remoti (``source.unsplash.com``,
+risultati Unsplash) che possono cambiare tra revisione e pubblicazione o
+rispondere lentamente. ``AssetStore`` scarica le immagini candidate in
+parallelo con il client HTTP condiviso (vedi httpclient.py) e le conserva su
+disco indirizzate per contenuto::
+
+    assets/ab/ab12…ef.jpg          originale (sha256 dei byte)
+    assets/ab/ab12…ef-web.webp     varianti ridimensionate, create una volta sola
+    assets/ab/ab12…ef-thumb.webp
+
+Bozze, revisore e archivio articoli ricevono un URL, non un percorso:
+``/assets/ab/ab12…ef-web.webp`` (prefisso ``ASSET_URL``), servito così com'è
+dall'endpoint delle revisioni (vedi reviews.py) o da qualsiasi web server che
+pubblichi ``ASSET_DIR`` sotto quel prefisso. ``path_of`` fa il percorso inverso.
+
+La stessa immagine arrivata da URL diversi occupa un solo file, e un URL già
+scaricato (da qualsiasi articolo) non torna in rete: la tabella
+``asset_sources`` lo risolve direttamente nell'hash.
+
+Le varianti richiedono Pillow (``pip install pillow``): senza, ogni variante
+è l'originale. Un download non riuscito non blocca il nodo: ``localize``
+restituisce al suo posto l'URL remoto.
+"""
+
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+from typing import Dict, List, Optional, Sequence, Tuple, TypedDict
+
+import httpclient
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow è opzionale: senza, niente varianti ridimensionate
+    Image = None
+
+ASSET_DIR = Path(os.environ.get("ASSET_DIR", "./assets"))
+# Prefisso degli URL pubblici di ASSET_DIR (percorso o URL assoluto di una CDN)
+ASSET_URL = os.environ.get("ASSET_URL", "/assets").rstrip("/")
+# Larghezza massima (px) di ogni variante; l'immagine non viene mai ingrandita
+VARIANTS: Dict[str, int] = {"web": 1600, "card": 800, "thumb": 400}
+VARIANT_FORMAT = ("WEBP", "webp", 82)  # formato Pillow, estensione, qualità
+MAX_BYTES = 15 * 2**20
+EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif",
+              "image/avif": "avif"}
+
+_DIGEST = re.compile(r"^([0-9a-f]{64})(?:-\w+)?\.\w+$")
+
+
+class Asset(TypedDict):
+    hash: str
+    path: str                  # originale
+    variants: Dict[str, str]   # nome variante → percorso
+    width: Optional[int]
+    height: Optional[int]
+
+
+def digest_of(ref: str) -> Optional[str]:
+    """Hash dell'asset a cui punta un riferimento dell'archivio (``None`` per gli URL esterni)."""
+    if not ref.startswith(ASSET_URL + "/"):
+        return None
+    match = _DIGEST.match(Path(urlparse(ref).path).name)
+    return match.group(1) if match else None
+
+
+class AssetStore:
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS assets (
+            hash TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            mime TEXT,
+            bytes INTEGER NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            variants TEXT NOT NULL DEFAULT '{}',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        """CREATE TABLE IF NOT EXISTS asset_sources (
+            url TEXT PRIMARY KEY,
+            hash TEXT NOT NULL
+        )""",
+    )
+
+    def __init__(self, root: Path = ASSET_DIR, conn: Optional[sqlite3.Connection] = None,
+                 lock: Optional[threading.Lock] = None, variants: Optional[Dict[str, int]] = None,
+                 concurrency: int = 8):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        # Senza connessione condivisa l'indice sta accanto ai file
+        self.conn = conn if conn is not None else sqlite3.connect(self.root / "assets.sqlite",
+                                                                  check_same_thread=False)
+        self.lock = lock if lock is not None else threading.Lock()
+        self.variants = VARIANTS if variants is None else variants
+        self.concurrency = concurrency
+        with self.lock, self.conn:
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
+
+    # --- indice -----------------------------------------------------------------
+    def get(self, digest: str) -> Optional[Asset]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT hash, path, variants, width, height FROM assets WHERE hash = ?", (digest,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"hash": row[0], "path": row[1], "variants": json.loads(row[2]), "width": row[3], "height": row[4]}
+
+    def lookup(self, url: str) -> Optional[Asset]:
+        """Asset già scaricato da ``url``, se il file è ancora su disco."""
+        with self.lock:
+            row = self.conn.execute("SELECT hash FROM asset_sources WHERE url = ?", (url,)).fetchone()
+        asset = self.get(row[0]) if row else None
+        return asset if asset and Path(asset["path"]).exists() else None
+
+    @staticmethod
+    def ref(asset: Asset, variant: str = "web") -> str:
+        """URL della variante (l'originale se manca): ``ASSET_URL/<ab>/<file>``."""
+        path = Path(asset["variants"].get(variant, asset["path"]))
+        return f"{ASSET_URL}/{path.parent.name}/{path.name}"
+
+    def path_of(self, ref: str) -> Optional[Path]:
+        """File locale di un riferimento restituito da ``ref`` (``None`` se è un URL esterno)."""
+        if digest_of(ref) is None:
+            return None
+        return self.root / ref[len(ASSET_URL) + 1:]
+
+    # --- scrittura --------------------------------------------------------------
+    def _write(self, path: Path, data: bytes) -> None:
+        # Scrittura atomica: due worker con la stessa immagine scrivono byte identici
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def _variants(self, original: Path, digest: str) -> Tuple[Dict[str, str], Optional[int], Optional[int]]:
+        """Varianti ridimensionate (create solo se mancano) e dimensioni dell'originale."""
+        if Image is None:
+            return {}, None, None
+        fmt, ext, quality = VARIANT_FORMAT
+        try:
+            with Image.open(original) as img:
+                img.load()
+                size = img.size
+                if img.mode not in ("RGB", "RGBA"):
+                    img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+                out = {}
+                for name, width in self.variants.items():
+                    path = original.with_name(f"{digest}-{name}.{ext}")
+                    if not path.exists():
+                        variant = img.copy()
+                        variant.thumbnail((width, width * 4))
+                        tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+                        variant.save(tmp, fmt, quality=quality)
+                        os.replace(tmp, path)
+                    out[name] = str(path)
+                return out, size[0], size[1]
+        except Exception as e:  # immagine non decodificabile: resta solo l'originale
+            print(f"[WARN] Varianti non create per {original.name}: {e}")
+            return {}, None, None
+
+    def store(self, data: bytes, mime: Optional[str] = None, url: Optional[str] = None) -> Asset:
+        """Salva ``data`` (se non c'è già) con le sue varianti e registra l'URL di origine."""
+        digest = hashlib.sha256(data).hexdigest()
+        asset = self.get(digest)
+        if asset is None or not Path(asset["path"]).exists():
+            ext = EXTENSIONS.get((mime or "").split(";")[0].strip(), "bin")
+            original = self.root / digest[:2] / f"{digest}.{ext}"
+            if not original.exists():
+                self._write(original, data)
+            variants, width, height = self._variants(original, digest)
+            asset = {"hash": digest, "path": str(original), "variants": variants, "width": width, "height": height}
+            with self.lock, self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO assets(hash, path, mime, bytes, width, height, variants) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (digest, str(original), mime, len(data), width, height, json.dumps(variants))
+                )
+        if url:
+            with self.lock, self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO asset_sources(url, hash) VALUES (?, ?)", (url, digest))
+        return asset
+
+    @staticmethod
+    def _check(url: str, response) -> str:
+        response.raise_for_status()
+        mime = (response.headers.get("content-type") or "").split(";")[0].strip()
+        if not mime.startswith("image/"):
+            raise ValueError(f"{url} non è un'immagine ({mime or 'content-type assente'})")
+        if len(response.content) > MAX_BYTES:
+            raise ValueError(f"{url} supera {MAX_BYTES // 2**20} MiB")
+        return mime
+
+    # --- download ---------------------------------------------------------------
+    def fetch(self, url: str) -> Optional[Asset]:
+        asset = self.lookup(url)
+        if asset:
+            return asset
+        try:
+            response = httpclient.client().get(url)
+            return self.store(response.content, self._check(url, response), url)
+        except Exception as e:
+            print(f"[WARN] Download immagine non riuscito: {e}")
+            return None
+
+    async def afetch(self, url: str, limit: asyncio.Semaphore) -> Optional[Asset]:
+        asset = await asyncio.to_thread(self.lookup, url)
+        if asset:
+            return asset
+        try:
+            async with limit:
+                response = await httpclient.async_client().get(url)
+            # Hash, scrittura su disco e ridimensionamento fuori dal loop
+            return await asyncio.to_thread(self.store, response.content, self._check(url, response), url)
+        except Exception as e:
+            print(f"[WARN] Download immagine non riuscito: {e}")
+            return None
+
+    def fetch_many(self, urls: Sequence[str]) -> List[Optional[Asset]]:
+        """Scarica gli URL in parallelo; il risultato è allineato a ``urls``."""
+        unique = list(dict.fromkeys(urls))
+        if not unique:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(unique))) as pool:
+            found = dict(zip(unique, pool.map(self.fetch, unique)))
+        return [found[url] for url in urls]
+
+    async def afetch_many(self, urls: Sequence[str]) -> List[Optional[Asset]]:
+        unique = list(dict.fromkeys(urls))
+        limit = asyncio.Semaphore(self.concurrency)
+        found = dict(zip(unique, await asyncio.gather(*(self.afetch(url, limit) for url in unique))))
+        return [found[url] for url in urls]
+
+    def localize(self, urls: Sequence[str], variant: str = "web") -> List[str]:
+        """Riferimenti locali (variante ``variant``) al posto degli URL; l'URL resta se il download fallisce."""
+        return [self.ref(asset, variant) if asset else url for url, asset in zip(urls, self.fetch_many(urls))]
+
+    async def alocalize(self, urls: Sequence[str], variant: str = "web") -> List[str]:
+        assets = await self.afetch_many(urls)
+        return [self.ref(asset, variant) if asset else url for url, asset in zip(urls, assets)]
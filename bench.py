@@ -0,0 +1,544 @@
+# coding: utf-8
+"""
+Benchmark offline dei due workflow
+==================================
+
+Esegue N articoli end-to-end su ``agent_2.py`` e ``agent.py`` senza rete e
+senza costi: ``ChatOpenAI``, Tavily, Google Trends, il feedback umano e le
+chiamate HTTP a Bing/Unsplash (``httpclient``) sono sostituiti da fake deterministici con
+latenza configurabile. Misura quindi il costo proprio dei workflow (grafo,
+checkpoint, cache, SQLite) e permette di confrontare le ottimizzazioni.
+
+Per ogni grafo riporta throughput, latenza per nodo (p50/p95, da
+``metrics.py``), byte di checkpoint scritti e picco di memoria (tracemalloc).
+Tutti i file SQLite vengono creati in una directory temporanea.
+
+Uso::
+
+    python bench.py -n 20 --workers 4
+    python bench.py -n 20 --llm-latency 0.2 --output bench.jsonl
+    python bench.py -n 20 --baseline bench.jsonl   # confronto con l'ultimo risultato salvato
+
+Ogni risultato porta commit git e parametri: due righe di ``bench.jsonl``
+con gli stessi parametri sono confrontabili tra commit diversi.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from unittest import mock
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from lazy import resolve
+
+REPO = Path(__file__).resolve().parent
+
+TOPICS = [
+    "Elden Ring Nightreign", "Hollow Knight Silksong", "GTA VI", "Nintendo Switch 2",
+    "Metroid Prime 4", "Death Stranding 2", "Hades II", "The Witcher 4",
+    "Monster Hunter Wilds", "Doom The Dark Ages", "Mafia The Old Country", "Ghost of Yotei",
+]
+
+
+def _digest(text: str) -> int:
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+# =============================================================================
+# FAKE
+# =============================================================================
+class FakeChatModel(BaseChatModel):
+    """Modello deterministico: la risposta dipende solo dal prompt.
+
+    Riconosce i prompt dei due workflow (router, classificazione trend,
+    verifica fonti, titolo) e per tutto il resto restituisce ``words`` parole
+    di testo. ``latency`` simula il tempo al primo token, ``token_latency``
+    quello di ogni token in streaming.
+    """
+    latency: float = 0.0
+    token_latency: float = 0.0
+    words: int = 800
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": "fake", "words": self.words}
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "FakeChatModel":
+        return self
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        text = "\n".join(str(m.content) for m in messages)
+        last = str(messages[-1].content) if messages else ""
+        if "topic suggerito" in text:
+            return "search_sources" if "topic:" in last else "choose_topic"
+        if "oggetto JSON" in text:
+            terms = [line for line in last.splitlines() if line.strip()]
+            return json.dumps({str(i + 1): 8 if _digest(t) % 3 else 2 for i, t in enumerate(terms)})
+        if "SÌ o NO" in text:
+            return "SÌ"
+        many = re.search(r"(\d+) titoli", text)
+        if many:
+            return "\n".join(f"Titolo {(_digest(text) + i) % 10000}: tutto quello che sappiamo"
+                             for i in range(int(many.group(1))))
+        if "titolo" in text.lower():
+            return f"Titolo {_digest(text) % 10000}: tutto quello che sappiamo"
+        seed = _digest(text)
+        return " ".join(f"parola{(seed + i) % 997}" for i in range(self.words))
+
+    def _message(self, messages: List[BaseMessage], content: str) -> AIMessage:
+        prompt_tokens = sum(len(str(m.content).split()) for m in messages)
+        completion_tokens = len(content.split())
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        })
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, self._respond(messages)))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, self._respond(messages)))])
+
+    def _chunks(self, messages: List[BaseMessage]) -> Iterator[ChatGenerationChunk]:
+        content = self._respond(messages)
+        for word in content.split(" "):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+        usage = self._message(messages, content).usage_metadata
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=usage))
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for chunk in self._chunks(messages):
+            time.sleep(self.token_latency)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any):
+        await asyncio.sleep(self.latency)
+        for chunk in self._chunks(messages):
+            await asyncio.sleep(self.token_latency)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class FakeSearch:
+    """Tavily, Bing, Unsplash e Google Trends con risultati sintetici."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def tavily_results(self, query: str, k: int, exclude: List[str] = ()) -> List[Dict[str, Any]]:
+        seed = _digest(str(query))
+        results = []
+        for i in range(k * 2):
+            domain = f"site{(seed + i) % 50}.example"
+            if domain in exclude or len(results) >= k:
+                continue
+            results.append({
+                "title": f"{query} - fonte {i}",
+                "url": f"https://www.{domain}/{seed % 1000}/{i}",
+                "content": f"Contenuto {i} su {query}. " * 20,
+                "score": round(0.95 - 0.08 * i, 2),
+            })
+        return results
+
+    # --- TavilyClient / AsyncTavilyClient -----------------------------------
+    def search(self, query: str, max_results: int = 5, exclude_domains: List[str] = (), **kwargs: Any):
+        self.calls += 1
+        time.sleep(self.latency)
+        return {"results": self.tavily_results(query, max_results, exclude_domains)}
+
+    async def asearch(self, query: str, max_results: int = 5, exclude_domains: List[str] = (), **kwargs: Any):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return {"results": self.tavily_results(query, max_results, exclude_domains)}
+
+    # --- tavily_tool / TavilySearchResults (agent.py) ---------------------------------------
+    def tool(self, max_results: int = 3, **kwargs: Any) -> SimpleNamespace:
+        def invoke(query: Any) -> List[Dict[str, Any]]:
+            return self.search(str(query), max_results)["results"]
+
+        async def ainvoke(query: Any) -> List[Dict[str, Any]]:
+            return (await self.asearch(str(query), max_results))["results"]
+        return SimpleNamespace(invoke=invoke, ainvoke=ainvoke)
+
+    # --- httpclient: client sincrono / asincrono (Bing, Unsplash, immagini) ----
+    def http_json(self, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        seed = _digest(json.dumps(params, sort_keys=True, default=str))
+        if "unsplash" in url:
+            return {"results": [{"urls": {"regular": f"https://images.example/{seed}/{i}.jpg"}}
+                                for i in range(params.get("per_page", 3))]}
+        return {"webPages": {"value": [
+            {"name": f"Risultato {i}", "snippet": f"Estratto {seed % 1000}-{i}", "url": f"https://bing{i}.example/{seed}"}
+            for i in range(params.get("count", 5))
+        ]}}
+
+    @staticmethod
+    def image(url: str) -> bytes:
+        # GIF 1x1 valida, con il colore ricavato dall'URL: contenuti (e hash) diversi per URL diversi
+        color = (_digest(url) % 2**24).to_bytes(3, "big")
+        return (b"GIF89a\x01\x00\x01\x00\x80\x00\x00" + color + b"\x00\x00\x00"
+                b"!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;")
+
+    def response(self, url: str, params: Dict[str, Any]) -> SimpleNamespace:
+        if "source.unsplash" in url or url.endswith(".jpg"):
+            return SimpleNamespace(raise_for_status=lambda: None, content=self.image(url),
+                                   headers={"content-type": "image/gif"}, status_code=200)
+        data = self.http_json(url, params)
+        return SimpleNamespace(raise_for_status=lambda: None, json=lambda: data, status_code=200)
+
+    def get(self, url: str, headers: Any = None, params: Any = None, **kwargs: Any) -> SimpleNamespace:
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.response(url, params or {})
+
+    # --- pytrends.TrendReq -----------------------------------------------------
+    def trend_req(self, hl: str = "en-US", tz: int = 360, **kwargs: Any) -> SimpleNamespace:
+        import pandas as pd
+
+        def trending_searches(pn: str = "united_states") -> "pd.DataFrame":
+            self.calls += 1
+            time.sleep(self.latency)
+            return pd.DataFrame({0: [f"{TOPICS[i % len(TOPICS)]} {pn or 'global'} {i}" for i in range(40)]})
+        return SimpleNamespace(hl=hl, tz=tz, trending_searches=trending_searches)
+
+
+class FakeAsyncClient:
+    def __init__(self, search: FakeSearch):
+        self.fake = search
+
+    async def __aenter__(self) -> "FakeAsyncClient":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        return None
+
+    async def get(self, url: str, headers: Any = None, params: Any = None, **kwargs: Any) -> SimpleNamespace:
+        self.fake.calls += 1
+        await asyncio.sleep(self.fake.latency)
+        return self.fake.response(url, params or {})
+
+    async def aclose(self) -> None:
+        return None
+
+
+# =============================================================================
+# MISURE
+# =============================================================================
+def _sqlite_checkpoint_bytes(db_path: Path) -> int:
+    import sqlite3
+    from checkpoints import blobs_path
+
+    total = 0
+    # I blob deduplicati stanno in un file accanto al DB dei checkpoint
+    for path, tables in ((db_path, (("checkpoints", "checkpoint, metadata"), ("writes", "value"))),
+                         (blobs_path(db_path), (("checkpoint_blobs", "data"),))):
+        if not path.exists():
+            continue
+        conn = sqlite3.connect(path)
+        try:
+            for table, columns in tables:
+                exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone()
+                if exists:
+                    expr = " + ".join(f"COALESCE(LENGTH({c.strip()}), 0)" for c in columns.split(","))
+                    total += conn.execute(f"SELECT COALESCE(SUM({expr}), 0) FROM {table}").fetchone()[0]
+        finally:
+            conn.close()
+    return total
+
+
+def _memory_bytes(obj: Any) -> int:
+    """Byte serializzati contenuti in un MemorySaver (storage, writes, blobs)."""
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sum(_memory_bytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple, set)):
+        return sum(_memory_bytes(v) for v in obj)
+    return 0
+
+
+def _node_latency(since: float) -> Dict[str, Dict[str, float]]:
+    from metrics import metrics
+
+    return {s["name"]: {"calls": s["calls"], "p50": round(s["p50"], 6), "p95": round(s["p95"], 6)}
+            for s in metrics.summary(since) if s["kind"] == "node"}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextlib.contextmanager
+def _quiet(verbose: bool) -> Iterator[None]:
+    if verbose:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+# =============================================================================
+# ESECUZIONE
+# =============================================================================
+class Bench:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.search = FakeSearch(args.search_latency)
+        self.llm = FakeChatModel(latency=args.llm_latency, token_latency=args.token_latency, words=args.words)
+
+    def _patches(self) -> contextlib.ExitStack:
+        stack = contextlib.ExitStack()
+        # Chiavi fittizie: _set_env non chiede nulla e nessun client parte davvero
+        dummy = {"OPENAI_API_KEY": "bench", "TAVILY_API_KEY": "bench", "LANGFUSE_PUBLIC_KEY": "bench",
+                 "LANGFUSE_SECRET_KEY": "bench", "LANGFUSE_HOST": "http://localhost"}
+        stack.enter_context(mock.patch.dict(os.environ, {k: os.environ.get(k) or v for k, v in dummy.items()}))
+        stack.enter_context(mock.patch("pytrends.request.TrendReq", self.search.trend_req))
+        return stack
+
+    async def _feedback(self, *args: Any) -> bool:
+        await asyncio.sleep(self.args.human_latency)
+        return True
+
+    def _setup_agent_2(self):
+        import agent_2
+        import httpclient
+
+        agent_2.langfuse_handler = BaseCallbackHandler()
+        llm = self.llm.model_copy(update={"cache": resolve(agent_2.llm_cache) if self.args.llm_cache else None})
+        agent_2.llm = agent_2.classifier.llm = agent_2.verifier.llm = llm
+        agent_2.tavily.client = SimpleNamespace(search=self.search.search)
+        agent_2.tavily.aclient = SimpleNamespace(search=self.search.asearch)
+        # Download delle immagini (assets.py) dal server finto
+        httpclient.client = lambda: SimpleNamespace(get=self.search.get)
+        httpclient.async_client = lambda: FakeAsyncClient(self.search)
+        feedback = agent_2.HumanFeedback()
+        feedback.arequest = self._feedback
+
+        async def arequest_edits(*args: Any) -> Tuple[bool, str]:
+            return await self._feedback(*args), ""
+        feedback.arequest_edits = arequest_edits
+
+        async def aask(question: str, options: Optional[List[str]] = None) -> str:
+            await asyncio.sleep(self.args.human_latency)
+            return "1"
+        feedback.aask = aask
+        agent_2.feedback = feedback
+        return agent_2
+
+    def _setup_agent(self):
+        import agent
+
+        llm = self.llm.model_copy(update={"cache": resolve(agent.llm_cache) if self.args.llm_cache else None})
+        agent.llm = llm
+        agent.tavily_tool = self.search.tool
+        agent.httpclient.client = lambda: SimpleNamespace(get=self.search.get)
+        agent.httpclient.async_client = lambda: FakeAsyncClient(self.search)
+        return agent
+
+    async def _run_agent_2(self, module, n: int) -> Dict[str, Any]:
+        limit = asyncio.Semaphore(self.args.workers)
+        errors = 0
+
+        async def one(graph, i: int) -> None:
+            nonlocal errors
+            config = {"configurable": {"thread_id": f"bench-{i}"}}
+            # Metà dei prompt ha già il topic, l'altra metà sceglie dal pool dei topic
+            topic = TOPICS[i % len(TOPICS)]
+            prompt = f"Articolo gaming, topic: {topic} #{i}" if i % 2 == 0 else f"Articolo gaming #{i}"
+            async with limit:
+                try:
+                    payload: Optional[Dict[str, Any]] = {"prompt": prompt}
+                    for _ in range(50):
+                        await graph.ainvoke(payload, config)
+                        if not (await graph.aget_state(config)).next:
+                            break
+                        payload = None
+                except Exception as exc:
+                    errors += 1
+                    print(f"[bench] agent_2 #{i}: {type(exc).__name__}: {exc}", file=sys.stderr)
+
+        async with module.async_checkpointer() as saver:
+            graph = module.compile_graph(saver, echo_tokens=False)
+            await asyncio.gather(*(one(graph, i) for i in range(n)))
+        return {"errors": errors, "checkpoint_bytes": _sqlite_checkpoint_bytes(module.DB_PATH)}
+
+    async def _run_agent(self, module, n: int) -> Dict[str, Any]:
+        from langgraph.types import Command
+        from metrics import MetricsCallback, metrics
+        from reviews import pending_reviews
+
+        limit = asyncio.Semaphore(self.args.workers)
+        errors = 0
+
+        async def one(i: int) -> None:
+            nonlocal errors
+            topic = TOPICS[i % len(TOPICS)]
+            state = {
+                "topic": topic, "category": "news", "query": f"{topic} #{i}",
+                "retrieved_docs": [], "verified_docs": [], "draft_post": None,
+                "human_feedback": None, "planning_notes": "", "seo_analysis": None,
+                "generated_titles": None, "media_resources": None, "post_version": None,
+            }
+            config = {"configurable": {"thread_id": f"bench-{i}"}, "callbacks": [MetricsCallback(metrics)]}
+            async with limit:
+                try:
+                    payload: Any = state
+                    # La revisione della bozza si sospende (interrupt): il revisore finto accetta
+                    while True:
+                        await module.workflow.ainvoke(payload, config)
+                        reviews = pending_reviews(await module.workflow.aget_state(config))
+                        if not reviews:
+                            break
+                        await asyncio.sleep(self.args.human_latency)
+                        payload = Command(resume={r["review_id"]: "" for r in reviews})
+                except Exception as exc:
+                    errors += 1
+                    print(f"[bench] agent #{i}: {type(exc).__name__}: {exc}", file=sys.stderr)
+
+        await asyncio.gather(*(one(i) for i in range(n)))
+        saver = module.workflow.checkpointer
+        stored = [getattr(saver, name, {}) for name in ("storage", "writes", "blobs")]
+        return {"errors": errors, "checkpoint_bytes": _memory_bytes(stored)}
+
+    def run_graph(self, name: str) -> Dict[str, Any]:
+        setup, runner = {
+            "agent_2": (self._setup_agent_2, self._run_agent_2),
+            "agent": (self._setup_agent, self._run_agent),
+        }[name]
+        with _quiet(self.args.verbose):
+            module = setup()
+        n = self.args.articles
+        since = time.time()
+        tracemalloc.start()
+        started = time.perf_counter()
+        with _quiet(self.args.verbose):
+            result = asyncio.run(runner(module, n))
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            "graph": name,
+            "articles": n,
+            "seconds": round(elapsed, 4),
+            "throughput": round(n / elapsed, 4) if elapsed else None,
+            "peak_memory": peak,
+            **result,
+            "nodes": _node_latency(since),
+        }
+
+    def run(self) -> Dict[str, Any]:
+        workdir = tempfile.mkdtemp(prefix="ccai-bench-")
+        cwd = os.getcwd()
+        # I moduli aprono i loro DB con percorsi relativi: tutto finisce in workdir
+        sys.path.insert(0, str(REPO))
+        os.chdir(workdir)
+        try:
+            with self._patches():
+                graphs = [self.run_graph(name) for name in self.args.graphs]
+        finally:
+            os.chdir(cwd)
+        return {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "params": {k: getattr(self.args, k) for k in
+                       ("articles", "workers", "llm_latency", "token_latency", "search_latency",
+                        "human_latency", "words", "llm_cache")},
+            "workdir": workdir,
+            "graphs": graphs,
+        }
+
+
+def _compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    if baseline.get("params") != current["params"]:
+        print("[bench] attenzione: parametri diversi dalla baseline", file=sys.stderr)
+    before = {g["graph"]: g for g in baseline.get("graphs", [])}
+    print(f"\nConfronto con {baseline.get('commit')}:")
+    for g in current["graphs"]:
+        old = before.get(g["graph"])
+        if not old:
+            continue
+        for key in ("seconds", "throughput", "peak_memory", "checkpoint_bytes"):
+            if old.get(key):
+                delta = (g[key] - old[key]) / old[key] * 100
+                print(f"  {g['graph']:<8} {key:<17} {old[key]:>14} -> {g[key]:>14} ({delta:+.1f}%)")
+
+
+def _report(result: Dict[str, Any]) -> None:
+    print(f"commit {result['commit']}  python {result['python']}  {result['params']}")
+    for g in result["graphs"]:
+        print(f"\n{g['graph']}: {g['articles']} articoli in {g['seconds']:.2f}s "
+              f"({g['throughput']} art/s), errori {g['errors']}, "
+              f"checkpoint {g['checkpoint_bytes'] / 1024:.1f} KiB, picco memoria {g['peak_memory'] / 2**20:.1f} MiB")
+        for node, s in sorted(g["nodes"].items(), key=lambda kv: -kv[1]["p95"]):
+            print(f"  {node:<22} calls {s['calls']:>4}  p50 {s['p50'] * 1000:>8.2f} ms  p95 {s['p95'] * 1000:>8.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark offline dei workflow con servizi fake")
+    parser.add_argument("-n", "--articles", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=4, help="articoli in parallelo")
+    parser.add_argument("--graphs", nargs="+", default=["agent_2", "agent"], choices=["agent_2", "agent"])
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="secondi per chiamata LLM")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="secondi per token in streaming")
+    parser.add_argument("--search-latency", type=float, default=0.0, help="secondi per chiamata di ricerca/HTTP")
+    parser.add_argument("--human-latency", type=float, default=0.0, help="secondi per risposta del revisore")
+    parser.add_argument("--words", type=int, default=800, help="parole degli articoli generati")
+    parser.add_argument("--llm-cache", action="store_true", help="attiva LLMCache sul modello fake")
+    parser.add_argument("--output", type=Path, help="aggiunge il risultato (JSON) a questo file")
+    parser.add_argument("--baseline", type=Path, help="confronta con l'ultimo risultato di questo file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="mostra l'output dei workflow")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline and args.baseline.exists():
+        lines = [l for l in args.baseline.read_text(encoding="utf-8").splitlines() if l.strip()]
+        baseline = json.loads(lines[-1]) if lines else None
+
+    result = Bench(args).run()
+    _report(result)
+    if baseline:
+        _compare(result, baseline)
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
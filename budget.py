@@ -0,0 +1,170 @@
+# coding: utf-8
+"""
+Budget di contesto per i prompt
+===============================
+
+I prompt non devono crescere con lo stato: fonti, documenti e cronologia
+vengono passati al modello solo dopo essere stati deduplicati, accorciati e
+contenuti in un budget di token fisso.
+
+- ``compact_sources``: risultati di ricerca (Tavily) → titolo, URL e un
+  estratto breve, deduplicati per URL e contenuto, entro ``budget`` token;
+- ``compact_lines``: lo stesso per liste di stringhe (documenti di agent.py);
+- ``window_messages`` / ``add_windowed_messages``: tiene gli ultimi messaggi
+  e riassume quelli più vecchi in un unico messaggio di sistema, così la
+  cronologia resta limitata qualunque sia il numero di loop HITL.
+
+I token si contano con ``tiktoken`` se installato (arriva con
+langchain-openai), altrimenti con la stima di 4 caratteri per token.
+"""
+
+from __future__ import annotations
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+from urllib.parse import urlparse
+
+from langchain_core.messages import AnyMessage, SystemMessage
+from langgraph.graph.message import add_messages
+
+SOURCES_BUDGET = 1200   # token per l'elenco fonti di un prompt
+SOURCE_TOKENS = 120     # token per l'estratto di una singola fonte
+DOCUMENT_TOKENS = 3000  # token di un testo lungo (bozza) passato per intero
+KEEP_MESSAGES = 6       # messaggi recenti tenuti alla lettera
+SUMMARY_TOKENS = 300    # token del riassunto dei messaggi più vecchi
+
+SUMMARY_ID = "history-summary"
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+    except ImportError:  # tiktoken è opzionale: stima a caratteri
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:  # es. worker offline: il file BPE non si scarica
+        # lru_cache ricorda anche il None: il tentativo non si ripete a ogni prompt
+        print(f"[WARN] Encoding tiktoken non disponibile, stima a caratteri: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    enc = _encoding()
+    return len(enc.encode(text, disallowed_special=())) if enc else (len(text) + 3) // 4
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """Accorcia ``text`` a ``max_tokens`` (su un confine di parola, con ``…``)."""
+    enc = _encoding()
+    if enc:
+        tokens = enc.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        cut = enc.decode(tokens[:max_tokens])
+    else:
+        if len(text) <= max_tokens * 4:
+            return text
+        cut = text[:max_tokens * 4]
+    return cut.rsplit(" ", 1)[0] + "…"
+
+
+def _fingerprint(text: str) -> str:
+    return " ".join(re.findall(r"\w+", text.lower())[:30])
+
+
+def _url_key(url: str) -> str:
+    parts = urlparse(url)
+    host = parts.netloc.lower().removeprefix("www.")
+    return f"{host}{parts.path.rstrip('/')}"
+
+
+def compact_sources(sources: Iterable[Dict[str, Any]], budget: int = SOURCES_BUDGET,
+                    per_source: int = SOURCE_TOKENS) -> List[Dict[str, str]]:
+    """Fonti ridotte a ``title``/``url``/``snippet``, senza duplicati, entro ``budget`` token.
+
+    Le fonti arrivano già ordinate per rilevanza: quando il budget finisce
+    restano fuori le ultime.
+    """
+    out: List[Dict[str, str]] = []
+    seen = set()
+    used = 0
+    for s in sources:
+        snippet = truncate(" ".join((s.get("content") or s.get("snippet") or "").split()), per_source)
+        keys = {_url_key(s.get("url", "")), _fingerprint(snippet) or None} - {"", None}
+        if keys & seen:
+            continue
+        item = {"title": truncate(s.get("title", ""), 30), "url": s.get("url", ""), "snippet": snippet}
+        cost = count_tokens(format_sources([item]))
+        if out and used + cost > budget:
+            break
+        seen |= keys
+        used += cost
+        out.append(item)
+    return out
+
+
+def format_sources(sources: Sequence[Dict[str, str]]) -> str:
+    lines = []
+    for s in sources:
+        line = f"- {s['title']} ({s['url']})"
+        if s.get("snippet"):
+            line += f": {s['snippet']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def compact_lines(lines: Iterable[str], budget: int = SOURCES_BUDGET, per_line: int = SOURCE_TOKENS) -> List[str]:
+    """Righe deduplicate (per contenuto), accorciate e contenute in ``budget`` token."""
+    out: List[str] = []
+    seen = set()
+    used = 0
+    for line in lines:
+        line = truncate(" ".join(str(line).split()), per_line)
+        key = _fingerprint(line)
+        if not key or key in seen:
+            continue
+        cost = count_tokens(line) + 1
+        if out and used + cost > budget:
+            break
+        seen.add(key)
+        used += cost
+        out.append(line)
+    return out
+
+
+def bullet_list(lines: Iterable[str]) -> str:
+    return "\n".join(f"- {line}" for line in lines)
+
+
+def window_messages(messages: Sequence[AnyMessage], keep_last: int = KEEP_MESSAGES,
+                    summary_tokens: int = SUMMARY_TOKENS) -> List[AnyMessage]:
+    """Ultimi ``keep_last`` messaggi più un riassunto estrattivo di quelli precedenti.
+
+    Il riassunto è un ``SystemMessage`` con id fisso: a ogni nuova finestra
+    quello precedente viene incorporato e sostituito, senza chiamate al modello.
+    """
+    if len(messages) <= keep_last + 1:
+        return list(messages)
+    old, recent = messages[:-keep_last], messages[-keep_last:]
+    lines = []
+    for m in old:
+        text = m.content if isinstance(m.content, str) else str(m.content)
+        if getattr(m, "id", None) == SUMMARY_ID:
+            lines.append(text.removeprefix("Riassunto dei messaggi precedenti:\n"))
+        else:
+            lines.append(f"{m.type}: {truncate(text, 40)}")
+    # Si tengono le righe più recenti che stanno nel budget
+    kept: List[str] = []
+    for line in reversed(lines):
+        if count_tokens("\n".join([line, *kept])) > summary_tokens:
+            break
+        kept.insert(0, line)
+    summary = SystemMessage(content="Riassunto dei messaggi precedenti:\n" + "\n".join(kept), id=SUMMARY_ID)
+    return [summary, *recent]
+
+
+def add_windowed_messages(left: Optional[List[AnyMessage]], right: Any) -> List[AnyMessage]:
+    """Reducer per ``messages``: come ``add_messages``, ma con la cronologia a finestra."""
+    return window_messages(add_messages(left or [], right))
@@ -0,0 +1,345 @@
+# coding: utf-8
+"""
+Cache delle risposte dei servizi esterni
+========================================
+
+Livello di cache condiviso davanti agli adapter che vanno in rete (Tavily,
+Bing, Unsplash, Google Trends). Le risposte restano in memoria in un LRU
+limitato e su disco in un file SQLite accanto ad ``articles.sqlite``, con un
+TTL diverso per ogni sorgente: i trend invecchiano in pochi minuti, i risultati
+di ricerca restano validi per ore.
+
+Un retry dopo un rifiuto HITL o dopo una verifica fonti fallita ritrova quindi
+la stessa risposta senza consumare quota API.
+
+Lo stesso file ospita anche ``LLMCache``, la cache delle chiamate ai modelli
+che si aggancia direttamente alle istanze ``ChatOpenAI`` (parametro ``cache``).
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, TypeVar
+
+from langchain_core.caches import BaseCache
+from langchain_core.embeddings import Embeddings
+from langchain_core.load import dumps, loads
+from langchain_core.outputs import Generation
+from langchain_core.runnables.config import ensure_config
+
+from checkpoints import connect_db
+from metrics import metrics
+
+T = TypeVar("T")
+
+CACHE_PATH = Path("./response_cache.sqlite")
+
+# TTL in secondi per sorgente; le sorgenti non elencate usano DEFAULT_TTL
+SOURCE_TTL: Dict[str, float] = {
+    "trends": 15 * 60,
+    "tavily": 6 * 3600,
+    "bing": 6 * 3600,
+    "unsplash": 24 * 3600,
+}
+DEFAULT_TTL = 3600
+
+_MISS = object()
+
+
+class ResponseCache:
+    """Cache LRU con TTL per sorgente e persistenza su SQLite.
+
+    Le chiavi sono qualsiasi struttura serializzabile in JSON (tipicamente i
+    parametri della richiesta); i valori devono essere serializzabili in JSON.
+    Solo le risposte riuscite vengono salvate: se ``fetch`` solleva
+    un'eccezione questa viene propagata e nulla finisce in cache.
+    """
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS responses (
+            source TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            last_access REAL NOT NULL,
+            PRIMARY KEY (source, key)
+        )"""
+    )
+
+    def __init__(self, db_path: Optional[Path] = CACHE_PATH, max_entries: int = 5000,
+                 ttl: Optional[Dict[str, float]] = None):
+        self.max_entries = max_entries
+        self.ttl = {**SOURCE_TTL, **(ttl or {})}
+        self.lock = threading.Lock()
+        self.memory: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._open_lock = threading.Lock()
+
+    @property
+    def conn(self) -> Optional[sqlite3.Connection]:
+        """Connessione al file di cache, aperta alla prima lettura/scrittura."""
+        if self._conn is None and self.db_path is not None:
+            with self._open_lock:
+                if self._conn is None:
+                    # WAL: le letture non bloccano LLMCache, che scrive sullo stesso file
+                    conn = connect_db(self.db_path)
+                    conn.execute(self.SCHEMA)
+                    conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses(last_access)")
+                    self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def make_key(key: Any) -> str:
+        raw = json.dumps(key, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, source: str, key: Any) -> Any:
+        """Restituisce il valore in cache oppure ``None`` se assente o scaduto."""
+        value = self._lookup(source, self.make_key(key))
+        return None if value is _MISS else value
+
+    def _lookup(self, source: str, digest: str) -> Any:
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get((source, digest))
+            if entry is None and self.conn is not None:
+                row = self.conn.execute(
+                    "SELECT value, expires_at FROM responses WHERE source = ? AND key = ?",
+                    (source, digest)
+                ).fetchone()
+                if row:
+                    entry = (json.loads(row[0]), row[1])
+            if entry is None or entry[1] < now:
+                self.misses[source] = self.misses.get(source, 0) + 1
+                return _MISS
+            self.memory[(source, digest)] = entry
+            self.memory.move_to_end((source, digest))
+            if self.conn is not None:
+                # Commit subito: una transazione aperta terrebbe il lock di scrittura sul file
+                with self.conn:
+                    self.conn.execute(
+                        "UPDATE responses SET last_access = ? WHERE source = ? AND key = ?",
+                        (now, source, digest)
+                    )
+            self.hits[source] = self.hits.get(source, 0) + 1
+            self._trim_memory()
+        metrics.cache_hit(source)
+        return entry[0]
+
+    def set(self, source: str, key: Any, value: Any) -> None:
+        self._store(source, self.make_key(key), value)
+
+    def _store(self, source: str, digest: str, value: Any) -> None:
+        now = time.time()
+        expires_at = now + self.ttl.get(source, DEFAULT_TTL)
+        with self.lock:
+            self.memory[(source, digest)] = (value, expires_at)
+            self.memory.move_to_end((source, digest))
+            self._trim_memory()
+            if self.conn is None:
+                return
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO responses(source, key, value, expires_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (source, digest, json.dumps(value, ensure_ascii=False), expires_at, now)
+                )
+                # Eviction LRU: scaduti prima, poi i meno usati oltre il limite
+                self.conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+                self.conn.execute(
+                    "DELETE FROM responses WHERE rowid IN ("
+                    "SELECT rowid FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+
+    def _trim_memory(self) -> None:
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def cached(self, source: str, key: Any, fetch: Callable[[], T]) -> T:
+        """Restituisce la risposta in cache o la ottiene con ``fetch`` e la memorizza."""
+        digest = self.make_key(key)
+        value = self._lookup(source, digest)
+        if value is _MISS:
+            value = fetch()
+            self._store(source, digest, value)
+        return value
+
+    async def acached(self, source: str, key: Any, fetch: Callable[[], Awaitable[T]]) -> T:
+        digest = self.make_key(key)
+        value = self._lookup(source, digest)
+        if value is _MISS:
+            value = await fetch()
+            self._store(source, digest, value)
+        return value
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Contatori hit/miss per sorgente."""
+        sources = set(self.hits) | set(self.misses)
+        return {s: {"hits": self.hits.get(s, 0), "misses": self.misses.get(s, 0)} for s in sorted(sources)}
+
+
+class LLMCache(BaseCache):
+    """Cache delle risposte LLM a due livelli, con opt-in per nodo.
+
+    - livello esatto: chiave = stringa del modello (modello, temperatura,
+      tool, ...) + messaggi normalizzati (spazi compressi);
+    - livello semantico (opzionale): se è configurato ``embeddings``, un
+      prompt diverso ma con similarità coseno ``>= threshold`` rispetto a
+      uno già in cache per lo stesso modello riusa quella risposta.
+
+    ``policy`` mappa il nome del nodo LangGraph (``langgraph_node`` nei
+    metadata della chiamata) su ``"exact"`` o ``"semantic"``; le chiamate
+    dei nodi non elencati non passano dalla cache. Con ``policy=None`` tutte
+    le chiamate usano il livello esatto. Il livello semantico va riservato a
+    prompt in linguaggio naturale la cui risposta resta valida per una
+    richiesta simile: mai a blocchi posizionali o a punteggi in JSON.
+    """
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS llm_responses (
+            key TEXT PRIMARY KEY,
+            llm_string TEXT NOT NULL,
+            generations TEXT NOT NULL,
+            embedding TEXT,
+            latency REAL,
+            tokens INTEGER,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )"""
+    )
+
+    def __init__(self, db_path: Path = CACHE_PATH, policy: Optional[Dict[str, str]] = None,
+                 embeddings: Optional[Embeddings] = None, threshold: float = 0.95,
+                 max_entries: int = 2000, ttl: float = 7 * 24 * 3600):
+        self.policy = policy
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.pending: Dict[str, tuple] = {}
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0,
+                         "saved_seconds": 0.0, "saved_tokens": 0}
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._open_lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            with self._open_lock:
+                if self._conn is None:
+                    conn = connect_db(self.db_path)
+                    conn.execute(self.SCHEMA)
+                    conn.execute("CREATE INDEX IF NOT EXISTS llm_responses_model ON llm_responses(llm_string)")
+                    self._conn = conn
+        return self._conn
+
+    def _mode(self) -> Optional[str]:
+        if self.policy is None:
+            return "exact"
+        node = ensure_config().get("metadata", {}).get("langgraph_node")
+        return self.policy.get(node)
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> tuple:
+        normalized = " ".join(prompt.split())
+        digest = hashlib.sha256(f"{llm_string}\x00{normalized}".encode("utf-8")).hexdigest()
+        return digest, normalized
+
+    def _hit(self, kind: str, row: Sequence[Any]) -> List[Generation]:
+        key, generations, latency, tokens = row
+        with self.lock:
+            self.counters[kind] += 1
+            self.counters["saved_seconds"] += latency or 0.0
+            self.counters["saved_tokens"] += tokens or 0
+            with self.conn:
+                self.conn.execute("UPDATE llm_responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        metrics.cache_hit("llm")
+        return [loads(g) for g in json.loads(generations)]
+
+    def _nearest(self, llm_string: str, vector: List[float]) -> Optional[Sequence[Any]]:
+        import numpy as np
+
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key, generations, latency, tokens, embedding FROM llm_responses "
+                "WHERE llm_string = ? AND embedding IS NOT NULL AND created_at >= ?",
+                (llm_string, time.time() - self.ttl)
+            ).fetchall()
+        if not rows:
+            return None
+        matrix = np.array([json.loads(r[4]) for r in rows], dtype=np.float32)
+        query = np.array(vector, dtype=np.float32)
+        sims = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-9)
+        best = int(sims.argmax())
+        return rows[best][:4] if sims[best] >= self.threshold else None
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[List[Generation]]:
+        mode = self._mode()
+        if mode is None:
+            return None
+        key, normalized = self._key(prompt, llm_string)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT key, generations, latency, tokens FROM llm_responses WHERE key = ? AND created_at >= ?",
+                (key, time.time() - self.ttl)
+            ).fetchone()
+        if row:
+            return self._hit("exact_hits", row)
+        vector = None
+        if mode == "semantic" and self.embeddings is not None:
+            vector = self.embeddings.embed_query(normalized)
+            row = self._nearest(llm_string, vector)
+            if row:
+                return self._hit("semantic_hits", row)
+        with self.lock:
+            self.counters["misses"] += 1
+            self.pending[key] = (time.monotonic(), vector)
+        return None
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        if self._mode() is None:
+            return
+        key, _ = self._key(prompt, llm_string)
+        now = time.time()
+        with self.lock:
+            started, vector = self.pending.pop(key, (None, None))
+            latency = time.monotonic() - started if started is not None else None
+            tokens = 0
+            for gen in return_val:
+                usage = getattr(getattr(gen, "message", None), "usage_metadata", None) or {}
+                tokens += usage.get("total_tokens", 0)
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO llm_responses"
+                    "(key, llm_string, generations, embedding, latency, tokens, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, llm_string, json.dumps([dumps(g) for g in return_val]),
+                     json.dumps(vector) if vector is not None else None, latency, tokens, now, now)
+                )
+                self.conn.execute("DELETE FROM llm_responses WHERE created_at < ?", (now - self.ttl,))
+                self.conn.execute(
+                    "DELETE FROM llm_responses WHERE key IN ("
+                    "SELECT key FROM llm_responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+
+    def clear(self, **kwargs: Any) -> None:
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM llm_responses")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit esatti/semantici, miss e costo risparmiato (secondi e token stimati)."""
+        with self.lock:
+            return dict(self.counters)
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,408 @@
+# coding: utf-8
+"""
+Retention e compattazione dei checkpoint
+========================================
+
+``SqliteSaver`` scrive un checkpoint (e le relative ``writes``) a ogni
+superstep e non cancella mai nulla: ``articles.sqlite`` cresce senza limiti.
+``CheckpointRetention`` tiene solo gli ultimi ``keep_last`` checkpoint di ogni
+thread ancora attivo e riduce a ``keep_finished`` quelli dei thread il cui
+articolo è già stato salvato (l'ultimo checkpoint resta, così la modalità
+batch continua a riconoscerli come completati).
+
+Le cancellazioni avvengono in piccole transazioni e lo spazio viene restituito
+con ``PRAGMA incremental_vacuum``: il job può girare mentre i worker scrivono
+(in WAL i lettori non vengono bloccati, i writer aspettano al massimo una
+transazione breve).
+
+``CompactSerializer`` è il serializer da passare a ``SqliteSaver`` /
+``AsyncSqliteSaver``: comprime i blob (zstd se installato, altrimenti zlib) e
+salva i canali grandi del checkpoint (``messages``, ``sources``, ``draft``...)
+una sola volta nella tabella ``checkpoint_blobs``, indirizzati per hash: i
+checkpoint successivi che contengono lo stesso valore scrivono solo il
+riferimento. I blob stanno in un file a parte (``articles.blobs.sqlite``): il
+serializer scrive in modo sincrono anche quando lo chiama
+``AsyncSqliteSaver.aput`` dal loop, e su quel file non può trovare il lock
+della transazione aperta dal checkpointer asincrono.
+
+``connect_db`` apre le connessioni a ``articles.sqlite`` sempre allo stesso
+modo (WAL, ``synchronous=NORMAL``, attesa sui lock): checkpointer, archivio
+articoli, job di retention e worker batch condividono il file senza errori
+``database is locked``.
+
+Uso da riga di comando::
+
+    python checkpoints.py --keep-last 10 --keep-finished 1
+"""
+
+from __future__ import annotations
+import argparse
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+try:
+    import zstandard
+except ImportError:  # zstd è opzionale: senza, si usa zlib
+    zstandard = None
+
+DB_PATH = Path("./articles.sqlite")
+
+# Canale dello stato che, valorizzato nell'ultimo checkpoint, segna la fine di un thread
+FINISHED_CHANNEL = "article_id"
+
+
+BLOB_REF = "__blob_ref__"
+
+
+def blobs_path(db_path: Path = DB_PATH) -> Path:
+    """File dei blob di checkpoint accanto al DB (``articles.sqlite`` → ``articles.blobs.sqlite``)."""
+    return db_path.with_name(f"{db_path.stem}.blobs.sqlite")
+
+# Attesa massima (secondi) su un lock di scrittura prima di sollevare errore
+BUSY_TIMEOUT = 30
+
+
+def connect_db(db_path: Path = DB_PATH, **kwargs: Any) -> sqlite3.Connection:
+    """Connessione SQLite in WAL, utilizzabile da più thread.
+
+    In WAL i lettori non bloccano lo scrittore; il ``busy_timeout`` fa
+    attendere gli scrittori concorrenti invece di fallire subito. La modalità
+    WAL è persistente nel file, le altre pragma valgono per la connessione.
+    """
+    kwargs.setdefault("check_same_thread", False)
+    kwargs.setdefault("timeout", BUSY_TIMEOUT)
+    conn = sqlite3.connect(db_path, **kwargs)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}")
+    return conn
+
+
+class CompactSerializer(SerializerProtocol):
+    """Serializer compresso e con deduplica dei canali grandi.
+
+    Il tipo salvato accanto a ogni blob porta il suffisso dell'algoritmo
+    (``msgpack+zstd``, ``msgpack+zlib``): i checkpoint scritti prima di
+    abilitare il serializer (tipo ``msgpack``) restano leggibili.
+    """
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS checkpoint_blobs (
+            hash TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            data BLOB NOT NULL,
+            last_used REAL NOT NULL
+        )"""
+    )
+
+    def __init__(self, db_path: Path = DB_PATH, min_compress: int = 256, min_ref: int = 2048,
+                 level: int = 3, cache_size: int = 256, blob_path: Optional[Path] = None):
+        self.inner = JsonPlusSerializer()
+        self.min_compress = min_compress
+        self.min_ref = min_ref
+        self.codec = "zstd" if zstandard is not None else "zlib"
+        self.level = level
+        self.lock = threading.Lock()
+        self.blob_cache: "OrderedDict[str, Any]" = OrderedDict()
+        self.cache_size = cache_size
+        self.blob_path = blob_path or blobs_path(db_path)
+        self.conn = connect_db(self.blob_path)
+        self.conn.execute(self.SCHEMA)
+        self.conn.commit()
+        self._adopt_legacy(db_path)
+
+    def _adopt_legacy(self, db_path: Path) -> None:
+        """Sposta nel file dei blob quelli salvati nel DB dei checkpoint (versioni precedenti)."""
+        if not Path(db_path).exists():
+            return
+        legacy = connect_db(db_path)
+        try:
+            if not legacy.execute("SELECT 1 FROM sqlite_master WHERE name = 'checkpoint_blobs'").fetchone():
+                return
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO checkpoint_blobs(hash, type, data, last_used) VALUES (?, ?, ?, ?)",
+                    legacy.execute("SELECT hash, type, data, last_used FROM checkpoint_blobs")
+                )
+            with legacy:
+                legacy.execute("DROP TABLE checkpoint_blobs")
+        finally:
+            legacy.close()
+
+    # --- compressione ------------------------------------------------------
+    def _compress(self, type_: str, data: bytes) -> Tuple[str, bytes]:
+        if len(data) < self.min_compress:
+            return type_, data
+        if self.codec == "zstd":
+            return f"{type_}+zstd", zstandard.ZstdCompressor(level=self.level).compress(data)
+        return f"{type_}+zlib", zlib.compress(data, self.level)
+
+    @staticmethod
+    def _decompress(type_: str, data: bytes) -> Tuple[str, bytes]:
+        base, _, codec = type_.partition("+")
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("checkpoint compresso con zstd ma il modulo zstandard non è installato")
+            return base, zstandard.ZstdDecompressor().decompress(data)
+        if codec == "zlib":
+            return base, zlib.decompress(data)
+        return type_, data
+
+    # --- blob indirizzati per contenuto ------------------------------------
+    def _store_blob(self, value: Any) -> Any:
+        type_, data = self.inner.dumps_typed(value)
+        if len(data) < self.min_ref:
+            return value
+        digest = hashlib.sha256(type_.encode() + b"\x00" + data).hexdigest()
+        now = time.time()
+        with self.lock, self.conn:
+            # last_used protegge il blob dalla GC finché il checkpoint che lo cita non è scritto
+            touched = self.conn.execute(
+                "UPDATE checkpoint_blobs SET last_used = ? WHERE hash = ?", (now, digest)
+            ).rowcount
+            if not touched:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO checkpoint_blobs(hash, type, data, last_used) VALUES (?, ?, ?, ?)",
+                    (digest, *self._compress(type_, data), now)
+                )
+            self._remember(digest, value)
+        return {BLOB_REF: digest}
+
+    def _load_blob(self, digest: str) -> Any:
+        with self.lock:
+            if digest in self.blob_cache:
+                self.blob_cache.move_to_end(digest)
+                return self.blob_cache[digest]
+            row = self.conn.execute("SELECT type, data FROM checkpoint_blobs WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            raise KeyError(f"blob di checkpoint mancante: {digest}")
+        value = self.inner.loads_typed(self._decompress(*row))
+        with self.lock:
+            self._remember(digest, value)
+        return value
+
+    def _remember(self, digest: str, value: Any) -> None:
+        self.blob_cache[digest] = value
+        self.blob_cache.move_to_end(digest)
+        while len(self.blob_cache) > self.cache_size:
+            self.blob_cache.popitem(last=False)
+
+    @staticmethod
+    def _is_checkpoint(obj: Any) -> bool:
+        return isinstance(obj, dict) and "channel_values" in obj and "channel_versions" in obj
+
+    @staticmethod
+    def _is_ref(value: Any) -> bool:
+        return isinstance(value, dict) and len(value) == 1 and BLOB_REF in value
+
+    # --- SerializerProtocol ------------------------------------------------
+    def dumps(self, obj: Any) -> bytes:
+        return self.inner.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self.inner.loads(data)
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        if self._is_checkpoint(obj):
+            values = {k: self._store_blob(v) for k, v in obj["channel_values"].items()}
+            obj = {**obj, "channel_values": values}
+        return self._compress(*self.inner.dumps_typed(obj))
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        obj = self.inner.loads_typed(self._decompress(*data))
+        if self._is_checkpoint(obj):
+            obj["channel_values"] = {
+                k: self._load_blob(v[BLOB_REF]) if self._is_ref(v) else v
+                for k, v in obj["channel_values"].items()
+            }
+        return obj
+
+    def referenced_blobs(self, conn: sqlite3.Connection) -> Set[str]:
+        """Hash dei blob ancora citati da almeno un checkpoint."""
+        refs: Set[str] = set()
+        for type_, data in conn.execute("SELECT type, checkpoint FROM checkpoints"):
+            obj = self.inner.loads_typed(self._decompress(type_, data))
+            if self._is_checkpoint(obj):
+                refs.update(v[BLOB_REF] for v in obj["channel_values"].values() if self._is_ref(v))
+        return refs
+
+
+class CheckpointRetention:
+    def __init__(self, db_path: Path = DB_PATH, keep_last: int = 10, keep_finished: int = 1,
+                 batch_size: int = 200, vacuum_pages: int = 256,
+                 finished_channel: str = FINISHED_CHANNEL,
+                 serde: Optional[CompactSerializer] = None):
+        self.serde = serde
+        self.inner = serde.inner if serde is not None else JsonPlusSerializer()
+        self.db_path = db_path
+        self.keep_last = keep_last
+        self.keep_finished = keep_finished
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.finished_channel = finished_channel
+        self._stop = threading.Event()
+
+    def _connect(self) -> sqlite3.Connection:
+        return connect_db(self.db_path, isolation_level=None)
+
+    def _is_finished(self, type_: Optional[str], data: Optional[bytes]) -> bool:
+        """Vero se il checkpoint ha già il canale di fine (``article_id``) valorizzato.
+
+        I metadata di langgraph-checkpoint non riportano più le ``writes`` dei
+        nodi: si legge lo stato del checkpoint. I canali grandi restano
+        riferimenti, senza caricare i blob.
+        """
+        if not data:
+            return False
+        try:
+            obj = self.inner.loads_typed(CompactSerializer._decompress(type_, data))
+        except Exception:
+            return False
+        values = obj.get("channel_values") if isinstance(obj, dict) else None
+        return bool(values and values.get(self.finished_channel))
+
+    def _stale(self, conn: sqlite3.Connection) -> List[Tuple[str, str, str]]:
+        """Checkpoint oltre la soglia di retention, per (thread_id, checkpoint_ns)."""
+        latest = conn.execute(
+            """SELECT thread_id, type, checkpoint FROM checkpoints c
+               WHERE checkpoint_ns = '' AND checkpoint_id = (
+                   SELECT MAX(checkpoint_id) FROM checkpoints
+                   WHERE thread_id = c.thread_id AND checkpoint_ns = '')"""
+        ).fetchall()
+        finished = {tid for tid, type_, data in latest if self._is_finished(type_, data)}
+        # checkpoint_id è un UUIDv6: l'ordine lessicografico è quello temporale
+        rows = conn.execute(
+            """SELECT thread_id, checkpoint_ns, checkpoint_id, ROW_NUMBER() OVER (
+                   PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC)
+               FROM checkpoints"""
+        ).fetchall()
+        return [
+            (tid, ns, cid) for tid, ns, cid, rank in rows
+            if rank > (self.keep_finished if tid in finished else self.keep_last)
+        ]
+
+    def _delete(self, conn: sqlite3.Connection, stale: Iterable[Tuple[str, str, str]]) -> int:
+        stale = list(stale)
+        for i in range(0, len(stale), self.batch_size):
+            chunk = stale[i:i + self.batch_size]
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", chunk
+                )
+                conn.executemany(
+                    "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", chunk
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return len(stale)
+
+    def _collect_blobs(self, conn: sqlite3.Connection, grace: float = 3600.0) -> int:
+        """Elimina i blob non più citati dai checkpoint rimasti e non usati da ``grace`` secondi.
+
+        La scansione dei checkpoint (che deserializza ognuno) gira senza lock di
+        scrittura, su uno snapshot WAL; il lock serve solo alla ``DELETE``, che
+        ricontrolla ``last_used``: un blob toccato da un checkpoint scritto nel
+        frattempo non viene eliminato.
+        """
+        cutoff = time.time() - grace
+        refs = self.serde.referenced_blobs(conn)
+        blobs = connect_db(self.serde.blob_path, isolation_level=None)
+        try:
+            candidates = [(h, cutoff) for (h,) in blobs.execute(
+                "SELECT hash FROM checkpoint_blobs WHERE last_used < ?", (cutoff,)
+            ) if h not in refs]
+            deleted = 0
+            for i in range(0, len(candidates), self.batch_size):
+                chunk = candidates[i:i + self.batch_size]
+                blobs.execute("BEGIN IMMEDIATE")
+                try:
+                    for digest, _ in chunk:
+                        deleted += blobs.execute(
+                            "DELETE FROM checkpoint_blobs WHERE hash = ? AND last_used < ?", (digest, cutoff)
+                        ).rowcount
+                    blobs.execute("COMMIT")
+                except Exception:
+                    blobs.execute("ROLLBACK")
+                    raise
+        finally:
+            blobs.close()
+        with self.serde.lock:
+            for digest, _ in candidates:
+                self.serde.blob_cache.pop(digest, None)
+        return deleted
+
+    def enable_incremental_vacuum(self) -> None:
+        """Passa il DB ad auto_vacuum=INCREMENTAL (richiede un VACUUM completo, una sola volta)."""
+        conn = self._connect()
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+    def compact(self) -> Dict[str, int]:
+        """Esegue un passaggio di retention e restituisce quante righe/pagine ha liberato."""
+        conn = self._connect()
+        try:
+            removed = self._delete(conn, self._stale(conn))
+            orphans = conn.execute(
+                """DELETE FROM writes WHERE NOT EXISTS (
+                       SELECT 1 FROM checkpoints c WHERE c.thread_id = writes.thread_id
+                       AND c.checkpoint_ns = writes.checkpoint_ns AND c.checkpoint_id = writes.checkpoint_id)"""
+            ).rowcount
+            blobs = 0
+            if self.serde is not None:
+                blobs = self._collect_blobs(conn)
+            freed = 0
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                # Poche pagine per volta: ogni passo è una transazione breve
+                while conn.execute("PRAGMA freelist_count").fetchone()[0]:
+                    conn.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})").fetchall()
+                freed = before
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            return {"checkpoints": removed, "orphan_writes": orphans, "blobs": blobs, "pages": freed}
+        finally:
+            conn.close()
+
+    def start_background(self, interval: float = 600.0) -> threading.Thread:
+        """Avvia la compattazione periodica in un thread daemon."""
+        def loop() -> None:
+            while not self._stop.wait(interval):
+                try:
+                    self.compact()
+                except sqlite3.OperationalError as e:
+                    print(f"[WARN] compattazione checkpoint saltata: {e}")
+        thread = threading.Thread(target=loop, name="checkpoint-retention", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Checkpoint retention")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--keep-last", type=int, default=10, help="checkpoint da tenere per thread attivo")
+    parser.add_argument("--keep-finished", type=int, default=1, help="checkpoint da tenere per thread concluso")
+    parser.add_argument("--enable-vacuum", action="store_true",
+                        help="converte il DB ad auto_vacuum incrementale (VACUUM completo, una tantum)")
+    args = parser.parse_args()
+    retention = CheckpointRetention(args.db, keep_last=args.keep_last, keep_finished=args.keep_finished,
+                                    serde=CompactSerializer(args.db))
+    if args.enable_vacuum:
+        retention.enable_incremental_vacuum()
+    print(retention.compact())
@@ -0,0 +1,83 @@
+# coding: utf-8
+"""
+Client HTTP condivisi
+=====================
+
+Un ``requests.get`` per chiamata apre ogni volta una nuova connessione
+TCP+TLS e, senza timeout, può restare appeso all'infinito. Gli adapter che
+chiamano API REST (Bing, Unsplash, download immagini) usano invece i client
+``httpx`` di questo modulo:
+
+- pool di connessioni keep-alive riusato da tutte le chiamate;
+- HTTP/2 quando il pacchetto ``h2`` è installato (``pip install httpx[http2]``);
+- timeout espliciti su connessione, lettura e attesa di una connessione libera.
+
+Il client sincrono è uno per processo; quello asincrono è uno per event loop
+(le connessioni di httpx non possono passare da un loop all'altro).
+"""
+
+from __future__ import annotations
+import asyncio
+import threading
+from typing import Any, Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401  (abilita HTTP/2 in httpx)
+    HTTP2 = True
+except ImportError:  # h2 è opzionale: senza, HTTP/1.1 con keep-alive
+    HTTP2 = False
+
+TIMEOUT = httpx.Timeout(15.0, connect=5.0, pool=10.0)
+LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60.0)
+
+_lock = threading.Lock()
+_client: Optional[httpx.Client] = None
+_async_clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+
+
+def client() -> httpx.Client:
+    """Client sincrono condiviso (thread-safe)."""
+    global _client
+    with _lock:
+        if _client is None or _client.is_closed:
+            _client = httpx.Client(http2=HTTP2, timeout=TIMEOUT, limits=LIMITS, follow_redirects=True)
+        return _client
+
+
+def async_client() -> httpx.AsyncClient:
+    """Client asincrono condiviso dal loop corrente."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        # I loop già chiusi (asyncio.run precedenti) lasciano client inutilizzabili
+        for old in [l for l in _async_clients if l.is_closed()]:
+            del _async_clients[old]
+        aclient = _async_clients.get(loop)
+        if aclient is None or aclient.is_closed:
+            aclient = _async_clients[loop] = httpx.AsyncClient(
+                http2=HTTP2, timeout=TIMEOUT, limits=LIMITS, follow_redirects=True
+            )
+        return aclient
+
+
+def get_json(url: str, headers: Optional[Dict[str, str]] = None, params: Optional[Dict[str, Any]] = None) -> Any:
+    response = client().get(url, headers=headers, params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+async def aget_json(url: str, headers: Optional[Dict[str, str]] = None,
+                    params: Optional[Dict[str, Any]] = None) -> Any:
+    response = await async_client().get(url, headers=headers, params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+async def aclose() -> None:
+    """Chiude il client del loop corrente (da chiamare prima che il loop termini)."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        aclient = _async_clients.pop(loop, None)
+    if aclient is not None:
+        await aclient.aclose()
@@ -0,0 +1,56 @@
+# coding: utf-8
+"""
+Oggetti creati al primo uso
+===========================
+
+Importare agent.py o agent_2.py non deve chiedere chiavi, aprire database o
+caricare SDK pesanti (OpenAI, Langfuse, pytrends/pandas, Tavily). I singleton
+di modulo sono quindi dei ``Lazy``: il nome resta lo stesso (``llm``,
+``tavily``, ``db``…), ma la factory gira solo al primo attributo letto o
+scritto, una volta per processo. Sostituire il nome nel modulo (test, bench)
+continua a funzionare come prima.
+
+Un ``Lazy`` inoltra solo gli attributi: dove serve l'oggetto vero
+(``isinstance``, ``with``, validazione pydantic) si passa ``resolve(x)``.
+"""
+
+from __future__ import annotations
+import threading
+from typing import Any, Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class Lazy(Generic[T]):
+    __slots__ = ("_factory", "_value", "_lock")
+
+    def __init__(self, factory: Callable[[], T]):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_value", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    @property
+    def loaded(self) -> bool:
+        return self._value is not None
+
+    def resolve(self) -> T:
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    object.__setattr__(self, "_value", self._factory())
+        return self._value
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self.resolve(), name, value)
+
+    def __repr__(self) -> str:
+        target = repr(self._value) if self.loaded else getattr(self._factory, "__name__", "factory")
+        return f"Lazy({target})"
+
+
+def resolve(obj: Any) -> Any:
+    """L'oggetto vero dietro un ``Lazy`` (gli altri valori passano invariati)."""
+    return obj.resolve() if isinstance(obj, Lazy) else obj
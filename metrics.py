@@ -0,0 +1,430 @@
+# coding: utf-8
+"""
+Metriche locali per nodo
+========================
+
+Langfuse è un servizio remoto: sui worker offline serve una misura locale di
+dove se ne va il tempo di un articolo. Questo modulo registra, in un file
+SQLite accanto ad ``articles.sqlite``, una riga per ogni:
+
+- esecuzione di un nodo del grafo (``kind = "node"``);
+- chiamata a un modello (``kind = "llm"``) con token di prompt e completamento;
+- chiamata a un adapter esterno (``kind = "adapter"``: Tavily, Google Trends...).
+
+Ogni riga porta ``thread_id`` e nodo LangGraph (letti dalla config corrente),
+durata, esito della cache e numero di retry. ``MetricsCallback`` va aggiunto
+ai callbacks del grafo; gli adapter usano ``metrics.track``; le cache
+segnalano gli hit con ``metrics.cache_hit``.
+
+Riepilogo da riga di comando (p50/p95 per nodo)::
+
+    python metrics.py --since 24
+    python metrics.py --prometheus /var/lib/node_exporter/ccai.prom
+"""
+
+from __future__ import annotations
+import argparse
+import atexit
+import contextlib
+import contextvars
+import functools
+import inspect
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.runnables.config import ensure_config
+
+METRICS_PATH = Path("./metrics.sqlite")
+
+# Prezzi in dollari per milione di token (prompt, completamento)
+PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+# Span attivo nel contesto corrente: le cache ci segnano gli hit
+_span: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("metrics_span", default=None)
+
+
+def cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Costo stimato di una chiamata; 0 per i modelli senza prezzo noto."""
+    # Il prefisso più lungo vince: "gpt-4o-mini-2024-07-18" -> "gpt-4o-mini"
+    matches = [m for m in PRICES if model.startswith(m)]
+    if not matches:
+        return 0.0
+    prompt_price, completion_price = PRICES[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Percentile con interpolazione lineare (``values`` già ordinati)."""
+    if not values:
+        return 0.0
+    pos = (len(values) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+class Metrics:
+    """Sink SQLite delle metriche, sicuro da più thread.
+
+    Le righe restano in memoria e vengono scritte a gruppi, in una sola
+    transazione; le letture (``rows``, ``summary``) scrivono prima quelle in
+    attesa, e il sink del processo le scrive anche all'uscita.
+    """
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS metrics (
+            ts REAL NOT NULL,
+            thread_id TEXT,
+            node TEXT,
+            kind TEXT NOT NULL,
+            name TEXT NOT NULL,
+            duration REAL NOT NULL,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            cache_hit INTEGER NOT NULL DEFAULT 0,
+            retries INTEGER NOT NULL DEFAULT 0,
+            error TEXT
+        )"""
+    )
+
+    def __init__(self, db_path: Path = METRICS_PATH, batch_size: int = 100, flush_interval: float = 2.0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self._buffer: List[Tuple[Any, ...]] = []
+        self._flushed = time.monotonic()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._open_lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # Aperta al primo record: importare il modulo non crea metrics.sqlite
+        if self._conn is None:
+            with self._open_lock:
+                if self._conn is None:
+                    conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+                    conn.execute("PRAGMA journal_mode = WAL")
+                    conn.execute("PRAGMA synchronous = NORMAL")
+                    conn.execute(self.SCHEMA)
+                    conn.execute("CREATE INDEX IF NOT EXISTS metrics_ts ON metrics(ts)")
+                    self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _context() -> Tuple[Optional[str], Optional[str]]:
+        """thread_id e nodo LangGraph della chiamata in corso, se ce n'è una."""
+        config = ensure_config()
+        thread_id = config.get("configurable", {}).get("thread_id")
+        return (str(thread_id) if thread_id is not None else None,
+                config.get("metadata", {}).get("langgraph_node"))
+
+    def record(self, kind: str, name: str, duration: float, prompt_tokens: int = 0,
+               completion_tokens: int = 0, cache_hit: bool = False, retries: int = 0,
+               error: Optional[str] = None, thread_id: Optional[str] = None,
+               node: Optional[str] = None) -> None:
+        if thread_id is None and node is None:
+            thread_id, node = self._context()
+        row = (time.time(), thread_id, node, kind, name, duration, prompt_tokens,
+               completion_tokens, int(cache_hit), retries, error)
+        with self.lock:
+            self._buffer.append(row)
+            # Una transazione ogni batch_size righe (o flush_interval secondi), non una per evento
+            if len(self._buffer) >= self.batch_size or time.monotonic() - self._flushed >= self.flush_interval:
+                self._flush()
+
+    def flush(self) -> None:
+        """Scrive su disco le righe ancora in memoria."""
+        with self.lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        self._flushed = time.monotonic()
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO metrics(ts, thread_id, node, kind, name, duration, prompt_tokens, "
+                "completion_tokens, cache_hit, retries, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    @contextlib.contextmanager
+    def span(self, kind: str, name: str) -> Iterator[Dict[str, Any]]:
+        """Misura il blocco; il dict restituito accoglie campi extra (token, cache_hit...)."""
+        fields: Dict[str, Any] = {}
+        token = _span.set(fields)
+        started = time.perf_counter()
+        try:
+            yield fields
+        except BaseException as exc:
+            fields["error"] = type(exc).__name__
+            raise
+        finally:
+            _span.reset(token)
+            self.record(kind, name, time.perf_counter() - started, **fields)
+
+    def track(self, kind: str, name: Optional[str] = None) -> Callable:
+        """Decoratore (sync o async) che registra ogni chiamata come span."""
+        def decorator(func: Callable) -> Callable:
+            label = name or func.__qualname__
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def awrapper(*args: Any, **kwargs: Any) -> Any:
+                    with self.span(kind, label):
+                        return await func(*args, **kwargs)
+                return awrapper
+
+            @functools.wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with self.span(kind, label):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def cache_hit(self, source: str) -> None:
+        """Segna un hit di cache sullo span corrente, o lo registra a sé se non ce n'è."""
+        fields = _span.get()
+        if fields is not None:
+            fields["cache_hit"] = True
+        else:
+            self.record("cache", source, 0.0, cache_hit=True)
+
+    def retry(self, source: str) -> None:
+        """Conta un retry sullo span corrente, o lo registra a sé se non ce n'è."""
+        fields = _span.get()
+        if fields is not None:
+            fields["retries"] = fields.get("retries", 0) + 1
+        else:
+            self.record("retry", source, 0.0, retries=1)
+
+    def rows(self, since: Optional[float] = None, thread_id: Optional[str] = None) -> List[sqlite3.Row]:
+        query = "SELECT * FROM metrics WHERE ts >= ?"
+        params: List[Any] = [since or 0]
+        if thread_id is not None:
+            query += " AND thread_id = ?"
+            params.append(thread_id)
+        with self.lock:
+            self._flush()
+            self.conn.row_factory = sqlite3.Row
+            try:
+                return self.conn.execute(query, params).fetchall()
+            finally:
+                self.conn.row_factory = None
+
+    def summary(self, since: Optional[float] = None, thread_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Aggrega per (kind, name): chiamate, p50/p95/max, token, costo, hit, retry, errori."""
+        groups: Dict[Tuple[str, str], List[sqlite3.Row]] = {}
+        for row in self.rows(since, thread_id):
+            groups.setdefault((row["kind"], row["name"]), []).append(row)
+        out = []
+        for (kind, name), rows in groups.items():
+            durations = sorted(r["duration"] for r in rows)
+            prompt = sum(r["prompt_tokens"] for r in rows)
+            completion = sum(r["completion_tokens"] for r in rows)
+            out.append({
+                "kind": kind,
+                "name": name,
+                "calls": len(rows),
+                "total": sum(durations),
+                "p50": percentile(durations, 0.50),
+                "p95": percentile(durations, 0.95),
+                "max": durations[-1],
+                "prompt_tokens": prompt,
+                "completion_tokens": completion,
+                "cost": sum(cost(r["name"], r["prompt_tokens"], r["completion_tokens"]) for r in rows),
+                "cache_hits": sum(r["cache_hit"] for r in rows),
+                "retries": sum(r["retries"] for r in rows),
+                "errors": sum(1 for r in rows if r["error"]),
+            })
+        return sorted(out, key=lambda s: (s["kind"], -s["total"]))
+
+    def prometheus(self, since: Optional[float] = None) -> str:
+        """Riepilogo in formato testo Prometheus (textfile collector di node_exporter)."""
+        lines = [
+            "# TYPE ccai_duration_seconds summary",
+            "# TYPE ccai_tokens_total counter",
+            "# TYPE ccai_cost_dollars_total counter",
+            "# TYPE ccai_cache_hits_total counter",
+            "# TYPE ccai_retries_total counter",
+            "# TYPE ccai_errors_total counter",
+        ]
+        for s in self.summary(since):
+            labels = f'kind="{s["kind"]}",name="{s["name"]}"'
+            lines += [
+                f'ccai_duration_seconds{{{labels},quantile="0.5"}} {s["p50"]:.6f}',
+                f'ccai_duration_seconds{{{labels},quantile="0.95"}} {s["p95"]:.6f}',
+                f'ccai_duration_seconds_sum{{{labels}}} {s["total"]:.6f}',
+                f'ccai_duration_seconds_count{{{labels}}} {s["calls"]}',
+                f'ccai_tokens_total{{{labels},type="prompt"}} {s["prompt_tokens"]}',
+                f'ccai_tokens_total{{{labels},type="completion"}} {s["completion_tokens"]}',
+                f'ccai_cost_dollars_total{{{labels}}} {s["cost"]:.6f}',
+                f'ccai_cache_hits_total{{{labels}}} {s["cache_hits"]}',
+                f'ccai_retries_total{{{labels}}} {s["retries"]}',
+                f'ccai_errors_total{{{labels}}} {s["errors"]}',
+            ]
+        return "\n".join(lines) + "\n"
+
+
+class MetricsCallback(BaseCallbackHandler):
+    """Callback LangChain che misura nodi del grafo e chiamate LLM.
+
+    Un nodo è il run il cui nome coincide con ``langgraph_node`` nei metadata;
+    i run annidati (prompt, modelli, tool) servono solo a ricondurre i retry
+    al nodo che li contiene.
+    """
+    run_inline = True  # in async: stesso contesto del run, niente executor
+
+    def __init__(self, sink: "Metrics"):
+        self.sink = sink
+        self.lock = threading.Lock()
+        self.parents: Dict[UUID, Optional[UUID]] = {}
+        self.nodes: Dict[UUID, Dict[str, Any]] = {}
+        self.llm_runs: Dict[UUID, Dict[str, Any]] = {}
+
+    @staticmethod
+    def _thread(metadata: Optional[Dict[str, Any]]) -> Optional[str]:
+        thread_id = (metadata or {}).get("thread_id")
+        return str(thread_id) if thread_id is not None else None
+
+    def _node_of(self, run_id: Optional[UUID]) -> Optional[UUID]:
+        while run_id is not None and run_id not in self.nodes:
+            run_id = self.parents.get(run_id)
+        return run_id
+
+    # --- nodi ----------------------------------------------------------------
+    def on_chain_start(self, serialized: Optional[Dict[str, Any]], inputs: Any, *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, metadata: Optional[Dict[str, Any]] = None,
+                       **kwargs: Any) -> None:
+        node = (metadata or {}).get("langgraph_node")
+        with self.lock:
+            self.parents[run_id] = parent_run_id
+            if node is not None and kwargs.get("name") == node and self._node_of(parent_run_id) is None:
+                self.nodes[run_id] = {"node": node, "thread_id": self._thread(metadata),
+                                      "started": time.perf_counter(), "retries": 0}
+
+    def _end_chain(self, run_id: UUID, error: Optional[str]) -> None:
+        with self.lock:
+            self.parents.pop(run_id, None)
+            run = self.nodes.pop(run_id, None)
+        if run is not None:
+            self.sink.record("node", run["node"], time.perf_counter() - run["started"],
+                             retries=run["retries"], error=error,
+                             thread_id=run["thread_id"], node=run["node"])
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_chain(run_id, None)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        # GraphInterrupt (pausa HITL) non è un errore del nodo
+        name = type(error).__name__
+        self._end_chain(run_id, None if "Interrupt" in name else name)
+
+    def on_retry(self, retry_state: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        with self.lock:
+            node_run = self._node_of(run_id)
+            if node_run is not None:
+                self.nodes[node_run]["retries"] += 1
+
+    # --- modelli ---------------------------------------------------------------
+    def _start_llm(self, serialized: Optional[Dict[str, Any]], run_id: UUID,
+                   parent_run_id: Optional[UUID], metadata: Optional[Dict[str, Any]],
+                   invocation_params: Optional[Dict[str, Any]]) -> None:
+        params = invocation_params or {}
+        model = params.get("model") or params.get("model_name") or (serialized or {}).get("name") or "llm"
+        # La lookup in cache avviene dopo questo callback, nello stesso contesto:
+        # LLMCache segna l'hit sullo span aperto qui
+        fields: Dict[str, Any] = {}
+        with self.lock:
+            self.parents[run_id] = parent_run_id
+            self.llm_runs[run_id] = {"model": model, "node": (metadata or {}).get("langgraph_node"),
+                                     "thread_id": self._thread(metadata), "started": time.perf_counter(),
+                                     "fields": fields, "previous": _span.get()}
+        _span.set(fields)
+
+    def on_chat_model_start(self, serialized: Optional[Dict[str, Any]], messages: Any, *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, metadata: Optional[Dict[str, Any]] = None,
+                            invocation_params: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        self._start_llm(serialized, run_id, parent_run_id, metadata, invocation_params)
+
+    def on_llm_start(self, serialized: Optional[Dict[str, Any]], prompts: List[str], *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, metadata: Optional[Dict[str, Any]] = None,
+                     invocation_params: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        self._start_llm(serialized, run_id, parent_run_id, metadata, invocation_params)
+
+    @staticmethod
+    def _usage(response: LLMResult) -> Tuple[int, int]:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        prompt = completion = 0
+        for generations in response.generations:
+            for gen in generations:
+                meta = getattr(getattr(gen, "message", None), "usage_metadata", None) or {}
+                prompt += meta.get("input_tokens", 0)
+                completion += meta.get("output_tokens", 0)
+        return prompt, completion
+
+    def _end_llm(self, run_id: UUID, response: Optional[LLMResult], error: Optional[str]) -> None:
+        with self.lock:
+            self.parents.pop(run_id, None)
+            run = self.llm_runs.pop(run_id, None)
+        if run is None:
+            return
+        _span.set(run["previous"])
+        prompt, completion = self._usage(response) if response is not None else (0, 0)
+        cache_hit = bool(run["fields"].get("cache_hit"))
+        if cache_hit:
+            # la risposta in cache riporta l'usage originale: non è consumo reale
+            prompt = completion = 0
+        self.sink.record("llm", run["model"], time.perf_counter() - run["started"],
+                         prompt_tokens=prompt, completion_tokens=completion, cache_hit=cache_hit,
+                         error=error, thread_id=run["thread_id"], node=run["node"])
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_llm(run_id, response, None)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_llm(run_id, None, type(error).__name__)
+
+
+metrics = Metrics()
+atexit.register(metrics.flush)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Riepilogo delle metriche per nodo (p50/p95)")
+    parser.add_argument("--db", type=Path, default=METRICS_PATH)
+    parser.add_argument("--since", type=float, help="solo le ultime N ore")
+    parser.add_argument("--thread-id", help="solo un thread")
+    parser.add_argument("--prometheus", type=Path, help="scrive il riepilogo in formato Prometheus")
+    args = parser.parse_args()
+
+    sink = Metrics(args.db)
+    since = time.time() - args.since * 3600 if args.since else None
+    if args.prometheus:
+        tmp = args.prometheus.with_suffix(".tmp")
+        tmp.write_text(sink.prometheus(since), encoding="utf-8")
+        tmp.replace(args.prometheus)  # scrittura atomica per il textfile collector
+        return
+    header = f"{'kind':<8} {'name':<28} {'calls':>6} {'p50':>8} {'p95':>8} {'max':>8} " \
+             f"{'tok in':>8} {'tok out':>8} {'cost $':>8} {'hit':>5} {'retry':>5} {'err':>4}"
+    print(header)
+    print("-" * len(header))
+    for s in sink.summary(since, args.thread_id):
+        print(f"{s['kind']:<8} {s['name'][:28]:<28} {s['calls']:>6} {s['p50']:>8.3f} {s['p95']:>8.3f} "
+              f"{s['max']:>8.3f} {s['prompt_tokens']:>8} {s['completion_tokens']:>8} {s['cost']:>8.4f} "
+              f"{s['cache_hits']:>5} {s['retries']:>5} {s['errors']:>4}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# coding: utf-8
+"""
+Coda di revisione umana
+=======================
+
+I nodi che hanno bisogno di una persona (prompt, scelta del topic, feedback
+su titolo/articolo/immagini, revisione della bozza) non chiamano più
+``input()``: chiamano ``request_review``, che sospende il thread con
+``interrupt`` di LangGraph. Il thread resta parcheggiato nel checkpointer
+SQLite e il processo continua a lavorare sugli altri articoli.
+
+Le risposte arrivano in tre modi:
+
+- da terminale, con ``answer_interactively`` (sessioni singole, come prima);
+- da CLI, un processo alla volta: ``python agent_2.py --reviews`` elenca le
+  revisioni in attesa, ``--answer THREAD_ID REVIEW_ID TESTO`` riprende il
+  thread;
+- via HTTP locale, mentre un batch è in corso (``--serve-reviews PORTA``)::
+
+      GET  /reviews                          → revisioni in attesa (JSON)
+      POST /reviews/<thread_id>/<review_id>  {"answer": "y"} → 202, il thread riparte
+      GET  /assets/<ab>/<file>               → immagini delle bozze (i riferimenti di assets.py)
+
+``review_id`` è l'id dell'interrupt oppure il nome del nodo in attesa. La
+ripresa usa ``Command(resume={id: risposta})``: in un thread con più
+revisioni aperte (i tre rami in parallelo) ognuna si risponde per conto suo.
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+import mimetypes
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from langgraph.types import Command, interrupt
+
+REVIEW_HOST = "127.0.0.1"
+REVIEW_PORT = 8765
+
+
+def request_review(kind: str, question: str, **fields: Any) -> Any:
+    """Sospende il nodo finché qualcuno non risponde; restituisce la risposta.
+
+    ``kind`` dice al client che tipo di risposta serve: ``text``, ``choice``
+    (``options``), ``approve`` (y/n) o ``edits`` (y/n/note di revisione).
+    """
+    return interrupt({"kind": kind, "question": question, **fields})
+
+
+def pending_reviews(snapshot: Any) -> List[Dict[str, Any]]:
+    """Revisioni in attesa in uno snapshot di ``get_state``, una per interrupt."""
+    thread_id = snapshot.config["configurable"]["thread_id"]
+    out = []
+    for task in snapshot.tasks:
+        for intr in task.interrupts:
+            value = intr.value if isinstance(intr.value, dict) else {"question": str(intr.value)}
+            out.append({"thread_id": thread_id, "review_id": intr.id, "node": task.name, **value})
+    return out
+
+
+def format_review(review: Dict[str, Any]) -> str:
+    """Domanda leggibile da terminale, con il contenuto da revisionare."""
+    lines = []
+    if review.get("component"):
+        lines.append(f"[FEEDBACK] {review['component']}: {review.get('payload')}")
+    for i, option in enumerate(review.get("options") or [], 1):
+        lines.append(f"{i}. {option}")
+    lines.append(review["question"])
+    return "\n".join(lines)
+
+
+def answer_interactively(graph: Any, payload: Any, config: Dict[str, Any],
+                         reply: Callable[[str], str] = input) -> Dict[str, Any]:
+    """Esegue il grafo rispondendo da terminale a ogni revisione, fino alla fine."""
+    while True:
+        graph.invoke(payload, config)
+        reviews = pending_reviews(graph.get_state(config))
+        if not reviews:
+            return graph.get_state(config).values
+        payload = Command(resume={r["review_id"]: reply(format_review(r) + " ") for r in reviews})
+
+
+class ReviewQueue:
+    """Revisioni in attesa sui thread del checkpointer, con ripresa in background.
+
+    ``graph`` è il grafo compilato su un checkpointer asincrono; i thread sono
+    letti dalla tabella ``checkpoints`` di ``db_path``. Ogni risposta avvia
+    la ripresa come task: il thread riparte fino alla revisione successiva (o
+    alla fine) mentre le altre risposte vengono accettate. Le riprese dello
+    stesso thread sono serializzate.
+    """
+
+    def __init__(self, graph: Any, db_path: Path, on_update: Optional[Callable[[str, Any], None]] = None):
+        self.graph = graph
+        self.db_path = db_path
+        self.on_update = on_update
+        self.running: Set[asyncio.Task] = set()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def _threads(self) -> List[str]:
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return [r[0] for r in conn.execute("SELECT DISTINCT thread_id FROM checkpoints")]
+        except sqlite3.OperationalError:  # checkpointer non ancora inizializzato
+            return []
+        finally:
+            conn.close()
+
+    async def pending(self, thread_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        threads = [thread_id] if thread_id else await asyncio.to_thread(self._threads)
+        reviews = []
+        for tid in threads:
+            snapshot = await self.graph.aget_state({"configurable": {"thread_id": tid}})
+            reviews += pending_reviews(snapshot)
+        return reviews
+
+    async def _resume(self, thread_id: str, review_id: str, answer: Any) -> bool:
+        config = {"configurable": {"thread_id": thread_id}}
+        async with self._locks.setdefault(thread_id, asyncio.Lock()):
+            # L'id si risolve solo ora: una ripresa precedente può aver cambiato le revisioni aperte
+            match = [r for r in await self.pending(thread_id) if review_id in (r["review_id"], r["node"])]
+            if not match:
+                return False
+            await self.graph.ainvoke(Command(resume={match[0]["review_id"]: answer}), config)
+            if self.on_update:
+                self.on_update(thread_id, await self.graph.aget_state(config))
+        return True
+
+    async def answer(self, thread_id: str, review_id: str, answer: Any, wait: bool = False) -> bool:
+        """Risponde a una revisione; con ``wait=False`` la ripresa continua in background."""
+        if wait:
+            return await self._resume(thread_id, review_id, answer)
+        if not any(review_id in (r["review_id"], r["node"]) for r in await self.pending(thread_id)):
+            return False
+        task = asyncio.create_task(self._resume(thread_id, review_id, answer))
+        self.running.add(task)
+        self._idle.clear()
+        task.add_done_callback(self._done)
+        return True
+
+    def _done(self, task: asyncio.Task) -> None:
+        self.running.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"[WARN] Ripresa del thread non riuscita: {task.exception()!r}")
+        if not self.running:
+            self._idle.set()
+
+    async def wait_done(self, thread_ids: List[str], poll: float = 5.0) -> None:
+        """Attende che sui ``thread_ids`` non restino né revisioni aperte né riprese in corso."""
+        while True:
+            await self._idle.wait()
+            if not any([await self.pending(tid) for tid in thread_ids]):
+                return
+            await asyncio.sleep(poll)
+
+    def serve(self, host: str = REVIEW_HOST, port: int = REVIEW_PORT,
+              assets: Optional[Path] = None) -> ThreadingHTTPServer:
+        """Avvia l'endpoint HTTP locale in un thread; le chiamate girano sul loop corrente.
+
+        Con ``assets`` (la radice dell'archivio immagini) serve anche i file
+        locali citati nelle revisioni: i riferimenti ``/assets/<ab>/<file>``
+        delle bozze sono URL validi su questo endpoint (``ASSET_URL`` di default).
+        """
+        loop = asyncio.get_running_loop()
+        queue = self
+        root = assets.resolve() if assets else None
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, status: int, body: Any) -> None:
+                data = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _call(self, coro) -> Any:
+                return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout=60)
+
+            def _send_file(self, rel: str) -> None:
+                path = (root / rel).resolve() if root else None
+                if path is None or root not in path.parents or not path.is_file():
+                    return self._send(404, {"error": "not found"})
+                data = path.read_bytes()
+                self.send_response(200)
+                self.send_header("Content-Type", mimetypes.guess_type(path.name)[0] or "application/octet-stream")
+                self.send_header("Content-Length", str(len(data)))
+                # Contenuto indirizzato per hash: lo stesso URL non cambia mai
+                self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self) -> None:
+                parts = self.path.strip("/").split("/")
+                if parts[0] == "assets":
+                    return self._send_file("/".join(parts[1:]))
+                if parts[0] != "reviews" or len(parts) > 2:
+                    return self._send(404, {"error": "not found"})
+                self._send(200, self._call(queue.pending(parts[1] if len(parts) == 2 else None)))
+
+            def do_POST(self) -> None:
+                parts = self.path.strip("/").split("/")
+                if parts[0] != "reviews" or len(parts) != 3:
+                    return self._send(404, {"error": "not found"})
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+                try:
+                    answer = json.loads(raw)["answer"] if raw.lstrip().startswith("{") else raw
+                except (ValueError, KeyError):
+                    return self._send(400, {"error": 'serve {"answer": ...}'})
+                if not self._call(queue.answer(parts[1], parts[2], answer)):
+                    return self._send(404, {"error": "nessuna revisione in attesa con questo id"})
+                self._send(202, {"status": "resuming", "thread_id": parts[1]})
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="review-http", daemon=True).start()
+        print(f"[INFO] Revisioni su http://{host}:{port}/reviews")
+        return server
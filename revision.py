@@ -0,0 +1,79 @@
+# coding: utf-8
+"""
+Revisione incrementale delle bozze
+==================================
+
+Quando il revisore chiede delle modifiche non serve riscrivere 800-1000
+parole: al modello si passano la bozza e le note, e lui risponde solo con le
+modifiche mirate, come coppie cerca/sostituisci in JSON::
+
+    [{"find": "testo esatto della bozza", "replace": "testo nuovo"}, ...]
+
+``apply_edits`` le applica alla bozza (tollerando differenze di spazi e a
+capo nel testo cercato). I token in uscita sono quelli delle sole parti
+cambiate, quindi ogni giro di revisione costa e dura una frazione di una
+generazione completa.
+"""
+
+from __future__ import annotations
+import json
+import re
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.language_models import BaseChatModel
+
+REVISION_SYSTEM = (
+    "Sei un editor. Ricevi una bozza e le richieste di modifica del revisore. "
+    "Non riscrivere la bozza: rispondi solo con un array JSON di modifiche "
+    '[{"find": "<testo copiato esattamente dalla bozza>", "replace": "<testo nuovo>"}]. '
+    "Ogni \"find\" deve essere abbastanza lungo da essere univoco; per aggiungere "
+    "testo includi nel \"replace\" anche il testo cercato. Nessun commento fuori dal JSON."
+)
+
+
+def revision_messages(draft: str, notes: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": REVISION_SYSTEM},
+        {"role": "user", "content": f"Richieste del revisore:\n{notes}\n\nBozza:\n{draft}"},
+    ]
+
+
+def parse_edits(content: str) -> List[Dict[str, str]]:
+    """Modifiche valide dalla risposta del modello (lista vuota se illeggibile)."""
+    match = re.search(r"\[.*\]", content, re.DOTALL)
+    if not match:
+        return []
+    try:
+        raw = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return []
+    return [e for e in raw if isinstance(e, dict) and isinstance(e.get("find"), str)
+            and e["find"].strip() and isinstance(e.get("replace"), str)]
+
+
+def apply_edits(text: str, edits: List[Dict[str, str]]) -> Tuple[str, int]:
+    """Applica le modifiche in ordine; restituisce il testo e quante sono andate a segno."""
+    applied = 0
+    for edit in edits:
+        find, replace = edit["find"], edit["replace"]
+        if find in text:
+            text = text.replace(find, replace, 1)
+            applied += 1
+            continue
+        # Il modello a volte normalizza spazi e a capo: confronto parola per parola
+        pattern = r"\s+".join(re.escape(word) for word in find.split())
+        match = re.search(pattern, text)
+        if match:
+            text = text[:match.start()] + replace + text[match.end():]
+            applied += 1
+    return text, applied
+
+
+def revise(llm: BaseChatModel, draft: str, notes: str, **kwargs: Any) -> Tuple[str, int]:
+    reply = llm.invoke(revision_messages(draft, notes), **kwargs)
+    return apply_edits(draft, parse_edits(reply.content))
+
+
+async def arevise(llm: BaseChatModel, draft: str, notes: str, **kwargs: Any) -> Tuple[str, int]:
+    reply = await llm.ainvoke(revision_messages(draft, notes), **kwargs)
+    return apply_edits(draft, parse_edits(reply.content))
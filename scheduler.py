@@ -0,0 +1,383 @@
+# coding: utf-8
+"""
+Scheduler delle richieste verso i servizi esterni
+=================================================
+
+Con più articoli in parallelo le chiamate dirette a OpenAI finiscono in 429 e
+un singolo errore transitorio di Bing/Unsplash diventa una stringa "Errore..."
+nello stato. Tutte le chiamate LLM e degli adapter HTTP passano quindi da un
+unico ``Scheduler`` che per ogni provider applica:
+
+- token bucket per richieste/minuto (RPM) e token/minuto (TPM);
+- priorità: i thread interattivi (revisione HITL) passano prima del lavoro
+  batch in attesa sullo stesso provider;
+- retry con backoff esponenziale e jitter (``Retry-After`` rispettato) sui
+  soli errori transitori: 429, 5xx, timeout e connessione;
+- circuit breaker: dopo ``failure_threshold`` errori consecutivi il provider
+  viene sospeso per ``reset_timeout`` secondi e le chiamate falliscono subito
+  con ``CircuitOpenError``, poi una sola chiamata di prova lo riapre.
+
+I modelli LangChain si agganciano con ``rate_limiter=scheduler.rate_limiter("openai")``
+e ``SchedulerCallback``, che scala dal bucket TPM i token effettivamente
+consumati; gli adapter HTTP usano ``scheduler.call`` / ``scheduler.acall``.
+"""
+
+from __future__ import annotations
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from metrics import metrics
+
+T = TypeVar("T")
+
+# Priorità: valori più bassi passano prima
+INTERACTIVE = 0
+BATCH = 10
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("scheduler_priority", default=INTERACTIVE)
+
+# Nomi (anche delle classi base) degli errori di rete da ritentare:
+# requests, httpx, openai, pytrends
+TRANSIENT_ERRORS = {
+    "ConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout", "ConnectError",
+    "RemoteProtocolError", "APIConnectionError", "APITimeoutError", "TooManyRequestsError",
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """Il provider ha superato la soglia di errori ed è temporaneamente sospeso."""
+
+
+@dataclass
+class ProviderLimits:
+    rpm: Optional[float] = None
+    tpm: Optional[float] = None
+    max_retries: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+
+
+# Limiti di default per provider (tier base dei rispettivi servizi)
+PROVIDERS: Dict[str, ProviderLimits] = {
+    "openai": ProviderLimits(rpm=500, tpm=200_000),
+    "tavily": ProviderLimits(rpm=100),
+    "bing": ProviderLimits(rpm=180),
+    "unsplash": ProviderLimits(rpm=50),
+    "trends": ProviderLimits(rpm=10, max_retries=3, base_delay=2.0),
+}
+
+
+class TokenBucket:
+    """Bucket che si ricarica a ``per_minute`` unità al minuto fino a ``capacity``.
+
+    Il livello può scendere sotto zero con ``debit`` (consumo noto solo a
+    posteriori, come i token di una risposta): le richieste successive
+    attendono finché il debito non è stato ricaricato.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Secondi prima che ``amount`` sia disponibile (0 se lo è già)."""
+        self._refill()
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed / self.rate) if needed > 0 else 0.0
+
+    def debit(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    def allow(self) -> bool:
+        """False se il circuito è aperto; a timeout scaduto lascia passare una sola prova."""
+        if self.opened_at is None:
+            return True
+        if self.probing or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self.probing = True
+        return True
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        self.probing = False
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """La chiamata è finita senza esito (cancellata): la prova si potrà ripetere."""
+        self.probing = False
+
+
+def _status(exc: BaseException) -> Optional[int]:
+    for obj in (exc, getattr(exc, "response", None)):
+        code = getattr(obj, "status_code", None)
+        if isinstance(code, int):
+            return code
+    return None
+
+
+def is_transient(exc: BaseException) -> bool:
+    """429, 5xx ed errori di rete; gli altri 4xx sono errori del chiamante."""
+    status = _status(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    if isinstance(exc, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(exc).__mro__)
+
+
+def _retry_after(exc: BaseException) -> float:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class _Provider:
+    def __init__(self, name: str, limits: ProviderLimits):
+        self.name = name
+        self.limits = limits
+        self.requests = TokenBucket(limits.rpm) if limits.rpm else None
+        self.tokens = TokenBucket(limits.tpm) if limits.tpm else None
+        self.breaker = CircuitBreaker(limits.failure_threshold, limits.reset_timeout)
+        self.waiting: List[Tuple[int, int]] = []
+
+
+class Scheduler:
+    """Limiti, priorità, retry e circuit breaker per provider (thread-safe e asyncio)."""
+
+    def __init__(self, providers: Optional[Dict[str, ProviderLimits]] = None,
+                 poll: float = 0.02, max_wait: float = 1.0):
+        self.lock = threading.Lock()
+        self.poll = poll
+        self.max_wait = max_wait
+        self.providers = {name: _Provider(name, limits) for name, limits in {**PROVIDERS, **(providers or {})}.items()}
+        self._seq = itertools.count()
+
+    def _provider(self, name: str) -> _Provider:
+        with self.lock:
+            if name not in self.providers:
+                self.providers[name] = _Provider(name, ProviderLimits())
+            return self.providers[name]
+
+    @staticmethod
+    @contextlib.contextmanager
+    def priority(level: int) -> Iterator[None]:
+        """Imposta la priorità delle richieste fatte nel blocco (e nei task che ne derivano)."""
+        token = _priority.set(level)
+        try:
+            yield
+        finally:
+            _priority.reset(token)
+
+    # --- ammissione ----------------------------------------------------------
+    def _try_acquire(self, p: _Provider, ticket: Tuple[int, int], tokens: float) -> float:
+        """Prende il posto se ``ticket`` è il primo in coda e c'è capacità; altrimenti l'attesa."""
+        with self.lock:
+            if min(p.waiting) != ticket:
+                return self.poll
+            wait = max(p.requests.wait_time(1) if p.requests else 0.0,
+                       # TPM: basta che il debito sia rientrato, il consumo reale arriva dopo
+                       p.tokens.wait_time(max(tokens, 1)) if p.tokens else 0.0)
+            if wait:
+                # il primo in coda si risveglia comunque ogni tanto: può arrivare
+                # una richiesta con priorità più alta
+                return min(wait, self.max_wait)
+            p.waiting.remove(ticket)
+            if not p.breaker.allow():
+                raise CircuitOpenError(f"{p.name}: troppi errori consecutivi, riprovo tra poco")
+            if p.requests:
+                p.requests.debit(1)
+            if p.tokens and tokens:
+                p.tokens.debit(tokens)
+            return 0.0
+
+    def _enqueue(self, provider: str) -> Tuple[_Provider, Tuple[int, int]]:
+        p = self._provider(provider)
+        ticket = (_priority.get(), next(self._seq))
+        with self.lock:
+            p.waiting.append(ticket)
+        return p, ticket
+
+    def _dequeue(self, p: _Provider, ticket: Tuple[int, int]) -> None:
+        with self.lock:
+            if ticket in p.waiting:
+                p.waiting.remove(ticket)
+
+    def acquire(self, provider: str, tokens: float = 0) -> None:
+        p, ticket = self._enqueue(provider)
+        try:
+            while (wait := self._try_acquire(p, ticket, tokens)) > 0:
+                time.sleep(wait)
+        finally:
+            self._dequeue(p, ticket)
+
+    async def aacquire(self, provider: str, tokens: float = 0) -> None:
+        p, ticket = self._enqueue(provider)
+        try:
+            while (wait := self._try_acquire(p, ticket, tokens)) > 0:
+                await asyncio.sleep(wait)
+        finally:
+            self._dequeue(p, ticket)
+
+    def debit(self, provider: str, tokens: float) -> None:
+        """Scala dal bucket TPM i token consumati davvero (noti solo dopo la risposta)."""
+        p = self._provider(provider)
+        if p.tokens and tokens:
+            with self.lock:
+                p.tokens.debit(tokens)
+
+    def success(self, provider: str) -> None:
+        p = self._provider(provider)
+        with self.lock:
+            p.breaker.success()
+
+    def failure(self, provider: str, exc: BaseException) -> None:
+        p = self._provider(provider)
+        with self.lock:
+            if not isinstance(exc, Exception):
+                # CancelledError e simili: il provider non ha risposto né sbagliato
+                p.breaker.release()
+            elif is_transient(exc):
+                p.breaker.failure()
+            else:
+                # un 4xx è un errore della richiesta: il provider risponde
+                p.breaker.success()
+
+    # --- esecuzione con retry ---------------------------------------------------
+    def _delay(self, p: _Provider, attempt: int, exc: BaseException) -> float:
+        cap = min(p.limits.max_delay, p.limits.base_delay * 2 ** attempt)
+        # full jitter: i client in retry non si risincronizzano
+        return max(random.uniform(0, cap), _retry_after(exc))
+
+    def call(self, provider: str, fn: Callable[[], T], tokens: float = 0) -> T:
+        p = self._provider(provider)
+        for attempt in itertools.count():
+            self.acquire(provider, tokens)
+            try:
+                result = fn()
+            except Exception as exc:
+                self.failure(provider, exc)
+                if not is_transient(exc) or attempt >= p.limits.max_retries:
+                    raise
+                metrics.retry(provider)
+                time.sleep(self._delay(p, attempt, exc))
+            except BaseException as exc:
+                self.failure(provider, exc)
+                raise
+            else:
+                self.success(provider)
+                return result
+
+    async def acall(self, provider: str, fn: Callable[[], Awaitable[T]], tokens: float = 0) -> T:
+        p = self._provider(provider)
+        for attempt in itertools.count():
+            await self.aacquire(provider, tokens)
+            try:
+                result = await fn()
+            except Exception as exc:
+                self.failure(provider, exc)
+                if not is_transient(exc) or attempt >= p.limits.max_retries:
+                    raise
+                metrics.retry(provider)
+                await asyncio.sleep(self._delay(p, attempt, exc))
+            except BaseException as exc:
+                # Task cancellato durante la chiamata: libera la prova del circuito
+                self.failure(provider, exc)
+                raise
+            else:
+                self.success(provider)
+                return result
+
+    def rate_limiter(self, provider: str) -> "SchedulerRateLimiter":
+        return SchedulerRateLimiter(self, provider)
+
+    def callback(self, provider: str) -> "SchedulerCallback":
+        return SchedulerCallback(self, provider)
+
+
+class SchedulerRateLimiter(BaseRateLimiter):
+    """Adattatore per il parametro ``rate_limiter`` dei modelli LangChain."""
+
+    def __init__(self, scheduler: Scheduler, provider: str):
+        self.scheduler = scheduler
+        self.provider = provider
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        self.scheduler.acquire(self.provider)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        await self.scheduler.aacquire(self.provider)
+        return True
+
+
+class SchedulerCallback(BaseCallbackHandler):
+    """Riporta allo scheduler token consumati ed esito delle chiamate LLM.
+
+    I retry sui 429/5xx restano al client OpenAI (``max_retries``, backoff
+    esponenziale con jitter): qui arrivano solo le chiamate fallite dopo
+    l'ultimo tentativo, che alimentano il circuit breaker.
+    """
+    run_inline = True
+
+    def __init__(self, scheduler: Scheduler, provider: str):
+        self.scheduler = scheduler
+        self.provider = provider
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        tokens = usage.get("total_tokens", 0)
+        if not tokens:
+            for generations in response.generations:
+                for gen in generations:
+                    meta = getattr(getattr(gen, "message", None), "usage_metadata", None) or {}
+                    tokens += meta.get("total_tokens", 0)
+        self.scheduler.debit(self.provider, tokens)
+        self.scheduler.success(self.provider)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.scheduler.failure(self.provider, error)
+
+    def on_retry(self, retry_state: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        metrics.retry(self.provider)
+
+
+scheduler = Scheduler()
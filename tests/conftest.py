@@ -0,0 +1,52 @@
+# I moduli del progetto sono file piatti nella radice del repository
+import os
+import sys
+import tempfile
+import zlib
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Le chiavi si chiedono con getpass se mancano: nei test bastano valori fittizi
+for _var in ("OPENAI_API_KEY", "TAVILY_API_KEY", "LANGFUSE_PUBLIC_KEY", "LANGFUSE_SECRET_KEY", "LANGFUSE_HOST"):
+    os.environ.setdefault(_var, "test")
+# I file SQLite di default (articles.sqlite, cache, metriche) sono relativi alla
+# directory corrente: i test non devono toccare quelli del repository
+os.chdir(tempfile.mkdtemp(prefix="ccai-tests-"))
+
+
+class FakeEmbeddings:
+    """Embeddings deterministici: conteggio delle parole su ``dim`` componenti."""
+
+    def __init__(self, dim: int = 64):
+        self.dim = dim
+
+    def embed_query(self, text: str):
+        vector = [0.0] * self.dim
+        for word in text.lower().split():
+            vector[zlib.crc32(word.strip(".,;:!?").encode()) % self.dim] += 1.0
+        return vector
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+
+@pytest.fixture
+def embeddings():
+    return FakeEmbeddings()
+
+
+@pytest.fixture
+def article_db(tmp_path):
+    """ArticleDB full-text su un file temporaneo."""
+    agent_2 = pytest.importorskip("agent_2")
+    return agent_2.ArticleDB(tmp_path / "articles.sqlite")
+
+
+@pytest.fixture
+def semantic_db(tmp_path, embeddings):
+    """ArticleDB con indice semantico (embeddings finti)."""
+    agent_2 = pytest.importorskip("agent_2")
+    return agent_2.ArticleDB(tmp_path / "articles.sqlite", embeddings=embeddings)
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+agent_2 = pytest.importorskip("agent_2")
+
+
+def test_search_ranks_by_relevance(article_db):
+    zelda = article_db.save("Zelda: recensione", "Zelda torna con un open world enorme. Zelda convince.", [])
+    article_db.save("Mario Kart", "Nuove piste per Mario Kart, Zelda come ospite.", [])
+    article_db.save("Meteo", "Pioggia su Roma nel weekend.", [])
+
+    results = article_db.search("zelda recensione")
+    assert [r["id"] for r in results][:1] == [zelda]
+    assert len(results) == 2
+    assert results[0]["rank"] >= results[1]["rank"]
+
+
+def test_search_ignores_diacritics_and_punctuation(article_db):
+    aid = article_db.save("Città e velocità", "Un racing ambientato in città.", [])
+    assert [r["id"] for r in article_db.search("citta!")] == [aid]
+    assert article_db.search("  ?! ") == []
+
+
+def test_related_falls_back_to_full_text(article_db):
+    aid = article_db.save("GTA 6 rinviato", "Rockstar rinvia GTA 6.", [])
+    assert article_db.related("GTA 6") == article_db.search("GTA 6", 3)
+    assert article_db.related("GTA 6")[0]["id"] == aid
+    assert "similarity" not in article_db.related("GTA 6")[0]
+
+
+def test_similar_orders_by_cosine(semantic_db):
+    gta = semantic_db.save("GTA 6 rinviato", "GTA 6 rinviato", [])
+    semantic_db.save("Zelda recensione", "Zelda recensione", [])
+
+    results = semantic_db.similar("GTA 6 rinviato", k=2)
+    assert results[0]["id"] == gta
+    assert results[0]["title"] == "GTA 6 rinviato"
+    assert results[0]["similarity"] == pytest.approx(1.0, abs=1e-5)
+    assert results[1]["similarity"] < results[0]["similarity"]
+
+
+def test_similar_sees_articles_saved_after_first_query(semantic_db):
+    assert semantic_db.similar("Zelda") == []
+    aid = semantic_db.save("Zelda recensione", "Zelda recensione", [])
+    assert semantic_db.similar("Zelda recensione", k=1)[0]["id"] == aid
+
+
+def test_route_related_stops_on_duplicate(semantic_db):
+    aid = semantic_db.save("GTA 6 rinviato", "GTA 6 rinviato", [])
+
+    duplicate = {"related": semantic_db.related("GTA 6 rinviato")}
+    assert duplicate["related"][0]["id"] == aid
+    assert agent_2.route_related(duplicate) == agent_2.END
+
+    fresh = {"related": semantic_db.related("Zelda recensione")}
+    assert agent_2.route_related(fresh) == "search_sources"
+    assert agent_2.route_related({"related": []}) == "search_sources"
+
+
+def test_save_many_is_one_transaction(article_db):
+    ids = article_db.save_many([("GTA 6", "Corpo", [], "gta 6"), ("Zelda", "Corpo", ["https://x.example/1.jpg"], None)])
+    assert ids == [1, 2]
+    rows = article_db.conn.execute("SELECT id, topic, title, images FROM articles ORDER BY id").fetchall()
+    assert rows == [(1, "gta 6", "GTA 6", "[]"), (2, None, "Zelda", json.dumps(["https://x.example/1.jpg"]))]
+    assert [r["id"] for r in article_db.search("zelda")] == [2]
+
+    # Un articolo non valido annulla l'intero gruppo
+    with pytest.raises(TypeError):
+        article_db.save_many([("Mario", "Corpo", [], None), ("Rotto", "Corpo", [object()], None)])
+    assert article_db.conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0] == 2
+    assert article_db.search("mario") == []
+
+
+def test_asave_batches_concurrent_saves(article_db, monkeypatch):
+    batches = []
+    save_many = article_db.save_many
+    monkeypatch.setattr(article_db, "save_many", lambda articles: batches.append(len(articles)) or save_many(articles))
+
+    async def main():
+        return await asyncio.gather(*(article_db.asave(f"Articolo {i}", "corpo", [], f"topic {i}") for i in range(5)))
+
+    ids = asyncio.run(main())
+    assert batches == [5]
+    assert len(set(ids)) == 5
+    titles = dict(article_db.conn.execute("SELECT id, title FROM articles").fetchall())
+    assert [titles[aid] for aid in ids] == [f"Articolo {i}" for i in range(5)]
+
+
+def test_asave_failure_reaches_every_caller(article_db, monkeypatch):
+    def fail(articles):
+        raise RuntimeError("disco pieno")
+    monkeypatch.setattr(article_db, "save_many", fail)
+
+    async def main():
+        return await asyncio.gather(*(article_db.asave("T", "corpo", []) for _ in range(3)), return_exceptions=True)
+
+    assert [str(e) for e in asyncio.run(main())] == ["disco pieno"] * 3
+
+
+def test_asave_during_flush_is_saved(article_db, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    batches = []
+    save_many = article_db.save_many
+
+    def slow(articles):
+        batches.append([title for title, *_ in articles])
+        started.set()
+        release.wait(5)
+        return save_many(articles)
+    monkeypatch.setattr(article_db, "save_many", slow)
+
+    async def main():
+        first = asyncio.create_task(article_db.asave("Primo", "corpo", []))
+        await asyncio.to_thread(started.wait, 5)
+        # Arriva mentre il flusher aspetta save_many
+        second = asyncio.create_task(article_db.asave("Secondo", "corpo", []))
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.wait_for(asyncio.gather(first, second), 5)
+
+    ids = asyncio.run(main())
+    assert batches == [["Primo"], ["Secondo"]]
+    titles = dict(article_db.conn.execute("SELECT id, title FROM articles").fetchall())
+    assert [titles[aid] for aid in ids] == ["Primo", "Secondo"]
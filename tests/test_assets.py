@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import io
+
+import httpx
+import pytest
+
+import assets
+import httpclient
+from assets import AssetStore, digest_of
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"finto" * 20
+DIGEST = hashlib.sha256(PNG).hexdigest()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AssetStore(tmp_path / "assets", variants={})
+
+
+class FakeHTTP:
+    """Client HTTP con risposte fisse per URL; conta le richieste."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+
+    def _get(self, url):
+        self.calls.append(url)
+        status, mime, body = self.responses.get(url, (404, "text/html", b"not found"))
+        return httpx.Response(status, content=body, headers={"content-type": mime},
+                              request=httpx.Request("GET", url))
+
+    def get(self, url):
+        return self._get(url)
+
+
+class AsyncFakeHTTP(FakeHTTP):
+    async def get(self, url):
+        return self._get(url)
+
+
+def test_store_dedups_identical_bytes(store):
+    first = store.store(PNG, "image/png", "https://a.example/1.png")
+    second = store.store(PNG, "image/png", "https://b.example/copia.png")
+    assert first["hash"] == second["hash"] == DIGEST
+    assert [p.name for p in store.root.rglob("*.png")] == [f"{DIGEST}.png"]
+    # Entrambi gli URL portano allo stesso file senza tornare in rete
+    assert store.lookup("https://a.example/1.png")["hash"] == DIGEST
+    assert store.lookup("https://b.example/copia.png")["hash"] == DIGEST
+    assert store.lookup("https://c.example/mai-visto.png") is None
+
+
+def test_lookup_ignores_deleted_files(store):
+    asset = store.store(PNG, "image/png", "https://a.example/1.png")
+    store.path_of(store.ref(asset)).unlink()
+    assert store.lookup("https://a.example/1.png") is None
+    assert store.store(PNG, "image/png")["hash"] == DIGEST
+    assert store.path_of(store.ref(asset)).read_bytes() == PNG
+
+
+def test_ref_digest_and_path_round_trip(store):
+    asset = store.store(PNG, "image/png")
+    ref = store.ref(asset)
+    assert ref == f"{assets.ASSET_URL}/{DIGEST[:2]}/{DIGEST}.png"
+    assert digest_of(ref) == DIGEST
+    assert store.path_of(ref) == store.root / DIGEST[:2] / f"{DIGEST}.png"
+    assert store.path_of(ref).read_bytes() == PNG
+
+
+def test_digest_of_other_refs():
+    assert digest_of(f"{assets.ASSET_URL}/ab/{'ab' * 32}-thumb.webp") == "ab" * 32
+    assert digest_of("https://source.unsplash.com/1600x900/?gta") is None
+    assert digest_of(f"https://cdn.example/{'ab' * 32}.jpg") is None
+    assert digest_of(f"{assets.ASSET_URL}/ab/non-un-hash.jpg") is None
+
+
+def test_localize_downloads_each_url_once(store, monkeypatch):
+    fake = FakeHTTP({
+        "https://a.example/1.png": (200, "image/png", PNG),
+        "https://b.example/copia.png": (200, "image/png", PNG),
+        "https://c.example/pagina": (200, "text/html", b"<html>"),
+    })
+    monkeypatch.setattr(httpclient, "client", lambda: fake)
+    urls = ["https://a.example/1.png", "https://b.example/copia.png", "https://a.example/1.png",
+            "https://c.example/pagina", "https://d.example/404.png"]
+
+    refs = store.localize(urls)
+    assert refs[:3] == [store.ref(store.get(DIGEST))] * 3
+    # Download non riusciti o non immagini: resta l'URL remoto
+    assert refs[3:] == urls[3:]
+    assert sorted(fake.calls) == sorted(set(urls))
+
+    # Secondo articolo con le stesse immagini: nessuna richiesta per quelle già scaricate
+    fake.calls.clear()
+    assert store.localize(urls[:2]) == refs[:2]
+    assert fake.calls == []
+
+
+def test_alocalize_matches_localize(store, monkeypatch):
+    fake = AsyncFakeHTTP({"https://a.example/1.png": (200, "image/png", PNG)})
+    monkeypatch.setattr(httpclient, "async_client", lambda: fake)
+    refs = asyncio.run(store.alocalize(["https://a.example/1.png", "https://x.example/404.png"]))
+    assert refs == [store.ref(store.get(DIGEST)), "https://x.example/404.png"]
+
+
+def test_variants_are_resized_once(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    buffer = io.BytesIO()
+    Image.new("RGB", (2000, 1000), "red").save(buffer, "PNG")
+    store = AssetStore(tmp_path / "assets", variants={"web": 1600, "thumb": 400})
+
+    asset = store.store(buffer.getvalue(), "image/png")
+    assert (asset["width"], asset["height"]) == (2000, 1000)
+    with Image.open(store.path_of(store.ref(asset, "thumb"))) as thumb:
+        assert thumb.size == (400, 200)
+    assert store.ref(asset, "card") == store.ref({**asset, "variants": {}})
+
+
+class AnyImage(dict):
+    """Ogni URL risponde con un'immagine diversa."""
+
+    def get(self, url, default=None):
+        return 200, "image/png", PNG + url.encode()
+
+
+def test_generated_image_sets_are_reused(store, monkeypatch):
+    agent_2 = pytest.importorskip("agent_2")
+    fake = FakeHTTP(AnyImage())
+    monkeypatch.setattr(httpclient, "client", lambda: fake)
+    monkeypatch.setattr(agent_2, "asset_store", store)
+    monkeypatch.setattr(agent_2, "speculation", agent_2.Speculation(k=1))
+    state = {"topic": "GTA 6"}
+
+    first = agent_2.generate_images_node(state)
+    assert len(fake.calls) == 6 and len(set(fake.calls)) == 6
+    assert len(first["draft"]["images"]) == 3 and len(first["candidates"]["images"]) == 1
+
+    # Nodo rieseguito sullo stesso stato (retry, ripresa): niente download
+    fake.calls.clear()
+    assert agent_2.generate_images_node(state) == first
+    assert fake.calls == []
+
+    # Tutti i set rifiutati: il giro successivo propone immagini nuove
+    rejected = {**state, "draft": first["draft"], "candidates": {"images": []}}
+    second = agent_2.generate_images_node(rejected)
+    assert len(fake.calls) == 6
+    assert not set(second["draft"]["images"]) & set(first["draft"]["images"])
@@ -0,0 +1,75 @@
+import asyncio
+import json
+import sys
+from types import SimpleNamespace
+from typing import Any, Dict, TypedDict
+
+import pytest
+
+agent_2 = pytest.importorskip("agent_2")
+from langgraph.graph import END, START, StateGraph
+
+from reviews import request_review
+
+
+class BatchState(TypedDict, total=False):
+    prompt: str
+    topic: str
+    draft: Dict[str, Any]
+    article_id: int
+
+
+def _write(state: BatchState) -> BatchState:
+    # Come i nodi veri: diagnostica con print durante l'esecuzione
+    print(f"[INFO] articolo su {state['prompt']}")
+    if state["prompt"] == "da rivedere":
+        request_review("approve", "Pubblico?")
+    return {"topic": state["prompt"], "draft": {"title": state["prompt"]}, "article_id": 1}
+
+
+builder = StateGraph(BatchState)
+builder.add_node("write", _write)
+builder.add_edge(START, "write")
+builder.add_edge("write", END)
+
+
+@pytest.fixture
+def batch(tmp_path, monkeypatch):
+    echo = []
+
+    def compile_graph(saver, echo_tokens=True):
+        echo.append(echo_tokens)
+        return builder.compile(checkpointer=saver)
+
+    idle = SimpleNamespace(start_background=lambda: None, stop=lambda: None, compact=lambda: None)
+    monkeypatch.setattr(agent_2, "compile_graph", compile_graph)
+    monkeypatch.setattr(agent_2, "DB_PATH", tmp_path / "articles.sqlite")
+    monkeypatch.setattr(agent_2, "retention", idle)
+    monkeypatch.setattr(agent_2, "topic_pool", idle)
+    path = tmp_path / "batch.jsonl"
+    path.write_text('{"id": "a", "prompt": "GTA 6"}\n{"id": "b", "prompt": "da rivedere"}\n', encoding="utf-8")
+    return path, echo
+
+
+def test_batch_stdout_is_jsonl(batch, capsys):
+    path, echo = batch
+    asyncio.run(agent_2.arun_batch(path, workers=2, output=sys.stdout))
+    out, err = capsys.readouterr()
+
+    records = [json.loads(line) for line in out.splitlines()]
+    assert {(r["thread_id"], r["status"]) for r in records} == {
+        ("a", "started"), ("a", "done"), ("b", "started"), ("b", "awaiting_review")}
+    assert "[INFO] articolo su GTA 6" in err
+    assert echo == [False]
+
+
+def test_reviews_stdout_is_jsonl(batch, capsys):
+    path, echo = batch
+    asyncio.run(agent_2.arun_batch(path, workers=2, output=sys.stdout))
+    capsys.readouterr()
+
+    asyncio.run(agent_2.areviews(output=sys.stdout))
+    out, _ = capsys.readouterr()
+    reviews = [json.loads(line) for line in out.splitlines()]
+    assert [(r["thread_id"], r["node"], r["question"]) for r in reviews] == [("b", "write", "Pubblico?")]
+    assert echo == [False, False]
@@ -0,0 +1,104 @@
+import sys
+import types
+
+import pytest
+
+pytest.importorskip("langchain_core")
+import budget
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+_encoding = budget._encoding
+
+
+@pytest.fixture(autouse=True)
+def char_estimate(monkeypatch):
+    # Conteggi prevedibili con o senza tiktoken: 4 caratteri per token
+    monkeypatch.setattr(budget, "_encoding", lambda: None)
+
+
+def source(url, content, title="Fonte"):
+    return {"url": url, "title": title, "content": content, "score": 0.9, "raw_content": "x" * 10_000}
+
+
+def test_truncate_on_word_boundary():
+    assert budget.truncate("breve", 10) == "breve"
+    assert budget.truncate("uno due tre quattro cinque", 3) == "uno due tre…"
+
+
+def test_compact_sources_drops_duplicates():
+    sources = [
+        source("https://www.ign.com/gta6/", "GTA 6 esce nel 2026"),
+        source("https://ign.com/gta6", "Altro testo, stesso articolo"),
+        source("https://kotaku.com/gta", "GTA 6   esce nel 2026"),
+        source("https://polygon.com/gta", "Trailer e data di uscita"),
+    ]
+    out = budget.compact_sources(sources)
+    assert [s["url"] for s in out] == ["https://www.ign.com/gta6/", "https://polygon.com/gta"]
+    assert set(out[0]) == {"title", "url", "snippet"}
+
+
+def test_compact_sources_respects_budget():
+    sources = [source(f"https://sito{i}.com/", f"articolo {i} " + "parola " * 200) for i in range(10)]
+    out = budget.compact_sources(sources, budget=150, per_source=40)
+    assert 0 < len(out) < 10
+    assert [s["url"] for s in out] == [s["url"] for s in sources[:len(out)]]
+    assert budget.count_tokens(budget.format_sources(out)) <= 150
+    assert all(budget.count_tokens(s["snippet"]) <= 40 for s in out)
+    # La prima fonte entra sempre, anche se da sola supera il budget
+    assert len(budget.compact_sources(sources, budget=1)) == 1
+
+
+def test_compact_lines_dedupes_by_content():
+    lines = ["Zelda è tornato!", "zelda È tornato", "Mario Kart", "", "   "]
+    assert budget.compact_lines(lines) == ["Zelda è tornato!", "Mario Kart"]
+
+
+def test_window_keeps_short_history():
+    messages = [HumanMessage(content=str(i)) for i in range(budget.KEEP_MESSAGES + 1)]
+    assert budget.window_messages(messages) == messages
+
+
+def test_window_summarizes_older_messages():
+    messages = [HumanMessage(content=f"domanda {i}", id=f"h{i}") if i % 2 == 0
+                else AIMessage(content=f"risposta {i}", id=f"a{i}") for i in range(10)]
+    windowed = budget.window_messages(messages, keep_last=4)
+    assert len(windowed) == 5
+    summary = windowed[0]
+    assert isinstance(summary, SystemMessage) and summary.id == budget.SUMMARY_ID
+    assert summary.content.splitlines()[1:] == [f"{m.type}: {m.content}" for m in messages[:6]]
+    assert windowed[1:] == messages[-4:]
+
+
+def test_window_folds_previous_summary():
+    history = [HumanMessage(content=f"messaggio {i}", id=str(i)) for i in range(8)]
+    first = budget.window_messages(history, keep_last=3)
+    more = first + [HumanMessage(content=f"nuovo {i}", id=f"n{i}") for i in range(3)]
+    second = budget.window_messages(more, keep_last=3)
+    # Un solo riassunto, che contiene anche le righe di quello precedente
+    assert [m.id for m in second].count(budget.SUMMARY_ID) == 1
+    assert "human: messaggio 0" in second[0].content
+    assert "human: messaggio 7" in second[0].content
+
+
+def test_window_summary_respects_token_budget():
+    messages = [HumanMessage(content="parola " * 30, id=str(i)) for i in range(40)]
+    summary = budget.window_messages(messages, keep_last=2, summary_tokens=50)[0]
+    assert budget.count_tokens(summary.content.split("\n", 1)[1]) <= 50
+
+
+def test_add_windowed_messages_reducer():
+    left = [HumanMessage(content=f"m{i}", id=str(i)) for i in range(budget.KEEP_MESSAGES)]
+    merged = budget.add_windowed_messages(left, [AIMessage(content="ok", id="x"), AIMessage(content="ok2", id="y")])
+    assert merged[0].id == budget.SUMMARY_ID
+    assert [m.id for m in merged[-2:]] == ["x", "y"]
+    # Stesso id: il messaggio viene sostituito, non aggiunto
+    replaced = budget.add_windowed_messages(merged, [AIMessage(content="modificato", id="y")])
+    assert len(replaced) == len(merged) and replaced[-1].content == "modificato"
+
+
+def test_encoding_falls_back_when_bpe_is_unavailable(monkeypatch):
+    # Worker offline: tiktoken è installato ma il file BPE non si scarica
+    def get_encoding(name):
+        raise OSError("rete non raggiungibile")
+    monkeypatch.setitem(sys.modules, "tiktoken", types.SimpleNamespace(get_encoding=get_encoding))
+    assert _encoding.__wrapped__() is None
@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+
+from langchain_core.outputs import Generation
+from langchain_core.runnables import RunnableLambda
+
+from cache import LLMCache, ResponseCache
+
+MODEL = "gpt-4o-mini"
+
+
+class FakeEmbeddings:
+    def embed_query(self, text):
+        words = set(text.lower().replace("?", "").split())
+        return [float(w in words) for w in ("gta", "6", "uscita", "zelda", "meteo")]
+
+
+def in_node(node, call):
+    """Esegue ``call`` come se fosse dentro il nodo LangGraph ``node``."""
+    return RunnableLambda(lambda _: call()).invoke(None, {"metadata": {"langgraph_node": node}})
+
+
+@pytest.fixture
+def llm_cache(tmp_path):
+    return LLMCache(tmp_path / "cache.sqlite", policy={"router": "exact", "riassunto": "semantic"},
+                    embeddings=FakeEmbeddings())
+
+
+def test_hit_does_not_block_other_writers(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    responses = ResponseCache(path)
+    responses.set("tavily", {"q": "gta 6"}, {"results": [1, 2]})
+    assert responses.get("tavily", {"q": "gta 6"}) == {"results": [1, 2]}
+    assert not responses.conn.in_transaction
+
+    # Stesso file, altra connessione: il hit non ha lasciato il lock di scrittura
+    llm = LLMCache(path)
+    llm.update("prompt", "gpt-4o-mini", [Generation(text="risposta")])
+    assert llm.lookup("prompt", "gpt-4o-mini")[0].text == "risposta"
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_nodes_outside_the_policy_skip_the_cache(llm_cache):
+    in_node("generate_title", lambda: llm_cache.update("titolo", MODEL, [Generation(text="A")]))
+    assert in_node("generate_title", lambda: llm_cache.lookup("titolo", MODEL)) is None
+    assert llm_cache.lookup("titolo", MODEL) is None  # fuori da un nodo
+    assert llm_cache.conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone() == (0,)
+    assert llm_cache.stats()["misses"] == 0
+
+
+def test_exact_node_matches_normalized_prompt_only(llm_cache):
+    assert in_node("router", lambda: llm_cache.lookup("Data di uscita di GTA 6?", MODEL)) is None
+    in_node("router", lambda: llm_cache.update("Data di uscita di GTA 6?", MODEL, [Generation(text="topic")]))
+
+    hit = in_node("router", lambda: llm_cache.lookup("Data di  uscita\ndi GTA 6?", MODEL))
+    assert [g.text for g in hit] == ["topic"]
+    # Prompt simile ma diverso: il livello esatto non lo riusa
+    assert in_node("router", lambda: llm_cache.lookup("Uscita di GTA 6?", MODEL)) is None
+    assert in_node("router", lambda: llm_cache.lookup("Data di uscita di GTA 6?", "gpt-4o")) is None
+    assert not llm_cache.conn.in_transaction
+    assert llm_cache.stats()["exact_hits"] == 1 and llm_cache.stats()["semantic_hits"] == 0
+
+
+def test_semantic_node_reuses_similar_prompts(llm_cache):
+    in_node("riassunto", lambda: llm_cache.lookup("Data di uscita di GTA 6?", MODEL))
+    in_node("riassunto", lambda: llm_cache.update("Data di uscita di GTA 6?", MODEL, [Generation(text="2026")]))
+
+    hit = in_node("riassunto", lambda: llm_cache.lookup("Uscita di GTA 6?", MODEL))
+    assert [g.text for g in hit] == ["2026"]
+    assert in_node("riassunto", lambda: llm_cache.lookup("Meteo su Zelda?", MODEL)) is None
+    assert not llm_cache.conn.in_transaction
+    assert llm_cache.stats()["semantic_hits"] == 1
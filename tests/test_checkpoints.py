@@ -0,0 +1,217 @@
+import sqlite3
+import time
+from typing import TypedDict
+
+import pytest
+
+pytest.importorskip("langgraph.checkpoint.sqlite")
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import END, START, StateGraph
+
+import checkpoints
+from checkpoints import BLOB_REF, CheckpointRetention, CompactSerializer, connect_db
+
+STEPS = 6
+
+SCHEMA = """CREATE TABLE checkpoints (
+    thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL DEFAULT '', checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT, type TEXT, checkpoint BLOB, metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))"""
+
+
+class StepState(TypedDict, total=False):
+    step: int
+
+
+def _step(state: StepState) -> StepState:
+    return {"step": state.get("step", 0) + 1}
+
+
+def _config(thread_id):
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def _run(db_path, threads):
+    """Un grafo lineare di ``STEPS`` nodi eseguito fino in fondo su ogni thread."""
+    builder = StateGraph(StepState)
+    previous = START
+    for i in range(STEPS):
+        builder.add_node(f"n{i}", _step)
+        builder.add_edge(previous, f"n{i}")
+        previous = f"n{i}"
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    graph = builder.compile(checkpointer=SqliteSaver(conn))
+    for thread_id in threads:
+        graph.invoke({"step": 0}, _config(thread_id))
+    return graph, conn
+
+
+class ArticleState(TypedDict, total=False):
+    step: int
+    publish: bool
+    draft: str
+    article_id: int
+
+
+def _save(state: ArticleState) -> ArticleState:
+    # Come save_node: article_id solo quando l'articolo viene davvero salvato
+    return {"article_id": 7} if state.get("publish") else {}
+
+
+def _counts(conn, table):
+    return dict(conn.execute(f"SELECT thread_id, COUNT(*) FROM {table} GROUP BY thread_id").fetchall())
+
+
+def test_compact_keeps_last_checkpoints_per_thread(tmp_path):
+    db_path = tmp_path / "articles.sqlite"
+    graph, conn = _run(db_path, ["a", "b"])
+    before = _counts(conn, "checkpoints")
+    assert min(before.values()) > 3
+
+    result = CheckpointRetention(db_path, keep_last=3).compact()
+    assert _counts(conn, "checkpoints") == {"a": 3, "b": 3}
+    assert result["checkpoints"] == sum(before.values()) - 6
+    # Lo stato più recente resta leggibile e nessuna write punta a checkpoint cancellati
+    assert graph.get_state(_config("a")).values == {"step": STEPS}
+    assert not conn.execute(
+        """SELECT 1 FROM writes w WHERE NOT EXISTS (
+               SELECT 1 FROM checkpoints c WHERE c.thread_id = w.thread_id
+               AND c.checkpoint_ns = w.checkpoint_ns AND c.checkpoint_id = w.checkpoint_id)"""
+    ).fetchone()
+
+
+def test_compact_is_idempotent(tmp_path):
+    db_path = tmp_path / "articles.sqlite"
+    _run(db_path, ["a"])
+    retention = CheckpointRetention(db_path, keep_last=2)
+    assert retention.compact()["checkpoints"] > 0
+    assert retention.compact()["checkpoints"] == 0
+
+
+def _checkpoint(value):
+    return {"v": 1, "id": "c1", "ts": "", "channel_values": {"draft": value},
+            "channel_versions": {}, "versions_seen": {}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    db_path = tmp_path / "articles.sqlite"
+    conn = sqlite3.connect(db_path)
+    conn.execute(SCHEMA)
+    conn.commit()
+    serde = CompactSerializer(db_path, min_ref=16)
+    retention = CheckpointRetention(db_path, serde=serde)
+
+    def save(value):
+        type_, data = serde.dumps_typed(_checkpoint(value))
+        with conn:
+            conn.execute("INSERT INTO checkpoints(thread_id, checkpoint_id, type, checkpoint) VALUES (?, ?, ?, ?)",
+                         ("t", str(time.time_ns()), type_, data))
+
+    def blob(value, age=0.0):
+        digest = serde._store_blob(value)[BLOB_REF]
+        with serde.conn:
+            serde.conn.execute("UPDATE checkpoint_blobs SET last_used = ? WHERE hash = ?",
+                               (time.time() - age, digest))
+        return digest
+
+    def stored():
+        return {h for (h,) in serde.conn.execute("SELECT hash FROM checkpoint_blobs")}
+
+    def collect(grace=60.0):
+        c = retention._connect()
+        try:
+            return retention._collect_blobs(c, grace=grace)
+        finally:
+            c.close()
+
+    return serde, save, blob, stored, collect
+
+
+def test_blobs_live_outside_checkpoint_db(tmp_path, store):
+    serde, save, *_ = store
+    save("x" * 100)
+    assert serde.blob_path == tmp_path / "articles.blobs.sqlite"
+    main = connect_db(tmp_path / "articles.sqlite")
+    assert not main.execute("SELECT 1 FROM sqlite_master WHERE name = 'checkpoint_blobs'").fetchone()
+
+
+def test_collect_removes_only_old_unreferenced_blobs(store):
+    serde, save, blob, stored, collect = store
+    save("referenziato " * 10)
+    referenced = blob("referenziato " * 10, age=3600)
+    orphan = blob("orfano " * 10, age=3600)
+    recent = blob("recente " * 10, age=1)
+    assert collect() == 1
+    assert stored() == {referenced, recent}
+    assert orphan not in serde.blob_cache
+
+
+def test_collect_rechecks_grace_inside_delete(store, monkeypatch):
+    serde, save, blob, stored, collect = store
+    orphan = blob("orfano " * 10, age=3600)
+    real_connect = checkpoints.connect_db
+
+    class Touching:
+        # Un checkpoint scrive (e tocca) il blob tra la scansione e la DELETE
+        def __init__(self, conn):
+            self.conn = conn
+
+        def execute(self, sql, *args):
+            if sql == "BEGIN IMMEDIATE":
+                serde._store_blob("orfano " * 10)
+            return self.conn.execute(sql, *args)
+
+        def close(self):
+            self.conn.close()
+
+    monkeypatch.setattr(checkpoints, "connect_db", lambda *a, **kw: Touching(real_connect(*a, **kw)))
+    assert collect() == 0
+    assert orphan in stored()
+
+
+def test_compact_round_trips_large_channels(tmp_path):
+    db_path = tmp_path / "articles.sqlite"
+    serde = CompactSerializer(db_path, min_ref=16)
+    conn = sqlite3.connect(db_path)
+    conn.execute(SCHEMA)
+    conn.commit()
+    type_, data = serde.dumps_typed(_checkpoint("bozza " * 200))
+    assert len(data) < len("bozza " * 200)
+    assert serde.loads_typed((type_, data))["channel_values"]["draft"] == "bozza " * 200
+
+
+def test_legacy_blob_table_is_adopted(tmp_path):
+    db_path = tmp_path / "articles.sqlite"
+    legacy = connect_db(db_path)
+    legacy.execute(CompactSerializer.SCHEMA)
+    legacy.execute("INSERT INTO checkpoint_blobs VALUES ('h', 'msgpack', x'00', 0)")
+    legacy.commit()
+    serde = CompactSerializer(db_path)
+    assert serde.conn.execute("SELECT hash FROM checkpoint_blobs").fetchall() == [("h",)]
+    assert not legacy.execute("SELECT 1 FROM sqlite_master WHERE name = 'checkpoint_blobs'").fetchone()
+
+
+@pytest.mark.parametrize("compact_serde", [False, True])
+def test_finished_threads_keep_fewer_checkpoints(tmp_path, compact_serde):
+    db_path = tmp_path / "articles.sqlite"
+    serde = CompactSerializer(db_path, min_ref=16) if compact_serde else None
+    builder = StateGraph(ArticleState)
+    builder.add_node("draft", lambda state: {"step": state.get("step", 0) + 1, "draft": "bozza " * 50})
+    builder.add_node("review", _step)
+    builder.add_node("save", _save)
+    builder.add_edge(START, "draft")
+    builder.add_edge("draft", "review")
+    builder.add_edge("review", "save")
+    builder.add_edge("save", END)
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    graph = builder.compile(checkpointer=SqliteSaver(conn, serde=serde))
+    graph.invoke({"step": 0, "publish": True}, _config("pubblicato"))
+    graph.invoke({"step": 0, "publish": False}, _config("scartato"))
+    assert min(_counts(conn, "checkpoints").values()) > 2
+
+    CheckpointRetention(db_path, keep_last=2, keep_finished=1, serde=serde).compact()
+    assert _counts(conn, "checkpoints") == {"pubblicato": 1, "scartato": 2}
+    # L'ultimo checkpoint resta: il thread concluso si riconosce ancora
+    assert graph.get_state(_config("pubblicato")).values["article_id"] == 7
+    assert graph.get_state(_config("pubblicato")).next == ()
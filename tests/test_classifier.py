@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+pytest.importorskip("langgraph")
+
+from agent_2 import TopicClassifier
+from langchain_core.messages import AIMessage
+
+TERMS = ["GTA 6", "Meteo Roma", "Zelda"]
+
+
+class FakeLLM:
+    """Risponde a ogni blocco con ``reply(termini)``; registra i blocchi ricevuti."""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = []
+
+    def invoke(self, messages):
+        terms = [line.split(". ", 1)[1] for line in messages[-1]["content"].splitlines()]
+        self.calls.append(terms)
+        return AIMessage(content=self.reply(terms))
+
+
+def classifier(tmp_path, reply, **kwargs):
+    return TopicClassifier(FakeLLM(reply), db_path=tmp_path / "articles.sqlite", **kwargs)
+
+
+def test_classify_maps_positions_to_terms_and_clamps(tmp_path):
+    c = classifier(tmp_path, lambda terms: '{"1": 9, "2": -3, "3": 14}')
+    assert c.classify(TERMS) == {"GTA 6": 9, "Meteo Roma": 0, "Zelda": 10}
+
+
+def test_classify_accepts_fenced_json(tmp_path):
+    c = classifier(tmp_path, lambda terms: '```json\n{"2": 1}\n```')
+    assert c.classify(TERMS) == {"Meteo Roma": 1}
+
+
+def test_unreadable_reply_leaves_terms_unscored(tmp_path):
+    c = classifier(tmp_path, lambda terms: "Non saprei.")
+    assert c.classify(TERMS) == {}
+    assert c.rank_gaming(TERMS) == []
+
+
+def test_verdicts_are_cached_across_instances(tmp_path):
+    first = classifier(tmp_path, lambda terms: '{"1": 9, "2": 1, "3": 8}')
+    first.classify(TERMS)
+    again = classifier(tmp_path, lambda terms: json.dumps({"1": 7}))
+    # Stesso termine con maiuscole e spazi diversi: nessuna nuova chiamata
+    assert again.classify(["gta  6", "Zelda", "Elden Ring"]) == {"gta  6": 9, "Zelda": 8, "Elden Ring": 7}
+    assert again.llm.calls == [["Elden Ring"]]
+
+
+def test_classify_in_batches(tmp_path):
+    terms = [f"termine {i}" for i in range(5)]
+    c = classifier(tmp_path, lambda batch: json.dumps({str(i + 1): 7 for i in range(len(batch))}),
+                   batch_size=2)
+    assert c.classify(terms + terms[:2]) == {t: 7 for t in terms}
+    assert sorted(len(b) for b in c.llm.calls) == [1, 2, 2]
+    assert sorted(t for b in c.llm.calls for t in b) == terms
+
+
+def test_rank_gaming_orders_by_score(tmp_path):
+    c = classifier(tmp_path, lambda terms: '{"1": 7, "2": 2, "3": 9}')
+    assert c.rank_gaming(TERMS) == ["Zelda", "GTA 6"]
+    assert c.is_gaming("Zelda") and not c.is_gaming("Meteo Roma")
+
+
+parse = TopicClassifier._parse_scores
+
+
+def test_parse_scores_accepts_positional_list():
+    assert parse(TERMS, "[8, 2, 7]") == {"GTA 6": 8, "Meteo Roma": 2, "Zelda": 7}
+
+
+@pytest.mark.parametrize("content", ["42", '"gaming"', "null", "non è json"])
+def test_parse_scores_non_object_reply_is_empty(content):
+    assert parse(TERMS, content) == {}
+
+
+def test_parse_scores_skips_bad_indices_and_values():
+    content = '{"0": 9, "4": 9, "x": 9, "1": "alto", "3": 6}'
+    assert parse(TERMS, content) == {"Zelda": 6}
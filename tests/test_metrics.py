@@ -0,0 +1,96 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("langchain_core")
+from metrics import Metrics, cost, percentile
+
+
+@pytest.fixture
+def sink(tmp_path):
+    return Metrics(tmp_path / "metrics.sqlite")
+
+
+def test_percentile_interpolates():
+    values = [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert percentile(values, 0.50) == 3.0
+    assert percentile(values, 0.95) == pytest.approx(4.8)
+    assert percentile([7.0], 0.95) == 7.0
+    assert percentile([], 0.5) == 0.0
+
+
+def test_summary_aggregates_per_node(sink):
+    for duration in [0.1 * i for i in range(1, 21)]:  # 0.1 ... 2.0
+        sink.record("node", "generate_article", duration, thread_id="t1", node="generate_article")
+    sink.record("node", "save", 0.5, thread_id="t1", node="save", error="OperationalError")
+
+    summary = {s["name"]: s for s in sink.summary()}
+    article = summary["generate_article"]
+    assert article["calls"] == 20
+    assert article["p50"] == pytest.approx(1.05)
+    assert article["p95"] == pytest.approx(1.905)
+    assert article["max"] == pytest.approx(2.0)
+    assert article["total"] == pytest.approx(21.0)
+    assert summary["save"]["errors"] == 1
+    # Ordinati per tempo totale: il nodo più lento per primo
+    assert [s["name"] for s in sink.summary()] == ["generate_article", "save"]
+
+
+def test_summary_tokens_cost_hits_and_retries(sink):
+    sink.record("llm", "gpt-4o-mini-2024-07-18", 1.0, prompt_tokens=1000, completion_tokens=500,
+                thread_id="t1", node="generate_title")
+    sink.record("llm", "gpt-4o-mini-2024-07-18", 0.0, cache_hit=True, thread_id="t2", node="generate_title")
+    sink.record("adapter", "tavily", 0.3, retries=2, thread_id="t1", node="search_sources")
+
+    llm = next(s for s in sink.summary() if s["kind"] == "llm")
+    assert (llm["calls"], llm["cache_hits"]) == (2, 1)
+    assert llm["cost"] == pytest.approx(cost("gpt-4o-mini", 1000, 500))
+    assert cost("gpt-4o-mini", 1000, 500) == pytest.approx((1000 * 0.15 + 500 * 0.60) / 1e6)
+    assert cost("modello-sconosciuto", 1000, 500) == 0.0
+    assert [s["calls"] for s in sink.summary(thread_id="t2")] == [1]
+    assert next(s for s in sink.summary() if s["kind"] == "adapter")["retries"] == 2
+
+
+def test_span_records_errors_and_cache_hits(sink):
+    with pytest.raises(ValueError):
+        with sink.span("adapter", "trends"):
+            raise ValueError("429")
+    with sink.span("adapter", "tavily"):
+        sink.cache_hit("tavily")
+
+    rows = {r["name"]: r for r in sink.rows()}
+    assert rows["trends"]["error"] == "ValueError"
+    assert rows["tavily"]["cache_hit"] == 1
+
+
+def test_prometheus_quantiles(sink):
+    for duration in (1.0, 2.0, 3.0):
+        sink.record("node", "save", duration, thread_id="t1", node="save")
+    text = sink.prometheus()
+    assert 'ccai_duration_seconds{kind="node",name="save",quantile="0.5"} 2.000000' in text
+    assert 'ccai_duration_seconds{kind="node",name="save",quantile="0.95"} 2.900000' in text
+    assert 'ccai_duration_seconds_count{kind="node",name="save"} 3' in text
+
+
+def test_records_are_written_in_batches(tmp_path):
+    path = tmp_path / "metrics.sqlite"
+    sink = Metrics(path, batch_size=3, flush_interval=60)
+
+    def stored():
+        with sqlite3.connect(path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM metrics").fetchone()[0]
+
+    for _ in range(4):
+        sink.record("node", "save", 0.1, thread_id="t1", node="save")
+    assert stored() == 3  # il quarto aspetta il prossimo gruppo
+    assert sink.conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    # Le letture vedono anche le righe ancora in memoria
+    assert [s["calls"] for s in sink.summary()] == [4]
+    assert stored() == 4
+
+
+def test_flush_interval_bounds_the_delay(tmp_path):
+    sink = Metrics(tmp_path / "metrics.sqlite", batch_size=100, flush_interval=0)
+    sink.record("node", "save", 0.1, thread_id="t1", node="save")
+    with sqlite3.connect(tmp_path / "metrics.sqlite") as conn:
+        assert conn.execute("SELECT COUNT(*) FROM metrics").fetchone()[0] == 1
@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("langgraph")
+
+from agent_2 import ArticleDB
+from assets import ASSET_URL
+
+DIGEST = "a" * 64
+
+
+def _legacy_db(path, schema, rows):
+    conn = sqlite3.connect(path)
+    conn.execute(schema)
+    conn.executemany(f"INSERT INTO articles VALUES ({','.join('?' * len(rows[0]))})", rows)
+    conn.commit()
+    conn.close()
+
+
+def _tables(db):
+    return {r[0] for r in db.conn.execute("SELECT name FROM sqlite_master")}
+
+
+def test_migrates_topic_article_schema(tmp_path):
+    # Schema storico di articles.sqlite: (topic, article) NOT NULL
+    path = tmp_path / "articles.sqlite"
+    _legacy_db(path, """CREATE TABLE articles (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL,
+        article TEXT NOT NULL, created_at TEXT NOT NULL)""",
+               [(7, "Zelda", "# Zelda\nTesto", "2024-01-01 10:00:00")])
+    db = ArticleDB(path)
+    assert db.version == len(ArticleDB.MIGRATIONS)
+    row = db.conn.execute("SELECT id, topic, title, body, images, created_at FROM articles").fetchone()
+    assert row == (7, "Zelda", "Zelda", "# Zelda\nTesto", "[]", "2024-01-01 10:00:00")
+    assert {"articles_fts", "article_embeddings", "draft_versions", "article_assets"} <= _tables(db)
+    assert db.search("zelda")[0]["id"] == 7
+
+
+def test_migrates_title_body_schema(tmp_path):
+    path = tmp_path / "articles.sqlite"
+    _legacy_db(path, """CREATE TABLE articles (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, body TEXT,
+        images TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",
+               [(1, "GTA 6", "Corpo", None, "2024-02-02 00:00:00")])
+    db = ArticleDB(path)
+    assert db.conn.execute("SELECT title, body, images, topic FROM articles").fetchone() == \
+        ("GTA 6", "Corpo", "[]", None)
+
+
+def test_migration_is_idempotent_and_new_db_is_current(tmp_path):
+    path = tmp_path / "articles.sqlite"
+    db = ArticleDB(path)
+    aid = db.save("Titolo", "Corpo", [], "topic")
+    db.conn.close()
+    again = ArticleDB(path)
+    assert again.migrate() == len(ArticleDB.MIGRATIONS)
+    assert again.conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0] == 1
+    assert again.search("titolo")[0]["id"] == aid
+
+
+def test_save_records_local_assets_in_order(tmp_path):
+    db = ArticleDB(tmp_path / "articles.sqlite")
+    other = "b" * 64
+    images = [f"{ASSET_URL}/aa/{DIGEST}-web.webp", "https://images.example/x.jpg", f"{ASSET_URL}/bb/{other}.png"]
+    aid = db.save("Titolo", "Corpo", images)
+    assert db.assets(aid) == [DIGEST, other]
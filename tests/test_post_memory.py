@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+agent = pytest.importorskip("agent")
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "blog_memory.sqlite"), str(tmp_path / "blog_memory.json")
+
+
+def test_round_trip(paths):
+    store = agent.PostMemory(*paths)
+    assert store.get("GTA 6", "Review") is None
+
+    first = store.append("GTA 6", "Review", "prima bozza", "2024-01-01T10:00:00")
+    second = store.append("GTA 6", "Review", "seconda bozza")
+    assert first == {"version": 1, "timestamp": "2024-01-01T10:00:00"}
+    assert second["version"] == 2
+
+    record = store.get("GTA 6", "Review")
+    assert [v["version"] for v in record["versions"]] == [1, 2]
+    assert all("content" not in v for v in record["versions"])
+    assert store.content("GTA 6", "Review") == "seconda bozza"
+    assert store.content("GTA 6", "Review", version=1) == "prima bozza"
+    assert store.content("GTA 6", "How-to") is None
+
+
+def test_list_topic_is_a_stable_key(paths):
+    store = agent.PostMemory(*paths)
+    store.append(["Zelda", "Switch 2"], "Evento", "testo")
+    assert store.get(["Zelda", "Switch 2"], "Evento")["versions"][0]["version"] == 1
+    assert store.get(["Switch 2", "Zelda"], "Evento") is None
+
+
+def test_versions_continue_across_runs(paths):
+    agent.PostMemory(*paths).append("GTA 6", "Review", "run 1")
+    reopened = agent.PostMemory(*paths)
+    assert reopened.append("GTA 6", "Review", "run 2")["version"] == 2
+    assert reopened.conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0] == 1
+
+
+def test_legacy_file_is_imported_once(paths):
+    db_path, legacy = paths
+    with open(legacy, "w", encoding="utf-8") as f:
+        json.dump([{"topic": "GTA 6", "category": "Review", "versions": [
+            {"version": 1, "timestamp": "2024-01-01T10:00:00", "content": "v1"},
+            {"version": 2, "timestamp": "2024-01-02T10:00:00", "content": "v2"},
+        ]}], f)
+
+    agent.PostMemory(db_path, legacy)
+    store = agent.PostMemory(db_path, legacy)  # secondo avvio: nessuna nuova importazione
+    assert [v["version"] for v in store.get("GTA 6", "Review")["versions"]] == [1, 2]
+    assert store.content("GTA 6", "Review") == "v2"
+
+
+def test_empty_legacy_file(paths):
+    db_path, legacy = paths
+    open(legacy, "w").close()
+    assert agent.PostMemory(db_path, legacy).get("GTA 6", "Review") is None
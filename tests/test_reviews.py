@@ -0,0 +1,163 @@
+import asyncio
+import json
+import operator
+import urllib.error
+import urllib.request
+from typing import Annotated, List, TypedDict
+
+import pytest
+
+pytest.importorskip("langgraph.checkpoint.sqlite.aio")
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from langgraph.graph import END, START, StateGraph
+
+from reviews import ReviewQueue, request_review
+
+
+class ReviewState(TypedDict, total=False):
+    answers: Annotated[List[List[str]], operator.add]
+
+
+def reviewer(part: str):
+    def node(state: ReviewState) -> ReviewState:
+        return {"answers": [[part, request_review("approve", f"{part} ok?")]]}
+    return node
+
+
+class Tracked:
+    """Grafo compilato che conta le riprese concorrenti."""
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.active = 0
+        self.max_active = 0
+
+    async def aget_state(self, config):
+        return await self.graph.aget_state(config)
+
+    async def ainvoke(self, payload, config):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.01)
+            return await self.graph.ainvoke(payload, config)
+        finally:
+            self.active -= 1
+
+
+def run(tmp_path, scenario):
+    """Esegue ``scenario(queue, graph)`` con due revisioni parallele aperte sul thread "t1"."""
+    builder = StateGraph(ReviewState)
+    builder.add_node("review_title", reviewer("title"))
+    builder.add_node("review_images", reviewer("images"))
+    builder.add_edge(START, "review_title")
+    builder.add_edge(START, "review_images")
+    builder.add_edge("review_title", END)
+    builder.add_edge("review_images", END)
+    db_path = tmp_path / "articles.sqlite"
+
+    async def main():
+        async with AsyncSqliteSaver.from_conn_string(str(db_path)) as saver:
+            graph = Tracked(builder.compile(checkpointer=saver))
+            await graph.graph.ainvoke({"answers": []}, {"configurable": {"thread_id": "t1"}})
+            return await scenario(ReviewQueue(graph, db_path), graph)
+
+    return asyncio.run(main())
+
+
+def test_pending_lists_one_review_per_interrupt(tmp_path):
+    async def scenario(queue, graph):
+        return await queue.pending()
+
+    reviews = run(tmp_path, scenario)
+    assert sorted(r["node"] for r in reviews) == ["review_images", "review_title"]
+    assert all(r["thread_id"] == "t1" and r["kind"] == "approve" for r in reviews)
+
+
+def test_review_id_resolves_node_name(tmp_path):
+    async def scenario(queue, graph):
+        by_id = [r for r in await queue.pending("t1") if r["node"] == "review_images"][0]["review_id"]
+        assert await queue.answer("t1", "review_title", "y", wait=True)
+        assert await queue.answer("t1", by_id, "n", wait=True)
+        assert not await queue.answer("t1", "review_title", "y", wait=True)
+        return (await graph.aget_state({"configurable": {"thread_id": "t1"}})).values
+
+    assert sorted(run(tmp_path, scenario)["answers"]) == [["images", "n"], ["title", "y"]]
+
+
+def test_resumes_on_the_same_thread_are_serialized(tmp_path):
+    async def scenario(queue, graph):
+        assert await queue.answer("t1", "review_title", "y")
+        assert await queue.answer("t1", "review_images", "y")
+        await asyncio.wait_for(queue.wait_done(["t1"], poll=0.01), timeout=10)
+        return graph.max_active, await queue.pending("t1")
+
+    max_active, pending = run(tmp_path, scenario)
+    assert max_active == 1
+    assert pending == []
+
+
+def http(method, url, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, method=method)) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_http_endpoint(tmp_path):
+    async def scenario(queue, graph):
+        server = queue.serve(port=0)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            listed = await asyncio.to_thread(http, "GET", f"{base}/reviews")
+            unknown = await asyncio.to_thread(http, "POST", f"{base}/reviews/t1/nessuna", {"answer": "y"})
+            bad = await asyncio.to_thread(http, "POST", f"{base}/reviews/t1/review_title", {"risposta": "y"})
+            accepted = await asyncio.to_thread(http, "POST", f"{base}/reviews/t1/review_title", {"answer": "y"})
+            await asyncio.wait_for(queue.wait_done([], poll=0.01), timeout=10)
+            left = await asyncio.to_thread(http, "GET", f"{base}/reviews/t1")
+            missing = await asyncio.to_thread(http, "GET", f"{base}/altro")
+        finally:
+            await asyncio.to_thread(server.shutdown)
+        return listed, unknown, bad, accepted, left, missing
+
+    listed, unknown, bad, accepted, left, missing = run(tmp_path, scenario)
+    assert listed[0] == 200 and len(listed[1]) == 2
+    assert unknown[0] == 404
+    assert bad[0] == 400
+    assert accepted == (202, {"status": "resuming", "thread_id": "t1"})
+    assert [r["node"] for r in left[1]] == ["review_images"]
+    assert missing[0] == 404
+
+
+def test_assets_stay_inside_the_archive(tmp_path):
+    assets = tmp_path / "assets"
+    (assets / "ab").mkdir(parents=True)
+    (assets / "ab" / "ab12-web.webp").write_bytes(b"RIFF....WEBP")
+    (tmp_path / "segreto.txt").write_text("non pubblico")
+
+    def get(url):
+        try:
+            with urllib.request.urlopen(url) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+    async def scenario(queue, graph):
+        server = queue.serve(port=0, assets=assets)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            return {path: await asyncio.to_thread(get, base + path) for path in (
+                "/assets/ab/ab12-web.webp", "/assets/../segreto.txt", "/assets/ab/../../segreto.txt",
+                "/assets/ab", "/assets/ab/manca.webp")}
+        finally:
+            await asyncio.to_thread(server.shutdown)
+
+    responses = run(tmp_path, scenario)
+    status, headers, body = responses.pop("/assets/ab/ab12-web.webp")
+    assert (status, body) == (200, b"RIFF....WEBP")
+    assert headers["Content-Type"] == "image/webp"
+    assert "immutable" in headers["Cache-Control"]
+    assert {path: r[0] for path, r in responses.items()} == dict.fromkeys(responses, 404)
+    assert all(b"non pubblico" not in r[2] for r in responses.values())
@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from revision import apply_edits, parse_edits
+
+
+def test_parse_edits_reads_json_array_inside_text():
+    content = 'Ecco le modifiche:\n```json\n[{"find": "vecchio", "replace": "nuovo"}]\n```'
+    assert parse_edits(content) == [{"find": "vecchio", "replace": "nuovo"}]
+
+
+@pytest.mark.parametrize("content", ["nessuna modifica", "[non json]", '{"find": "a", "replace": "b"}'])
+def test_parse_edits_unreadable_reply_is_empty(content):
+    assert parse_edits(content) == []
+
+
+def test_parse_edits_drops_invalid_entries():
+    content = '[{"find": "", "replace": "x"}, {"find": "a"}, "testo", {"find": "b", "replace": "c"}]'
+    assert parse_edits(content) == [{"find": "b", "replace": "c"}]
+
+
+def test_apply_edits_replaces_first_occurrence_only():
+    text, applied = apply_edits("gatto gatto", [{"find": "gatto", "replace": "cane"}])
+    assert (text, applied) == ("cane gatto", 1)
+
+
+def test_apply_edits_tolerates_whitespace_differences():
+    draft = "Il nuovo capitolo\n  arriva   a marzo."
+    text, applied = apply_edits(draft, [{"find": "capitolo arriva a marzo", "replace": "capitolo arriva ad aprile"}])
+    assert text == "Il nuovo capitolo arriva ad aprile."
+    assert applied == 1
+
+
+def test_apply_edits_counts_only_matching_edits():
+    edits = [{"find": "assente", "replace": "x"}, {"find": "bozza", "replace": "versione"}]
+    assert apply_edits("una bozza", edits) == ("una versione", 1)
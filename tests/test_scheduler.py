@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+import scheduler
+from scheduler import CircuitBreaker, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(scheduler.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_token_bucket_starts_full_and_waits_after_debit(clock):
+    bucket = TokenBucket(per_minute=60)  # 1 unità al secondo
+    assert bucket.wait_time(60) == 0.0
+    bucket.debit(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    clock[0] += 30
+    assert bucket.wait_time(30) == 0.0
+
+
+def test_token_bucket_debt_must_be_refilled(clock):
+    bucket = TokenBucket(per_minute=60, capacity=10)
+    bucket.debit(20)  # consumo noto a posteriori: livello -10
+    assert bucket.wait_time(1) == pytest.approx(11.0)
+
+
+def test_token_bucket_amount_above_capacity_waits_for_full_bucket(clock):
+    bucket = TokenBucket(per_minute=60, capacity=10)
+    bucket.debit(10)
+    assert bucket.wait_time(100) == pytest.approx(10.0)
+
+
+def test_token_bucket_refill_is_capped(clock):
+    bucket = TokenBucket(per_minute=60, capacity=10)
+    clock[0] += 3600
+    bucket.debit(0)
+    assert bucket.level == 10
+
+
+def test_circuit_opens_after_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert not breaker.allow()
+
+
+def test_circuit_allows_single_probe_after_timeout(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.failure()
+    clock[0] += 31
+    assert breaker.allow()
+    assert not breaker.allow()  # la prova è già in corso
+    breaker.success()
+    assert breaker.allow() and breaker.failures == 0
+
+
+def test_circuit_failed_probe_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.failure()
+    clock[0] += 31
+    assert breaker.allow()
+    breaker.failure()
+    assert not breaker.allow()
+    clock[0] += 31
+    assert breaker.allow()
+
+
+def _open_circuit(sched, clock):
+    sched.providers["x"] = scheduler._Provider("x", scheduler.ProviderLimits(failure_threshold=1, reset_timeout=30))
+    sched.failure("x", ConnectionError("giù"))
+    clock[0] += 31
+    return sched.providers["x"].breaker
+
+
+def test_cancelled_probe_releases_the_circuit(clock):
+    sched = scheduler.Scheduler(providers={})
+    breaker = _open_circuit(sched, clock)
+
+    async def main():
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(3600)
+
+        probe = asyncio.create_task(sched.acall("x", hang))
+        await started.wait()
+        assert breaker.probing
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        # La prova cancellata non lascia il circuito bloccato né lo chiude
+        assert not breaker.probing and breaker.opened_at is not None
+        async def ok():
+            return "ok"
+        return await sched.acall("x", ok)
+
+    assert asyncio.run(main()) == "ok"
+    assert breaker.opened_at is None
+
+
+def test_cancelled_llm_call_releases_the_circuit(clock):
+    sched = scheduler.Scheduler(providers={})
+    breaker = _open_circuit(sched, clock)
+    assert breaker.allow()
+    sched.callback("x").on_llm_error(asyncio.CancelledError(), run_id=None)
+    assert not breaker.probing and breaker.opened_at is not None
+    assert breaker.allow()
@@ -0,0 +1,69 @@
+import pytest
+
+agent_2 = pytest.importorskip("agent_2")
+from langchain_core.messages import AIMessage
+
+Speculation = agent_2.Speculation
+
+
+def test_titles_capped_by_cost():
+    # gpt-4o-mini: 20 token di completamento ≈ 1.2e-5 $ per alternativa
+    assert Speculation(k=2, max_cost=0.001).titles("gpt-4o-mini") == 2
+    assert Speculation(k=5, max_cost=0.00003).titles("gpt-4o-mini") == 2
+    assert Speculation(k=2, max_cost=0.0).titles("gpt-4o") == 0
+    # Prezzo sconosciuto: nessun tetto
+    assert Speculation(k=3, max_cost=0.0).titles("modello-locale") == 3
+    assert Speculation(k=0).titles("gpt-4o") == 0
+
+
+def test_parse_titles():
+    content = '1. "GTA 6: la data"\n2) Zelda torna\n- GTA 6: la data\n\n• “Mario Kart World”\n'
+    assert Speculation.parse_titles(content, 3) == ["GTA 6: la data", "Zelda torna", "Mario Kart World"]
+    assert Speculation.parse_titles(content, 1) == ["GTA 6: la data"]
+    assert Speculation.parse_titles("  ", 2) == [""]
+
+
+def test_next_candidate_pops_the_first_alternative():
+    state = {"candidates": {"title": ["B", "C"]}}
+    assert Speculation.next_candidate(state, "title") == {
+        "draft": {"title": "B"}, "approved": {"title": None}, "candidates": {"title": ["C"]}}
+    assert Speculation.next_candidate({"candidates": {"title": []}}, "title") is None
+    assert Speculation.next_candidate({}, "images") is None
+
+
+class FakeLLM:
+    model_name = "gpt-4o-mini"
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = []
+
+    def invoke(self, messages):
+        self.calls.append(messages)
+        return AIMessage(content=self.reply)
+
+
+def test_title_alternatives_come_from_one_call(monkeypatch):
+    fake = FakeLLM("Titolo A\nTitolo B\nTitolo C")
+    monkeypatch.setattr(agent_2, "llm", fake)
+    monkeypatch.setattr(agent_2, "speculation", Speculation(k=2, max_cost=1.0))
+
+    first = agent_2.generate_title_node({"topic": "GTA 6"})
+    assert first["draft"] == {"title": "Titolo A"}
+    assert first["candidates"] == {"title": ["Titolo B", "Titolo C"]}
+    assert "3 titoli" in fake.calls[0][0].content
+
+    # Titolo rifiutato: l'alternativa è già pronta, nessuna nuova chiamata
+    second = agent_2.generate_title_node({"topic": "GTA 6", **first})
+    assert second["draft"] == {"title": "Titolo B"}
+    assert len(fake.calls) == 1
+
+
+def test_no_alternatives_without_budget(monkeypatch):
+    fake = FakeLLM("Titolo unico")
+    monkeypatch.setattr(agent_2, "llm", fake)
+    monkeypatch.setattr(agent_2, "speculation", Speculation(k=2, max_cost=0.0))
+
+    update = agent_2.generate_title_node({"topic": "GTA 6"})
+    assert update["draft"] == {"title": "Titolo unico"} and update["candidates"] == {"title": []}
+    assert "un titolo" in fake.calls[0][0].content
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+agent_2 = pytest.importorskip("agent_2")
+from cache import ResponseCache
+
+
+def result(domain, score):
+    return {"url": f"https://www.{domain}/articolo", "title": domain, "content": "...", "score": score}
+
+
+class FakeTavily:
+    """Risultati in ordine di rilevanza; ``exclude_domains`` li filtra come l'API."""
+
+    def __init__(self, results):
+        self.results = results
+        self.calls = []
+
+    def _search(self, query, max_results, exclude_domains):
+        self.calls.append({"query": query, "max_results": max_results, "exclude": list(exclude_domains)})
+        found = [r for r in self.results if agent_2.TavilyAdapter._domain(r["url"]) not in exclude_domains]
+        return {"results": found[:max_results]}
+
+    def search(self, query, max_results=10, exclude_domains=()):
+        return self._search(query, max_results, exclude_domains)
+
+
+class AsyncFakeTavily(FakeTavily):
+    async def search(self, query, max_results=10, exclude_domains=()):
+        return self._search(query, max_results, exclude_domains)
+
+
+@pytest.fixture(autouse=True)
+def no_shared_cache(monkeypatch):
+    # Ogni test con la propria cache in memoria: le pagine non arrivano dal test precedente
+    monkeypatch.setattr(agent_2, "response_cache", ResponseCache(None))
+
+
+def adapter(results, **kwargs):
+    tavily = agent_2.TavilyAdapter(api_key="test", min_score=0.6, target_sources=3, page_size=3, **kwargs)
+    tavily.client = FakeTavily(results)
+    tavily.aclient = AsyncFakeTavily(results)
+    return tavily
+
+
+ENOUGH = [result("ign.com", 0.9), result("eurogamer.it", 0.8), result("polygon.com", 0.7),
+          result("kotaku.com", 0.95)]
+# La prima pagina ha una sola fonte valida: servono altre pagine
+SPARSE = [result("ign.com", 0.9), result("forum.net", 0.2), result("ign.com", 0.85),
+          result("eurogamer.it", 0.8), result("blog.org", 0.1), result("polygon.com", 0.7)]
+
+
+def test_collect_stops_when_first_page_suffices():
+    tavily = adapter(ENOUGH)
+    sources = tavily.collect("GTA 6")
+    assert [s["url"] for s in sources] == [r["url"] for r in ENOUGH[:3]]
+    assert len(tavily.client.calls) == 1
+
+
+def test_collect_widens_search_excluding_seen_domains():
+    tavily = adapter(SPARSE)
+    sources = tavily.collect("GTA 6")
+    assert [tavily._domain(s["url"]) for s in sources] == ["ign.com", "eurogamer.it", "polygon.com"]
+    assert len(tavily.client.calls) == 2
+    # Il secondo giro esclude anche i domini scartati per punteggio basso
+    assert set(tavily.client.calls[1]["exclude"]) == {"ign.com", "forum.net"}
+
+
+def test_collect_stops_when_no_new_domains():
+    tavily = adapter([result("ign.com", 0.9), result("ign.com", 0.8)])
+    assert len(tavily.collect("GTA 6")) == 1
+    assert len(tavily.client.calls) == 2
+    assert tavily.client.calls[1]["exclude"] == ["ign.com"]
+
+
+def test_collect_respects_max_pages():
+    pages = [result(f"sito{i}.com", 0.9 if i % 3 == 0 else 0.1) for i in range(12)]
+    tavily = adapter(pages, max_pages=2)
+    assert len(tavily.collect("GTA 6")) == 2
+    assert len(tavily.client.calls) == 2
+
+
+@pytest.mark.parametrize("results, pages", [(ENOUGH, 1), (SPARSE, 2)])
+def test_acollect_matches_collect(results, pages):
+    tavily = adapter(results)
+    sources = asyncio.run(tavily.acollect("Zelda"))
+    assert len(tavily.aclient.calls) == pages
+    # Stesse chiavi di cache: collect riusa le pagine già scaricate
+    assert tavily.collect("Zelda") == sources
+    assert tavily.client.calls == []
@@ -0,0 +1,138 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import topics
+from topics import TopicPool
+
+
+class FakeTrends:
+    def __init__(self, by_region):
+        self.by_region = by_region
+        self.calls = 0
+
+    def get_trending(self, country="italy", n=20):
+        self.calls += 1
+        return self.by_region.get(country, [])[:n]
+
+
+class FakeClassifier:
+    MIN_SCORE = 6
+
+    def __init__(self, scores):
+        self.scores = scores
+
+    def classify(self, terms):
+        return {t: self.scores[t] for t in terms if t in self.scores}
+
+
+class FakeArticles:
+    """``related`` come ArticleDB: similarità semantica per i temi in ``similar``."""
+
+    def __init__(self, similar=None, full_text=()):
+        self.similar = similar or {}
+        self.full_text = set(full_text)
+
+    def related(self, term, k=3):
+        if term in self.similar:
+            return [{"id": 1, "title": term, "similarity": self.similar[term]}]
+        return [{"id": 1, "title": term, "rank": 1.0}] if term in self.full_text else []
+
+
+TRENDS = {
+    "": ["GTA 6", "Meteo Roma", "Zelda", "Elden Ring"],
+    "italy": ["gta 6", "Serie A", "Mario Kart", "Hollow Knight"],
+}
+SCORES = {"GTA 6": 9, "Meteo Roma": 0, "Zelda": 8, "Elden Ring": 8, "Serie A": 1, "Mario Kart": 7,
+          "Hollow Knight": 9}
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.execute("CREATE TABLE articles (id INTEGER PRIMARY KEY, topic TEXT)")
+    return conn
+
+
+def pool(conn, articles=None, trends=None, **kwargs):
+    return TopicPool(trends or FakeTrends(TRENDS), FakeClassifier(SCORES), articles or FakeArticles(),
+                     conn, threading.Lock(), **kwargs)
+
+
+def test_refresh_ranks_gaming_topics_by_novelty(conn):
+    conn.execute("INSERT INTO articles(topic) VALUES ('zelda')")
+    articles = FakeArticles(similar={"Elden Ring": 0.95, "Hollow Knight": 0.5}, full_text={"Mario Kart"})
+
+    ranked = pool(conn, articles).refresh()
+    # Niente non-gaming, niente duplicati tra regioni, niente topic già pubblicati o quasi-duplicati
+    assert ranked == ["GTA 6", "Hollow Knight", "Mario Kart"]
+    novelty = dict(conn.execute("SELECT topic, novelty FROM topic_pool").fetchall())
+    assert novelty == {"GTA 6": 1.0, "Hollow Knight": 0.5, "Mario Kart": TopicPool.RELATED_PENALTY}
+
+
+def test_candidates_are_served_from_the_pool(conn):
+    trends = FakeTrends(TRENDS)
+    first = pool(conn, trends=trends)
+    assert first.candidates()[:2] == ["GTA 6", "Zelda"]
+    assert trends.calls == 2  # una richiesta per regione
+
+    # Un altro processo sullo stesso DB legge il pool senza scaricare niente
+    other_trends = FakeTrends(TRENDS)
+    assert pool(conn, trends=other_trends).candidates() == first.candidates()
+    assert other_trends.calls == 0 and trends.calls == 2
+
+
+def test_stale_pool_refreshes_in_background(conn, monkeypatch):
+    stale = pool(conn, interval=60)
+    stale.refresh()
+    started = []
+    monkeypatch.setattr(stale, "refresh_in_background", lambda: started.append(True))
+    now = time.time()
+    monkeypatch.setattr(topics.time, "time", lambda: now + 120)
+
+    assert stale.candidates()[0] == "GTA 6"  # il pool scaduto si serve comunque
+    assert started == [True]
+
+
+def test_empty_pool_is_not_refetched_at_every_call(conn):
+    trends = FakeTrends({})
+    empty = pool(conn, trends=trends)
+    assert empty.candidates() == [] and empty.candidates() == []
+    assert trends.calls == 2
+
+
+def test_claim_moves_topic_last_and_survives_refresh(conn):
+    first = pool(conn)
+    first.refresh()
+    first.claim("GTA 6")
+    assert first.candidates()[-1] == "GTA 6"
+
+    # Visibile agli altri worker e conservato dal prossimo aggiornamento
+    other = pool(conn)
+    assert other.candidates()[-1] == "GTA 6"
+    assert other.refresh(force=True)[-1] == "GTA 6"
+
+
+def test_claim_expires(conn, monkeypatch):
+    claimed = pool(conn)
+    claimed.refresh()
+    claimed.claim("GTA 6")
+    now = time.time()
+    monkeypatch.setattr(topics.time, "time", lambda: now + topics.CLAIM_TTL + 1)
+    claimed.refresh(force=True)
+    assert claimed.candidates()[0] == "GTA 6"
+
+
+def test_aclaim_runs_off_the_event_loop(conn, monkeypatch):
+    claimed = pool(conn)
+    claimed.refresh()
+    threads = []
+    claim = claimed.claim
+    monkeypatch.setattr(claimed, "claim", lambda topic: (threads.append(threading.get_ident()), claim(topic)))
+
+    asyncio.run(claimed.aclaim("GTA 6"))
+    assert threads and threads[0] != threading.get_ident()
+    assert claimed.candidates()[-1] == "GTA 6"
@@ -0,0 +1,227 @@
+# coding: utf-8
+"""
+Pool dei topic di tendenza
+==========================
+
+Scegliere un topic non deve costare due richieste a Google Trends (endpoint
+non ufficiale, facile da far bloccare) e una classificazione LLM per ogni
+articolo. ``TopicPool`` lo fa una volta ogni ``interval`` secondi per tutto
+il processo (e, tramite SQLite, per tutti i processi che condividono il DB):
+
+1. scarica le tendenze globali e italiane in parallelo;
+2. le classifica con il ``TopicClassifier`` (verdetti già in cache gratis);
+3. penalizza i temi già pubblicati in ``articles`` (stesso topic o articoli
+   vicini, semantici o full-text);
+4. salva in ``topic_pool`` la lista ordinata e deduplicata dei candidati.
+
+``candidates`` legge la lista dalla memoria (o da SQLite se un altro processo
+l'ha aggiornata) senza rete né LLM; se è scaduta la restituisce comunque e
+avvia l'aggiornamento in background. Solo al primo avvio, a pool vuoto,
+l'aggiornamento è sincrono. ``claim`` manda in fondo alla lista il topic
+scelto, così i worker in parallelo non scrivono due articoli sullo stesso
+tema finché ce ne sono altri da proporre.
+"""
+
+from __future__ import annotations
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+TOPIC_REFRESH = float(os.environ.get("TOPIC_REFRESH", 1800))  # secondi di validità del pool
+CLAIM_TTL = 6 * 3600.0   # per quanto un topic scelto resta in fondo al pool
+REGIONS = ("", "italy")  # "" = tendenze globali
+
+
+def _key(term: str) -> str:
+    """Chiave di deduplica: minuscole e spazi normalizzati (come i verdetti del classificatore)."""
+    return " ".join(term.lower().split())
+
+
+class TopicPool:
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS topic_pool (
+            term TEXT PRIMARY KEY,
+            topic TEXT NOT NULL,
+            score REAL NOT NULL,
+            gaming INTEGER NOT NULL,
+            novelty REAL NOT NULL,
+            refreshed_at REAL NOT NULL,
+            claimed_at REAL
+        )""",
+        "CREATE INDEX IF NOT EXISTS topic_pool_score ON topic_pool(score DESC)",
+    )
+    RELATED_PENALTY = 0.6     # novelty di un tema con articoli vicini (full-text)
+    DUPLICATE_SIMILARITY = 0.92
+
+    def __init__(self, trends: Any, classifier: Any, articles: Any, conn: sqlite3.Connection,
+                 lock: threading.Lock, interval: float = TOPIC_REFRESH, size: int = 10,
+                 per_region: int = 30, regions: Sequence[str] = REGIONS):
+        self.trends = trends
+        self.classifier = classifier
+        self.articles = articles
+        self.conn = conn
+        self.lock = lock
+        self.interval = interval
+        self.size = size
+        self.per_region = per_region
+        self.regions = tuple(regions)
+        self._refreshing = threading.Lock()
+        self._ranked: List[str] = []
+        self._loaded_at = 0.0
+        self._last_refresh = 0.0  # anche un pool vuoto conta come aggiornato
+        self._stop = threading.Event()
+        with self.lock, self.conn:
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
+
+    # --- lettura --------------------------------------------------------------
+    def _refreshed_at(self) -> float:
+        with self.lock:
+            row = self.conn.execute("SELECT MAX(refreshed_at) FROM topic_pool").fetchone()
+        return max(row[0] or 0.0, self._last_refresh)
+
+    def _load(self) -> None:
+        since = time.time() - CLAIM_TTL
+        with self.lock:
+            # I topic scelti di recente non spariscono: con più thread che topic si riusano per ultimi
+            rows = self.conn.execute(
+                "SELECT topic FROM topic_pool "
+                "ORDER BY COALESCE(claimed_at >= ?, 0), score DESC LIMIT ?",
+                (since, self.size)
+            ).fetchall()
+        self._ranked = [r[0] for r in rows]
+        self._loaded_at = time.time()
+
+    def candidates(self) -> List[str]:
+        """Topic gaming ordinati, dal pool; l'eventuale aggiornamento parte in background."""
+        if not self._ranked or time.time() - self._loaded_at > self.interval:
+            # Un altro processo può aver già aggiornato il pool: si rilegge prima di scaricare
+            self._load()
+        if not self._ranked:
+            self.refresh()  # primo avvio: niente da servire, si aspetta
+        elif time.time() - self._refreshed_at() > self.interval:
+            self.refresh_in_background()
+        return list(self._ranked)
+
+    async def acandidates(self) -> List[str]:
+        return await asyncio.to_thread(self.candidates)
+
+    def claim(self, topic: str) -> None:
+        """Sposta ``topic`` in fondo ai candidati per ``CLAIM_TTL`` (scelto da un thread)."""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE topic_pool SET claimed_at = ? WHERE term = ?",
+                              (time.time(), _key(topic)))
+        if topic in self._ranked:
+            self._ranked = [t for t in self._ranked if t != topic] + [topic]
+
+    async def aclaim(self, topic: str) -> None:
+        # L'attesa sul lock di SQLite non deve fermare il loop (e l'AsyncSqliteSaver)
+        await asyncio.to_thread(self.claim, topic)
+
+    # --- aggiornamento ----------------------------------------------------------
+    def _fetch(self) -> List[str]:
+        with ThreadPoolExecutor(max_workers=len(self.regions)) as pool:
+            lists = list(pool.map(lambda region: self.trends.get_trending(country=region, n=self.per_region),
+                                  self.regions))
+        # Stesso termine in più regioni (o con maiuscole diverse): tiene la prima occorrenza
+        seen: Dict[str, str] = {}
+        for term in (t for terms in lists for t in terms):
+            seen.setdefault(_key(term), term)
+        return list(seen.values())
+
+    def _published(self) -> set:
+        with self.lock:
+            rows = self.conn.execute("SELECT DISTINCT topic FROM articles WHERE topic IS NOT NULL").fetchall()
+        return {_key(r[0]) for r in rows}
+
+    def _novelty(self, term: str, published: set) -> float:
+        if _key(term) in published:
+            return 0.0
+        related = self.articles.related(term, k=1)
+        if not related:
+            return 1.0
+        if "similarity" in related[0]:
+            return max(0.0, 1.0 - related[0]["similarity"])
+        return self.RELATED_PENALTY
+
+    def _score(self, terms: List[str]) -> List[Tuple[str, float, int, float]]:
+        scores = self.classifier.classify(terms)
+        published = self._published()
+        ranked = []
+        for position, term in enumerate(terms):
+            gaming = scores.get(term, 0)
+            if gaming < self.classifier.MIN_SCORE:
+                continue
+            novelty = self._novelty(term, published)
+            if novelty <= 1.0 - self.DUPLICATE_SIMILARITY:
+                continue
+            # Pertinenza gaming × novità, con un leggero vantaggio ai termini più in alto nei trends
+            trend_weight = 1.0 - 0.2 * position / max(len(terms), 1)
+            ranked.append((term, gaming / 10 * novelty * trend_weight, gaming, novelty))
+        return sorted(ranked, key=lambda r: -r[1])
+
+    def refresh(self, force: bool = False) -> List[str]:
+        """Scarica, classifica e salva il pool; una sola esecuzione alla volta per processo."""
+        if not self._refreshing.acquire(blocking=False):
+            # Aggiornamento già in corso in un altro thread: si attende quello
+            with self._refreshing:
+                pass
+            self._load()
+            return list(self._ranked)
+        try:
+            if not force and time.time() - self._refreshed_at() <= self.interval:
+                self._load()  # già aggiornato (da questo o da un altro processo)
+                return list(self._ranked)
+            ranked = self._score(self._fetch())
+            now = time.time()
+            with self.lock, self.conn:
+                # I topic già scelti restano segnati anche dopo l'aggiornamento
+                claimed = dict(self.conn.execute(
+                    "SELECT term, claimed_at FROM topic_pool WHERE claimed_at IS NOT NULL"
+                ).fetchall())
+                self.conn.execute("DELETE FROM topic_pool")
+                self.conn.executemany(
+                    "INSERT INTO topic_pool(term, topic, score, gaming, novelty, refreshed_at, claimed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(_key(t), t, score, gaming, novelty, now,
+                      claimed.get(_key(t)))
+                     for t, score, gaming, novelty in ranked]
+                )
+            self._last_refresh = now
+            self._load()
+            print(f"[INFO] Pool topic aggiornato: {self._ranked}")
+            return list(self._ranked)
+        finally:
+            self._refreshing.release()
+
+    def refresh_in_background(self) -> None:
+        if self._refreshing.locked():
+            return
+        def run() -> None:
+            try:
+                self.refresh()
+            except Exception as e:  # il pool precedente resta valido
+                print(f"[WARN] Aggiornamento pool topic non riuscito: {e}")
+        threading.Thread(target=run, name="topic-pool-refresh", daemon=True).start()
+
+    def start_background(self, interval: Optional[float] = None) -> threading.Thread:
+        """Aggiorna il pool periodicamente in un thread daemon (batch e worker)."""
+        interval = interval or self.interval
+        def loop() -> None:
+            while True:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"[WARN] Aggiornamento pool topic non riuscito: {e}")
+                if self._stop.wait(interval):
+                    return
+        thread = threading.Thread(target=loop, name="topic-pool", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self._stop.set()